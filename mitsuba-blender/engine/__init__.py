@@ -28,6 +28,8 @@ def register():
 def unregister():
     from . import properties
     properties.unregister()
+    for engine in list(MitsubaRenderEngine.instances):
+        engine.free_persistent_scene()
     bpy.utils.unregister_class(MitsubaRenderEngine)
     for panel in get_panels():
         if 'MITSUBA' in panel.COMPAT_ENGINES:
@@ -0,0 +1,71 @@
+import numpy as np
+
+def film_passes(channel_names):
+    '''
+    Group the channels of a Mitsuba film into blender render passes, like Bitmap.split() does.
+    The channels of the root image (e.g. 'R', 'G', 'B') go to the 'Main' pass, the others
+    are grouped by AOV name (e.g. 'albedo.R', 'albedo.G', 'albedo.B').
+
+    Params
+    ------
+    channel_names: Names of the film channels, in storage order
+
+    Returns a list of (pass name, slice of the film channels, channel ids) tuples.
+    '''
+    passes = []
+    for i, name in enumerate(channel_names):
+        prefix, _, channel_id = name.rpartition('.')
+        pass_name = prefix or 'Main'
+        if passes and passes[-1][0] == pass_name:
+            passes[-1][1] = slice(passes[-1][1].start, i + 1)
+            passes[-1][2] += channel_id
+        else:
+            passes.append([pass_name, slice(i, i + 1), channel_id])
+    return [tuple(p) for p in passes]
+
+def pass_channel_count(film_channel_count):
+    # Blender has no 2 channel passes, a dummy third channel is added
+    return 3 if film_channel_count == 2 else film_channel_count
+
+def allocate_pass_buffer(width, height, film_channel_count):
+    '''
+    Buffer holding the pixels of one render pass, in the layout of RenderPass.rect.
+    '''
+    return np.zeros((height, width, pass_channel_count(film_channel_count)), dtype=np.float32)
+
+def accumulate(pixels, spp, accumulation=None):
+    '''
+    Add the film values of a pass, weighted by its sample count, to the accumulation buffer.
+    The pixels are scaled in place, so that no temporary of the size of the film is allocated:
+    they must be a writable array that isn't used afterwards, e.g. a view of the film's bitmap.
+
+    Params
+    ------
+    pixels: (height, width, channels) float32 film values of the pass
+    spp: Sample count of the pass
+    accumulation: Accumulation buffer, allocated if None
+
+    Returns the accumulation buffer.
+    '''
+    if accumulation is None:
+        return np.multiply(pixels, np.float32(spp), dtype=np.float32)
+    if spp != 1:
+        np.multiply(pixels, np.float32(spp), out=pixels)
+    np.add(accumulation, pixels, out=accumulation)
+    return accumulation
+
+def write_pass(accumulation, channels, rendered_spp, buffer):
+    '''
+    Average the accumulated film values of a pass into its preallocated buffer.
+    Mitsuba stores the top row first, and blender the bottom one: reading through a flipped view
+    of the accumulation buffer writes the result in a single pass, without intermediate copies.
+
+    Params
+    ------
+    accumulation: (height, width, channels) sum of the film values, weighted by sample count
+    channels: Slice of the channels of the pass in the accumulation buffer
+    rendered_spp: Total sample count of the accumulated passes
+    buffer: Output buffer, from allocate_pass_buffer
+    '''
+    source = accumulation[::-1, :, channels]
+    np.multiply(source, np.float32(1.0 / rendered_spp), out=buffer[..., :source.shape[2]])
@@ -1,8 +1,10 @@
+import weakref
+
 import bpy
-import tempfile
-import os
 import numpy as np
-from ..io.exporter import SceneConverter
+from . import film
+from .scene_sync import SceneSync
+from .viewport import ViewportSession, MitsubaDrawData
 
 class MitsubaRenderEngine(bpy.types.RenderEngine):
 
@@ -10,18 +12,32 @@ class MitsubaRenderEngine(bpy.types.RenderEngine):
     bl_label = "Mitsuba"
     bl_use_preview = False
 
+    # Engines holding a persistent scene, freed on unregister
+    instances = weakref.WeakSet()
+
     # Init is called whenever a new render engine instance is created. Multiple
     # instances may exist at the same time, for example for a viewport and final
     # render.
     def __init__(self):
         self.scene_data = None
         self.draw_data = None
-        self.converter = SceneConverter(render=True)
+        self.viewport = None
+        # Scene kept loaded between final renders, when the scene uses persistent data.
+        # Blender keeps the engine instance alive between those renders.
+        self.persistent_scene = None
 
     # When the render engine instance is destroy, this is called. Clean up any
     # render engine data here, for example stopping running render threads.
     def __del__(self):
-        pass
+        if getattr(self, 'viewport', None) is not None:
+            self.viewport.free()
+            self.viewport = None
+        self.free_persistent_scene()
+
+    def free_persistent_scene(self):
+        if getattr(self, 'persistent_scene', None) is not None:
+            self.persistent_scene.free()
+            self.persistent_scene = None
 
     # This is the method called by Blender for both final renders (F12) and
     # small preview for materials, world and lights.
@@ -29,40 +45,127 @@ class MitsubaRenderEngine(bpy.types.RenderEngine):
         from mitsuba import set_variant
         b_scene = depsgraph.scene
         set_variant(b_scene.mitsuba.variant)
-        from mitsuba import ScopedSetThreadEnvironment, Thread
+        from mitsuba import ScopedSetThreadEnvironment
         with ScopedSetThreadEnvironment(b_scene.thread_env):
             scale = b_scene.render.resolution_percentage / 100.0
             self.size_x = int(b_scene.render.resolution_x * scale)
             self.size_y = int(b_scene.render.resolution_y * scale)
 
-            # Temporary workaround as long as the dict creation writes stuff to dict
-            with tempfile.TemporaryDirectory() as dummy_dir:
-                filepath = os.path.join(dummy_dir, "scene.xml")
-                self.converter.set_path(filepath)
-                self.converter.scene_to_dict(depsgraph)
-                Thread.thread().file_resolver().prepend(dummy_dir)
-                mts_scene = self.converter.dict_to_scene()
-
-            sensor = mts_scene.sensors()[0]
-            mts_scene.integrator().render(mts_scene, sensor)
-            render_results = sensor.film().bitmap().split()
-
-            for result in render_results:
-                buf_name = result[0].replace("<root>", "Main")
-                channel_count = result[1].channel_count() if result[1].channel_count() != 2 else 3
-
-                self.add_pass(buf_name, channel_count, ''.join([f.name.split('.')[-1] for f in result[1].struct_()]))
-
-            blender_result = self.begin_result(0, 0, self.size_x, self.size_y)
-
-            for result in render_results:
-                render_pixels = np.array(result[1])
-                if result[1].channel_count() == 2:
-                    # Add a dummy third channel
-                    render_pixels = np.dstack((render_pixels, np.zeros((*render_pixels.shape[:2], 1))))
-                #render_pixels = np.array(render.convert(Bitmap.PixelFormat.RGBA, Struct.Type.Float32, srgb_gamma=False))
-                # Here we write the pixel values to the RenderResult
-                buf_name = result[0].replace("<root>", "Main")
-                layer = blender_result.layers[0].passes[buf_name]
-                layer.rect = np.flip(render_pixels, 0).reshape((self.size_x*self.size_y, -1))
-            self.end_result(blender_result)
+            scene_sync = self.final_scene(depsgraph)
+            try:
+                self.render_scene(b_scene, scene_sync.mts_scene)
+            finally:
+                if scene_sync is not self.persistent_scene:
+                    scene_sync.free()
+
+    def final_scene(self, depsgraph):
+        '''
+        Load the scene to render. With persistent data, the scene of the previous render is
+        updated with the changes since then, and only rebuilt if they can't be applied as parameter updates.
+        '''
+        if not depsgraph.scene.render.use_persistent_data:
+            self.free_persistent_scene()
+            scene_sync = SceneSync()
+            scene_sync.build(depsgraph)
+            return scene_sync
+
+        if self.persistent_scene is None:
+            self.persistent_scene = SceneSync()
+            MitsubaRenderEngine.instances.add(self)
+        scene_sync = self.persistent_scene
+        if scene_sync.sync(depsgraph):
+            self.update_stats("", "Updated the loaded scene")
+        else:
+            self.update_stats("", "Loading the scene")
+            scene_sync.build(depsgraph)
+        return scene_sync
+
+    def render_scene(self, b_scene, mts_scene):
+        sensor = mts_scene.sensors()[0]
+        total_spp = sensor.sampler().sample_count()
+        if b_scene.mitsuba.progressive:
+            pass_spp = min(b_scene.mitsuba.samples_per_pass, total_spp)
+        else:
+            pass_spp = total_spp
+
+        # Render the first pass, which tells which AOVs the film outputs
+        accumulation, channel_names = self.render_pass(mts_scene, sensor, 0, pass_spp)
+        rendered_spp = pass_spp
+        passes = film.film_passes(channel_names)
+
+        for pass_name, channels, channel_ids in passes:
+            channel_count = film.pass_channel_count(channels.stop - channels.start)
+            self.add_pass(pass_name, channel_count, channel_ids)
+
+        blender_result = self.begin_result(0, 0, self.size_x, self.size_y)
+        # One buffer per pass, reused for every progressive update
+        buffers = [film.allocate_pass_buffer(self.size_x, self.size_y, channels.stop - channels.start) for _, channels, _ in passes]
+        self.write_results(blender_result, passes, buffers, accumulation, rendered_spp)
+
+        # Accumulate passes with different seeds until the sample count is reached or the render is cancelled
+        seed = 1
+        while rendered_spp < total_spp and not self.test_break():
+            self.update_result(blender_result)
+            self.update_progress(rendered_spp / total_spp)
+            spp = min(pass_spp, total_spp - rendered_spp)
+            self.render_pass(mts_scene, sensor, seed, spp, accumulation)
+            rendered_spp += spp
+            seed += 1
+            self.write_results(blender_result, passes, buffers, accumulation, rendered_spp)
+
+        self.end_result(blender_result)
+
+    # For viewport renders, this method gets called once at the start and
+    # whenever the scene or 3D viewport changes. This method is where data
+    # should be read from Blender in the same thread.
+    def view_update(self, context, depsgraph):
+        from mitsuba import set_variant, ScopedSetThreadEnvironment
+        b_scene = depsgraph.scene
+        set_variant(b_scene.mitsuba.variant)
+        with ScopedSetThreadEnvironment(b_scene.thread_env):
+            if self.viewport is None:
+                self.viewport = ViewportSession(self)
+                updates = None
+            else:
+                updates = {(update.id.original.id_type, update.id.original.name_full) for update in depsgraph.updates}
+            self.viewport.update(depsgraph, updates)
+
+    # For viewport renders, this method is called whenever Blender redraws
+    # the 3D viewport. The renderer is expected to quickly draw the render
+    # with OpenGL, and not perform other expensive work.
+    def view_draw(self, context, depsgraph):
+        from mitsuba import ScopedSetThreadEnvironment
+        import gpu
+        b_scene = depsgraph.scene
+        with ScopedSetThreadEnvironment(b_scene.thread_env):
+            self.viewport.update_view(context, depsgraph)
+        pixels, version = self.viewport.latest_pixels()
+        if pixels is None:
+            return
+        if self.draw_data is None or self.draw_data.version != version:
+            self.draw_data = MitsubaDrawData(pixels, version)
+
+        gpu.state.blend_set('ALPHA_PREMULT')
+        self.bind_display_space_shader(b_scene)
+        self.draw_data.draw((context.region.width, context.region.height))
+        self.unbind_display_space_shader()
+        gpu.state.blend_set('NONE')
+
+    def render_pass(self, mts_scene, sensor, seed, spp, accumulation=None):
+        '''
+        Render a pass with the given seed and sample count, and add the film values weighted
+        by the sample count to the accumulation buffer. The buffer is allocated if not given.
+        Returns the accumulation buffer and the names of the film channels.
+        '''
+        mts_scene.integrator().render(mts_scene, sensor, seed=seed, spp=spp)
+        bitmap = sensor.film().bitmap()
+        # A view of the bitmap, which is only used for this pass
+        pixels = np.asarray(bitmap, dtype=np.float32)
+        accumulation = film.accumulate(pixels, spp, accumulation)
+        return accumulation, [f.name for f in bitmap.struct_()]
+
+    def write_results(self, blender_result, passes, buffers, accumulation, rendered_spp):
+        for (pass_name, channels, _), buffer in zip(passes, buffers):
+            film.write_pass(accumulation, channels, rendered_spp, buffer)
+            # Bulk copy of the buffer, without converting it to a list of pixels
+            blender_result.layers[0].passes[pass_name].rect.foreach_set(buffer.ravel())
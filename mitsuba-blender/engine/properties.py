@@ -282,6 +282,34 @@ class MitsubaRenderSettings(PropertyGroup):
         default = default_variant
     )
     # TODO: break variant into its subcomponents (backend/color/polarization/precision)
+
+    progressive : BoolProperty(
+        name = "Progressive",
+        description = "Render in successive passes, showing intermediate results and allowing to cancel the render between passes",
+        default = True
+    )
+
+    samples_per_pass : IntProperty(
+        name = "Samples per Pass",
+        description = "Number of samples per pixel rendered in each progressive pass",
+        default = 16,
+        min = 1
+    )
+
+    viewport_samples : IntProperty(
+        name = "Viewport Samples",
+        description = "Number of samples per pixel accumulated in the viewport",
+        default = 64,
+        min = 1
+    )
+
+    viewport_resolution_scale : FloatProperty(
+        name = "Viewport Resolution Scale",
+        description = "Resolution of the viewport render, relative to the size of the viewport",
+        default = 0.5,
+        min = 0.1,
+        max = 1.0
+    )
     enum_integrators = [(name, integrator['label'], integrator['description']) for name, integrator in integrator_data.items()]
 
     active_integrator : EnumProperty(
@@ -429,6 +457,13 @@ def draw_device(self, context):
 
         col = layout.column()
         col.prop(mts_settings, "variant")
+        col.prop(mts_settings, "progressive")
+        sub = col.column()
+        sub.active = mts_settings.progressive
+        sub.prop(mts_settings, "samples_per_pass")
+        col.prop(mts_settings, "viewport_samples")
+        col.prop(mts_settings, "viewport_resolution_scale")
+        col.prop(scene.render, "use_persistent_data", text="Persistent Data")
 
 def register():
     bpy.types.RENDER_PT_context.append(draw_device)
@@ -0,0 +1,349 @@
+import os
+import shutil
+import tempfile
+from collections import Counter
+
+import numpy as np
+import bpy
+
+from ..io.exporter import SceneConverter, geometry, materials, lights, camera
+from ..io.exporter.export_context import ExportContext
+from ..io.exporter.incremental import ExportManifest, tracker
+
+# Sensor plugins exported for blender cameras
+sensor_types = {'perspective', 'thinlens', 'orthographic'}
+
+# Child plugins and parameters whose name in traverse() differs from their name in the scene dict
+param_aliases = {
+    ('twosided', 'bsdf'): 'brdf_0',
+    ('perspective', 'fov'): 'x_fov',
+}
+
+# Datablocks whose changes can't be mapped on parameters of the loaded scene
+rebuild_id_types = {'IMAGE', 'NODETREE', 'TEXTURE'}
+
+class SceneSync:
+    '''
+    Keep a Mitsuba scene loaded between renders, and apply blender changes to it
+    through the parameters exposed by traverse(): mesh vertices (edits and transforms),
+    material, light and world values, and the camera. Changes that can't be expressed
+    as parameter updates (new objects, topology, textures...) require a rebuild.
+    '''
+    def __init__(self):
+        # Textures are still written to disk while creating the dict
+        self.directory = tempfile.mkdtemp(prefix='mitsuba-blender-')
+        self.converter = None
+        self.mts_scene = None
+        self.params = None
+        self.sensor_dict = None
+        self.integrator = None
+        self.objects = None
+        self.instance_matrices = None
+        self.variant = None
+        self.session = None # Update tracker session and tick of the last sync
+        self.tick = 0
+        self.rebuild_count = 0
+        self.update_count = 0
+
+    def free(self):
+        self.mts_scene = None
+        self.params = None
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def build(self, depsgraph, sensor_dict=None):
+        '''
+        Export the whole scene and load it.
+
+        Params
+        ------
+        depsgraph: The evaluated dependency graph
+        sensor_dict: Sensor replacing the scene camera, e.g. for the viewport
+        '''
+        from mitsuba import Thread, traverse, variant
+        converter = SceneConverter(render=True)
+        # Named entries can be matched with the parameters of the loaded scene
+        converter.export_ctx.export_ids = True
+        converter.export_ctx.manifest = ExportManifest(None, {})
+        converter.set_path(os.path.join(self.directory, "scene.xml"))
+        file_resolver = Thread.thread().file_resolver()
+        if self.directory not in [file_resolver[i] for i in range(len(file_resolver))]:
+            file_resolver.prepend(self.directory)
+        converter.scene_to_dict(depsgraph)
+
+        if sensor_dict is not None:
+            scene_data = converter.export_ctx.scene_data
+            for key in [key for key, value in scene_data.items() if isinstance(value, dict) and value.get('type') in sensor_types]:
+                del scene_data[key]
+            converter.export_ctx.data_add(sensor_dict, name='viewport-camera')
+
+        self.mts_scene = converter.dict_to_scene()
+        self.params = traverse(self.mts_scene)
+        self.converter = converter
+        self.sensor_dict = sensor_dict
+        self.integrator = converter.integrator_dict(depsgraph.scene)
+        self.objects, self.instance_matrices = self.scene_objects(depsgraph)
+        self.variant = variant()
+        self.session, self.tick = tracker.session, tracker.tick
+        self.rebuild_count += 1
+
+    @staticmethod
+    def scene_objects(depsgraph):
+        '''
+        Return the set of rendered objects and the world matrices of all instances,
+        to detect objects being added, removed or instanced differently.
+        '''
+        objects = set()
+        instance_matrices = []
+        for instance in depsgraph.object_instances:
+            b_object = instance.object
+            if b_object.hide_render:
+                continue
+            objects.add((b_object.name_full, b_object.type, instance.is_instance))
+            if instance.is_instance:
+                instance_matrices.append([x for row in instance.matrix_world for x in row])
+        return objects, np.array(instance_matrices, dtype=np.float32)
+
+    def sync(self, depsgraph, updates=None):
+        '''
+        Apply the changes of the blender scene to the loaded Mitsuba scene.
+        Returns False if they can't be applied, in which case the scene should be rebuilt.
+
+        Params
+        ------
+        depsgraph: The evaluated dependency graph
+        updates: Set of (id_type, name) of the datablocks that changed, or None to compare everything
+        '''
+        from mitsuba import variant
+        if self.mts_scene is None or self.variant != variant():
+            return False
+        if updates is None:
+            # Datablocks that can't be compared are tracked through depsgraph updates
+            if self.session != tracker.session:
+                return False
+            updated_types = {id_type for (id_type, _), tick in tracker.updates.items() if tick > self.tick}
+            if updated_types & rebuild_id_types:
+                return False
+        elif any(id_type in rebuild_id_types for id_type, _ in updates):
+            return False
+        self.tick = tracker.tick
+        objects, instance_matrices = self.scene_objects(depsgraph)
+        if objects != self.objects or not np.array_equal(instance_matrices, self.instance_matrices):
+            return False
+
+        b_scene = depsgraph.scene
+        if (updates is None or ('SCENE', b_scene.name_full) in updates) and self.converter.integrator_dict(b_scene) != self.integrator:
+            return False
+
+        export_ctx = self.scratch_context(depsgraph)
+        changes = []
+        if b_scene.world is not None and (updates is None or ('WORLD', b_scene.world.name_full) in updates):
+            materials.export_world(export_ctx, b_scene.world, self.converter.ignore_background)
+            if ('World' in export_ctx.scene_data) != ('World' in self.converter.export_ctx.scene_data):
+                return False
+
+        for instance in depsgraph.object_instances:
+            b_object = instance.object
+            if instance.is_instance or b_object.hide_render:
+                continue
+            if updates is not None and not self.object_changed(b_object, updates):
+                continue
+            if b_object.type in {'MESH', 'FONT', 'SURFACE', 'META'}:
+                mesh_changes = self.mesh_changes(export_ctx, b_object)
+                if mesh_changes is None:
+                    return False
+                changes += mesh_changes
+            elif b_object.type == 'LIGHT':
+                lights.export_light(instance, export_ctx)
+            elif b_object.type == 'CAMERA' and self.sensor_dict is None and b_object.name_full == b_scene.camera.name_full:
+                camera.export_camera(instance, b_scene, export_ctx)
+
+        material_ids = self.converter.export_ctx.material_ids
+        shared_ids = {mat_id for mat_id, count in Counter(material_ids.values()).items() if count > 1}
+        for b_material in bpy.data.materials:
+            mat_id = material_ids.get(b_material.name)
+            if mat_id is None:
+                continue
+            if updates is None or ('MATERIAL', b_material.name_full) in updates:
+                if mat_id in shared_ids:
+                    # Identical materials share their BSDF, it can't be updated for only one of them
+                    if self.converter.export_ctx.material_cache.get(materials.material_key(b_material)) != mat_id:
+                        return False
+                    continue
+                materials.export_material(export_ctx, b_material)
+                old_emitter = self.converter.export_ctx.exported_mats.mats.get(mat_id, {}).get('emitter')
+                if export_ctx.exported_mats.mats.get(mat_id, {}).get('emitter') != old_emitter:
+                    return False # Emitters of mixed materials are nested in each shape
+
+        for key, new_dict in export_ctx.scene_data.items():
+            if key == 'type' or key.startswith('elm__'):
+                continue
+            old_dict = self.converter.export_ctx.data_dict(key)
+            if old_dict is None:
+                return False
+            dict_changes = self.dict_changes(key, old_dict, new_dict)
+            if dict_changes is None:
+                return False
+            changes += dict_changes
+
+        if changes:
+            self.apply(changes)
+            # Later syncs compare against the new values
+            for key, new_dict in export_ctx.scene_data.items():
+                if key in self.converter.export_ctx.loaded_dicts:
+                    self.converter.export_ctx.loaded_dicts[key] = new_dict
+                elif key != 'type' and not key.startswith('elm__'):
+                    self.converter.export_ctx.scene_data[key] = new_dict
+        return True
+
+    def scratch_context(self, depsgraph):
+        '''
+        Export context to convert changed datablocks again, without touching the loaded scene dict.
+        '''
+        loaded_ctx = self.converter.export_ctx
+        export_ctx = ExportContext()
+        export_ctx.export_ids = True
+        export_ctx.keep_meshes_in_memory = True
+        export_ctx.axis_mat = loaded_ctx.axis_mat
+        export_ctx.directory = loaded_ctx.directory
+        export_ctx.deg = depsgraph
+        # Textures did not change, or the scene would be rebuilt
+        export_ctx.exported_textures = dict(loaded_ctx.exported_textures)
+        return export_ctx
+
+    @staticmethod
+    def object_changed(b_object, updates):
+        if ('OBJECT', b_object.name_full) in updates:
+            return True
+        data = b_object.data
+        return data is not None and (data.id_type, data.name_full) in updates
+
+    def mesh_changes(self, export_ctx, b_object):
+        '''
+        Compute the vertex buffer updates of a mesh object, or None if its topology,
+        materials or shading changed.
+        '''
+        name_clean = bpy.path.clean_name(b_object.name_full)
+        entry = self.converter.export_ctx.manifest.objects.get(f"mesh-{name_clean}")
+        local_entry = self.converter.export_ctx.manifest.objects.get(f"mesh-{name_clean}-local")
+        if entry is None and local_entry is None:
+            return None
+
+        if b_object.type == 'MESH':
+            b_mesh = b_object.data
+        else: # Metaballs, text, surfaces
+            b_mesh = b_object.to_mesh()
+        try:
+            transform = export_ctx.world_matrix(b_object) if entry is not None else None
+            mesh_buffers = geometry.MeshBuffers(export_ctx, b_mesh, transform, name_clean, len(b_mesh.materials))
+            digest = mesh_buffers.digest()
+            if digest == (entry or local_entry)['digest']:
+                return [] # e.g. selection changes
+            if entry is None:
+                return None # Instanced meshes are shared by several shapes
+            materials_now = [b_mesh.materials[part['mat_nr']].name if part['mat_nr'] >= 0 else None for part in entry['parts']]
+            if materials_now != [part.get('material') for part in entry['parts']]:
+                return None
+            if set(mesh_buffers.used_materials()) != {max(part['mat_nr'], 0) for part in entry['parts']}:
+                return None
+
+            changes = []
+            for part in entry['parts']:
+                part_nr = max(part['mat_nr'], 0)
+                if part['face_normals'] == mesh_buffers.has_smooth_faces(part_nr):
+                    return None
+                mesh_part = mesh_buffers.build_part(part_nr, part['name'])
+                prefix = f"mesh-{part['name']}"
+                buffers = {
+                    'vertex_positions': mesh_part.positions,
+                    'faces': mesh_part.faces,
+                    'vertex_normals': mesh_part.normals,
+                    'vertex_texcoords': mesh_part.uvs
+                }
+                buffers.update(mesh_part.attributes)
+                for buffer_name, values in buffers.items():
+                    key = f"{prefix}.{buffer_name}"
+                    if key not in self.params:
+                        return None
+                    size = 0 if values is None else values.size
+                    if len(self.params[key]) != size:
+                        return None # Different topology
+                    if values is not None:
+                        changes.append((key, values.ravel()))
+            entry['digest'] = digest
+            return changes
+        finally:
+            if b_object.type != 'MESH':
+                b_object.to_mesh_clear()
+
+    def dict_changes(self, prefix, old_dict, new_dict):
+        '''
+        Compare two versions of a plugin dict and map the differences on traverse() parameters.
+        Returns None if the plugins differ in a way parameters can't express.
+        '''
+        if old_dict.keys() != new_dict.keys() or old_dict.get('type') != new_dict.get('type'):
+            return None
+        changes = []
+        plugin_type = new_dict.get('type')
+        for name, new_value in new_dict.items():
+            old_value = old_dict[name]
+            if self.same_value(old_value, new_value):
+                continue
+            key = f"{prefix}.{param_aliases.get((plugin_type, name), name)}"
+            if plugin_type == 'perspective' and name == 'fov' and new_dict.get('fov_axis', 'x') != 'x':
+                return None
+            if isinstance(new_value, dict):
+                if not isinstance(old_value, dict):
+                    return None
+                if new_value.get('type') == 'rgb' and old_value.get('type') == 'rgb':
+                    key += '.value'
+                    new_value = new_value['value']
+                else:
+                    nested_changes = self.dict_changes(key, old_value, new_value)
+                    if nested_changes is None:
+                        return None
+                    changes += nested_changes
+                    continue
+            elif isinstance(new_value, str) or isinstance(new_value, bool):
+                return None
+            if key not in self.params and f"{key}.value" in self.params:
+                key += '.value' # Float parameters are often textures
+            if key not in self.params:
+                return None
+            changes.append((key, new_value))
+        return changes
+
+    @staticmethod
+    def same_value(a, b):
+        if hasattr(a, 'matrix') and hasattr(b, 'matrix'): # Transforms
+            return np.array_equal(np.array(a.matrix), np.array(b.matrix))
+        return a == b
+
+    def apply(self, changes):
+        for key, value in changes:
+            current = self.params[key]
+            if isinstance(value, np.ndarray):
+                self.params[key] = value
+            else:
+                self.params[key] = type(current)(value)
+        self.params.update()
+        self.update_count += 1
+
+    def set_sensor(self, sensor_dict):
+        '''
+        Update the custom sensor of the loaded scene. Returns False if it requires a rebuild.
+        '''
+        if self.mts_scene is None or self.sensor_dict is None:
+            return False
+        old_film, new_film = self.sensor_dict['film'], sensor_dict['film']
+        changes = []
+        if (old_film['width'], old_film['height']) != (new_film['width'], new_film['height']):
+            size = [new_film['width'], new_film['height']]
+            changes += [('viewport-camera.film.size', size), ('viewport-camera.film.crop_size', size)]
+        sensor_changes = self.dict_changes('viewport-camera', {**self.sensor_dict, 'film': new_film}, sensor_dict)
+        if sensor_changes is None:
+            return False
+        changes += sensor_changes
+        if changes:
+            self.apply(changes)
+        self.sensor_dict = sensor_dict
+        return True
@@ -0,0 +1,207 @@
+import weakref
+import threading
+from math import atan, degrees
+
+import numpy as np
+import bpy
+import gpu
+from gpu_extras.presets import draw_texture_2d
+from mathutils import Matrix
+
+from .scene_sync import SceneSync
+
+class ViewportSession:
+    '''
+    Interactive rendering of the 3D viewport.
+    The scene stays loaded between redraws, and is rendered in low sample count passes
+    on a background thread. Blender updates are applied to the loaded scene in between passes.
+    The render thread doesn't call into Blender: a timer on the main thread redraws the
+    viewport when a new image is available.
+    '''
+    redraw_interval = 0.05 # Seconds between checks for a new image
+
+    def __init__(self, engine):
+        # The redraw timer keeps the session alive, it must not keep the engine alive too
+        self.engine = weakref.ref(engine)
+        self.scene_sync = SceneSync()
+        self.view = None # Sensor dict of the last drawn view
+        self.lock = threading.Lock() # Protects the loaded scene
+        self.condition = threading.Condition() # Signals new work to the render thread
+        self.running = True
+        self.restart = False
+        self.accumulation = None
+        self.pixels = None # Latest averaged image, as RGBA float32, bottom row first
+        self.pixels_version = 0
+        self.rendered_spp = 0
+        self.max_spp = 0
+        self.thread = None
+        self.drawn_version = 0 # Version of the pixels the viewport was last redrawn for
+        self.redraw_timer = self.check_redraw # Same function object to unregister the timer
+
+    def free(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if bpy.app.timers.is_registered(self.redraw_timer):
+            bpy.app.timers.unregister(self.redraw_timer)
+        if self.thread is not None:
+            self.thread.join()
+        with self.lock:
+            self.scene_sync.free()
+
+    def update(self, depsgraph, updates):
+        '''
+        Apply the changes of the scene, or rebuild it.
+
+        Params
+        ------
+        depsgraph: The evaluated dependency graph
+        updates: Set of (id_type, name) of the datablocks that changed, or None for a full update
+        '''
+        with self.lock:
+            update_count = self.scene_sync.update_count
+            if updates is not None and self.scene_sync.sync(depsgraph, updates):
+                if self.scene_sync.update_count == update_count:
+                    return # Nothing visible changed, e.g. a selection change
+            elif self.view is None:
+                return # The scene is built on the first redraw, once the view is known
+            else:
+                self.scene_sync.build(depsgraph, self.view)
+        self.request_restart()
+
+    def update_view(self, context, depsgraph):
+        '''
+        Update the viewport camera. Returns the (width, height) of the viewport.
+        '''
+        region = context.region
+        mts_settings = depsgraph.scene.mitsuba
+        self.max_spp = mts_settings.viewport_samples
+        scale = mts_settings.viewport_resolution_scale
+        width, height = max(int(region.width * scale), 1), max(int(region.height * scale), 1)
+        sensor_dict = self.sensor_dict(context, width, height)
+        if self.view is not None and self.same_sensor(self.view, sensor_dict):
+            return width, height
+        with self.lock:
+            self.view = sensor_dict
+            if not self.scene_sync.set_sensor(sensor_dict):
+                self.scene_sync.build(depsgraph, sensor_dict)
+        self.request_restart()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.render_loop, args=(depsgraph.scene.thread_env,), daemon=True)
+            self.thread.start()
+            bpy.app.timers.register(self.redraw_timer, first_interval=self.redraw_interval)
+        return width, height
+
+    @staticmethod
+    def sensor_dict(context, width, height):
+        '''
+        Sensor matching the view of the 3D viewport.
+        '''
+        from mitsuba import ScalarTransform4f
+        region_data = context.region_data
+        space = context.space_data
+        # Blender cameras look down -Z, Mitsuba cameras look down +Z
+        to_world = region_data.view_matrix.inverted() @ Matrix.Rotation(np.pi, 4, 'Y')
+        window_matrix = region_data.window_matrix
+        params = {
+            'near_clip': space.clip_start,
+            'far_clip': space.clip_end,
+            'sampler': {'type': 'independent', 'sample_count': 1},
+            'film': {
+                'type': 'hdrfilm',
+                'width': width,
+                'height': height,
+                'rfilter': {'type': 'box'}
+            }
+        }
+        if region_data.is_perspective:
+            params['type'] = 'perspective'
+            params['fov'] = degrees(2.0 * atan(1.0 / window_matrix[0][0]))
+            params['fov_axis'] = 'x'
+        else:
+            # The orthographic camera covers [-1, 1] horizontally, scale it to the view
+            params['type'] = 'orthographic'
+            to_world = to_world @ Matrix.Scale(1.0 / window_matrix[0][0], 4)
+        params['to_world'] = ScalarTransform4f(list([list(x) for x in to_world]))
+        return params
+
+    @staticmethod
+    def same_sensor(a, b):
+        if a.keys() != b.keys() or any(a[key] != b[key] for key in a if key != 'to_world'):
+            return False
+        return np.array_equal(np.array(a['to_world'].matrix), np.array(b['to_world'].matrix))
+
+    def request_restart(self):
+        with self.condition:
+            self.restart = True
+            self.condition.notify()
+
+    def render_loop(self, thread_env):
+        from mitsuba import ScopedSetThreadEnvironment, Bitmap, Struct
+        with ScopedSetThreadEnvironment(thread_env):
+            seed = 0
+            while True:
+                with self.condition:
+                    while self.running and not self.restart and self.rendered_spp >= self.max_spp:
+                        self.condition.wait()
+                    if not self.running:
+                        return
+                    if self.restart:
+                        self.restart = False
+                        self.accumulation = None
+                        self.rendered_spp = 0
+
+                with self.lock:
+                    mts_scene = self.scene_sync.mts_scene
+                    if mts_scene is None:
+                        self.rendered_spp = self.max_spp # Wait for the scene to be built
+                        continue
+                    sensor = mts_scene.sensors()[0]
+                    mts_scene.integrator().render(mts_scene, sensor, seed=seed, spp=1)
+                    bitmap = sensor.film().bitmap().split()[0][1]
+                    pixels = np.array(bitmap.convert(Bitmap.PixelFormat.RGBA, Struct.Type.Float32, srgb_gamma=False))
+                seed += 1
+
+                with self.condition:
+                    if self.restart:
+                        continue # The scene changed during the pass
+                    if self.accumulation is None or self.accumulation.shape != pixels.shape:
+                        self.accumulation = np.zeros(pixels.shape, dtype=np.float32)
+                    self.accumulation += pixels
+                    self.rendered_spp += 1
+                    # Textures are filled from the bottom row
+                    self.pixels = np.flip(self.accumulation / self.rendered_spp, 0)
+                    self.pixels[..., 3] = 1.0
+                    self.pixels_version += 1
+
+    def check_redraw(self):
+        '''
+        Timer on the main thread, redraws the viewport when the render thread produced a new image.
+        '''
+        engine = self.engine()
+        with self.condition:
+            if not self.running or engine is None:
+                return None
+            version = self.pixels_version
+        if version != self.drawn_version:
+            self.drawn_version = version
+            engine.tag_redraw()
+        return self.redraw_interval
+
+    def latest_pixels(self):
+        with self.condition:
+            return self.pixels, self.pixels_version
+
+
+class MitsubaDrawData:
+    '''
+    GPU texture holding the viewport image.
+    '''
+    def __init__(self, pixels, version):
+        self.height, self.width = pixels.shape[:2]
+        self.version = version
+        data = gpu.types.Buffer('FLOAT', self.width * self.height * 4, np.ascontiguousarray(pixels, dtype=np.float32).ravel())
+        self.texture = gpu.types.GPUTexture((self.width, self.height), format='RGBA16F', data=data)
+
+    def draw(self, dimensions):
+        draw_texture_2d(self.texture, (0, 0), *dimensions)
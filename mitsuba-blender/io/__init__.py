@@ -2,6 +2,8 @@ if "bpy" in locals():
     import importlib
     if "bl_utils" in locals():
         importlib.reload(bl_utils)
+    if "bundle" in locals():
+        importlib.reload(bundle)
     if "importer" in locals():
         importlib.reload(importer)
     if "importer_yml" in locals():
@@ -9,10 +11,13 @@ if "bpy" in locals():
     if "exporter" in locals():
         importlib.reload(exporter)
 
+import os
+
 import bpy
 from bpy.props import (
         StringProperty,
         BoolProperty,
+        IntProperty,
     )
 from bpy_extras.io_utils import (
         ImportHelper,
@@ -22,6 +27,7 @@ from bpy_extras.io_utils import (
     )
 
 from . import bl_utils
+from . import bundle
 from . import importer
 from . import importer_yml
 from . import exporter
@@ -34,7 +40,7 @@ class ImportMistuba(bpy.types.Operator, ImportHelper):
     bl_label = "Mitsuba Import"
 
     filename_ext = ".xml"
-    filter_glob: StringProperty(default="*.xml", options={'HIDDEN'})
+    filter_glob: StringProperty(default=f"*.xml;*{bundle.BUNDLE_EXT}", options={'HIDDEN'})
 
     override_scene: BoolProperty(
         name = 'Override Current Scene',
@@ -43,6 +49,19 @@ class ImportMistuba(bpy.types.Operator, ImportHelper):
         default = True,
     )
 
+    proxy_meshes: BoolProperty(
+        name = 'Proxy Meshes',
+        description = 'Import decimated proxies of the PLY meshes, for layout work on huge scans',
+        default = False,
+    )
+
+    proxy_faces: IntProperty(
+        name = 'Proxy Faces',
+        description = 'Approximate number of faces of each proxy mesh',
+        default = 100000,
+        min = 1,
+    )
+
     def execute(self, context):
         # Set blender to object mode
         if bpy.ops.object.mode_set.poll():
@@ -62,8 +81,9 @@ class ImportMistuba(bpy.types.Operator, ImportHelper):
         collection = scene.collection
 
         try:
-            importer.load_mitsuba_scene(context, scene, collection, self.filepath, axis_mat)
-        except (RuntimeError, NotImplementedError) as e:
+            proxy_faces = self.proxy_faces if self.proxy_meshes else None
+            importer.load_mitsuba_scene(context, scene, collection, self.filepath, axis_mat, proxy_faces)
+        except (RuntimeError, NotImplementedError, ValueError) as e:
             print(e)
             self.report({'ERROR'}, "Failed to load Mitsuba scene. See error log.")
             return {'CANCELLED'}
@@ -150,46 +170,129 @@ class ExportMitsuba(bpy.types.Operator, ExportHelper):
             default = True
     )
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.reset()
+    use_mesh_cache: BoolProperty(
+            name = "Use Mesh Cache",
+            description = "Reuse previously exported PLY files of meshes whose geometry did not change",
+            default = False
+    )
 
-    def reset(self):
-        self.converter = exporter.SceneConverter()
+    mesh_cache_dir: StringProperty(
+            name = "Mesh Cache Directory",
+            description = "Folder storing the cached meshes. Defaults to a '.cache' folder next to the exported meshes",
+            default = "",
+            subtype = 'DIR_PATH'
+    )
 
-    def execute(self, context):
-        # Conversion matrix to shift the "Up" Vector. This can be useful when exporting single objects to an existing mitsuba scene.
-        axis_mat = axis_conversion(
-	            to_forward=self.axis_forward,
-	            to_up=self.axis_up,
-	        ).to_4x4()
+    ply_writer_threads: IntProperty(
+            name = "Mesh Writer Threads",
+            description = "Number of background threads encoding and writing PLY files. 0 writes them on the main thread",
+            default = 4,
+            min = 0,
+            soft_max = 32
+    )
 
-        self.converter.export_ctx.axis_mat = axis_mat
-        # Add IDs to all base plugins (shape, emitter, sensor...)
-        self.converter.export_ctx.export_ids = self.export_ids
+    incremental: BoolProperty(
+            name = "Incremental Export",
+            description = "Only re-export the objects that changed since the previous export to this file in the current session",
+            default = False
+    )
 
-        self.converter.use_selection = self.use_selection
+    bundle: BoolProperty(
+            name = "Scene Bundle",
+            description = "Export a single .mib file holding the scene, its meshes and its textures, instead of an XML file with separate mesh and texture files",
+            default = False
+    )
 
-        # Set path to scene .xml file
-        self.converter.set_path(self.filepath, split_files=self.split_files)
+    streaming: BoolProperty(
+            name = "Stream XML",
+            description = "Write the scene file while exporting, instead of keeping the whole scene in memory. Use it for very large scenes",
+            default = False
+    )
 
-        window_manager = context.window_manager
+    profile: BoolProperty(
+            name = "Profile Export",
+            description = "Time the stages of the export and each exported object, and write the report next to the scene file (<name>.profile.json, viewable in chrome://tracing)",
+            default = False
+    )
 
-        deps_graph = context.evaluated_depsgraph_get()
+    export_animation: BoolProperty(
+            name = "Animation",
+            description = "Export a frame range, as one XML file per frame sharing the meshes that don't deform",
+            default = False
+    )
 
-        total_progress = len(deps_graph.object_instances)
-        window_manager.progress_begin(0, total_progress)
+    frame_start: IntProperty(
+            name = "Start Frame",
+            description = "First frame of the exported animation. Defaults to the start of the scene's frame range",
+            default = 1
+    )
 
-        self.converter.scene_to_dict(deps_graph, window_manager)
-        # Write data to scene .xml file
-        self.converter.dict_to_xml()
+    frame_end: IntProperty(
+            name = "End Frame",
+            description = "Last frame of the exported animation. Defaults to the end of the scene's frame range",
+            default = 250
+    )
 
-        window_manager.progress_end()
+    frame_step: IntProperty(
+            name = "Frame Step",
+            description = "Number of frames between two exported frames",
+            default = 1,
+            min = 1
+    )
 
-        self.report({'INFO'}, "Scene exported successfully!")
+    def invoke(self, context, event):
+        if not self.properties.is_property_set('frame_start'):
+            self.frame_start = context.scene.frame_start
+        if not self.properties.is_property_set('frame_end'):
+            self.frame_end = context.scene.frame_end
+        return super().invoke(context, event)
 
-        # Reset the exporter
-        self.reset()
+    def execute(self, context):
+        options = {
+            'use_selection': self.use_selection,
+            'split_files': self.split_files,
+            'export_ids': self.export_ids,
+            'ignore_background': self.ignore_background,
+            'axis_forward': self.axis_forward,
+            'axis_up': self.axis_up,
+            'ply_writer_threads': self.ply_writer_threads,
+            'mesh_cache_dir': self.mesh_cache_dir if self.use_mesh_cache else None,
+            'streaming': self.streaming,
+            'profile': self.profile,
+        }
+
+        if self.export_animation:
+            if self.incremental:
+                self.report({'WARNING'}, "Incremental export is not supported for animations, exporting all the frames.")
+            if self.bundle:
+                self.report({'WARNING'}, "Scene bundles are not supported for animations, exporting XML files.")
+            frame_files, animation = exporter.export_animation(self.filepath, self.frame_start, self.frame_end, self.frame_step,
+                                                               context.scene, context.view_layer, context.window_manager, **options)
+            self.report({'INFO'}, f"Exported {len(frame_files)} frames: {animation.written} mesh files written, {animation.reused} shared.")
+            return {'FINISHED'}
+
+        filepath = self.filepath
+        if self.bundle:
+            if self.incremental or self.streaming:
+                self.report({'WARNING'}, "Incremental and streaming exports are not supported for scene bundles, exporting the whole scene.")
+            filepath = bpy.path.ensure_ext(os.path.splitext(filepath)[0], bundle.BUNDLE_EXT)
+            options['streaming'] = False
+        converter = exporter.export_scene(filepath, context.scene, context.view_layer,
+                                          incremental=self.incremental and not self.bundle,
+                                          window_manager=context.window_manager, bundle=self.bundle, **options)
+
+        mesh_cache = converter.export_ctx.mesh_cache
+        if mesh_cache is not None:
+            self.report({'INFO'}, f"Mesh cache: {mesh_cache.hits} hits, {mesh_cache.misses} misses.")
+        manifest = converter.export_ctx.manifest
+        if manifest is not None:
+            self.report({'INFO'}, f"Incremental export: {manifest.reused} objects reused, {manifest.converted} converted.")
+        profiler = converter.export_ctx.profiler
+        if profiler is not None:
+            slowest = ', '.join(f"{name} ({totals['seconds']:.2f} s)" for name, totals in profiler.slowest_objects(5))
+            self.report({'INFO'}, f"Slowest objects: {slowest or 'none'}. Profile written to {converter.profile_path}")
+
+        self.report({'INFO'}, "Scene exported successfully!")
 
         return {'FINISHED'}
 
@@ -298,6 +401,8 @@ def register():
     for cls in classes:
         bpy.utils.register_class(cls)
 
+    exporter.incremental.register()
+
     bpy.types.TOPBAR_MT_file_export.append(menu_export_func)
     bpy.types.TOPBAR_MT_file_export.append(menu_custom_export_func)
     bpy.types.TOPBAR_MT_file_import.append(menu_import_func)
@@ -307,6 +412,8 @@ def unregister():
     for cls in classes:
         bpy.utils.unregister_class(cls)
 
+    exporter.incremental.unregister()
+
     bpy.types.TOPBAR_MT_file_export.remove(menu_export_func)
     bpy.types.TOPBAR_MT_file_export.append(menu_custom_export_func)
     bpy.types.TOPBAR_MT_file_import.remove(menu_import_func)
@@ -0,0 +1,365 @@
+'''
+Scene bundles: a single file holding an exported scene, instead of an XML file with loose mesh and texture files.
+
+Layout of a bundle:
+    header: magic, format version
+    blobs: raw arrays and files, each one aligned to ALIGNMENT bytes
+    index: UTF-8 JSON with the scene dict and the location of every blob
+    footer: offset and size of the index, magic
+
+The scene dict is the one handed to Mitsuba's XML writer. Its 'filename' entries are paths
+relative to the scene, looked up in the bundle: meshes are stored as typed buffers (positions,
+faces, normals...) instead of PLY files, other files (e.g. textures) as is, once per content.
+Transforms are stored as {"$transform": 4x4 matrix}.
+
+This module only depends on numpy and mitsuba, so that bundles can be loaded outside of blender:
+    mi.load_dict(load_bundle('scene.mib'))
+'''
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import threading
+
+import numpy as np
+
+BUNDLE_EXT = '.mib'
+MAGIC = b'MIBUNDLE'
+VERSION = 1
+ALIGNMENT = 64 # Blob alignment, so that the buffers can be used in place
+_header = struct.Struct('<8sI4x')
+_footer = struct.Struct('<QQ8s')
+
+def is_bundle(filepath):
+    if not os.path.isfile(filepath):
+        return False
+    with open(filepath, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def encode_value(value):
+    '''
+    Convert a value of the scene dict to JSON types.
+    '''
+    if isinstance(value, dict):
+        return {key: encode_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode_value(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    if hasattr(value, 'matrix'): # Mitsuba transform
+        return {'$transform': np.array(value.matrix, dtype=np.float64).tolist()}
+    raise TypeError(f"Unsupported value in the scene dict: {value!r}")
+
+def decode_value(value):
+    '''
+    Convert a value of the JSON scene dict back to the types expected by load_dict.
+    '''
+    if isinstance(value, dict):
+        if len(value) == 1 and '$transform' in value:
+            from mitsuba import ScalarTransform4f
+            return ScalarTransform4f(np.array(value['$transform'], dtype=np.float64))
+        return {key: decode_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [decode_value(item) for item in value]
+    return value
+
+class BundleWriter:
+    '''
+    Write a scene bundle. Blobs are appended to the file as they are added, from any thread,
+    and the index is written by close(). The bundle is written next to its final path,
+    and only replaces it once complete.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.temp_path = f"{path}.part"
+        self.file = open(self.temp_path, 'wb')
+        self.file.write(_header.pack(MAGIC, VERSION))
+        self.lock = threading.Lock()
+        self.blobs = [] # [offset, size, dtype, shape], dtype and shape are None for files
+        self.meshes = {} # Scene path -> buffer name -> blob
+        self.files = {} # Scene path -> blob
+        self.file_blobs = {} # Digest of a file's content -> blob
+        self.instances = {} # Shapegroup id -> blob of the (N, 4, 4) to_world matrices of its instances
+        # Folder for the files that have to be encoded before being bundled, e.g. packed images
+        self.staging_dir = tempfile.mkdtemp(prefix='mitsuba-bundle-')
+
+    def _append(self, write, size, dtype=None, shape=None):
+        with self.lock:
+            offset = self.file.tell()
+            padding = -offset % ALIGNMENT
+            self.file.write(b'\0' * padding)
+            offset += padding
+            write(self.file)
+            self.blobs.append([offset, size, dtype, shape])
+            return len(self.blobs) - 1
+
+    def add_array(self, array):
+        '''
+        Add a numpy array, returns the index of its blob.
+        '''
+        array = np.ascontiguousarray(array)
+        return self._append(lambda f: f.write(array.data), array.nbytes, array.dtype.str, list(array.shape))
+
+    def add_mesh(self, filename, positions, faces, normals=None, uvs=None, attributes=None):
+        '''
+        Add the buffers of a triangle mesh, same arguments as ply_writer.write_ply.
+
+        Params
+        ------
+        filename: Path of the mesh in the scene dict, e.g. 'meshes/Cube.ply'
+        '''
+        buffers = {'positions': self.add_array(positions), 'faces': self.add_array(faces)}
+        if normals is not None:
+            buffers['normals'] = self.add_array(normals)
+        if uvs is not None:
+            buffers['uvs'] = self.add_array(uvs)
+        buffers['attributes'] = {name: self.add_array(values) for name, values in (attributes or {}).items()}
+        with self.lock:
+            self.meshes[filename] = buffers
+
+    def add_file(self, filename, source_path):
+        '''
+        Add a file, stored once if several paths have the same content.
+
+        Params
+        ------
+        filename: Path of the file in the scene dict, e.g. 'textures/wood.png'
+        source_path: Path of the file on disk
+        '''
+        digest = hashlib.blake2b()
+        with open(source_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        digest = digest.hexdigest()
+        with self.lock:
+            blob = self.file_blobs.get(digest)
+        if blob is None:
+            def copy(target):
+                with open(source_path, 'rb') as source:
+                    shutil.copyfileobj(source, target)
+            blob = self._append(copy, os.path.getsize(source_path))
+            with self.lock:
+                self.file_blobs[digest] = blob
+        with self.lock:
+            self.files[filename] = blob
+
+    def add_instances(self, shape_id, matrices):
+        '''
+        Add the (N, 4, 4) to_world matrices of the instances of a shapegroup.
+        '''
+        self.instances[shape_id] = self.add_array(np.asarray(matrices, dtype=np.float32))
+
+    def close(self, scene_dict):
+        '''
+        Write the index with the scene dict, and move the bundle to its final path.
+        '''
+        index = {
+            'version': VERSION,
+            'scene': encode_value(scene_dict),
+            'meshes': self.meshes,
+            'files': self.files,
+            'instances': self.instances,
+            'blobs': self.blobs,
+        }
+        data = json.dumps(index, separators=(',', ':')).encode('utf-8')
+        offset = self.file.tell()
+        self.file.write(data)
+        self.file.write(_footer.pack(offset, len(data), MAGIC))
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+
+    def abort(self):
+        '''
+        Remove the partially written bundle.
+        '''
+        self.file.close()
+        os.remove(self.temp_path)
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+
+class Bundle:
+    '''
+    Read access to a scene bundle. The file is memory mapped, and the arrays returned
+    are read-only views of it: nothing is copied until Mitsuba or blender reads them.
+    '''
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = _header.unpack_from(self.data, 0)
+        index_offset, index_size, end_magic = _footer.unpack_from(self.data, len(self.data) - _footer.size)
+        if magic != MAGIC or end_magic != MAGIC:
+            raise ValueError(f"'{path}' is not a scene bundle, or is incomplete")
+        if version > VERSION:
+            raise ValueError(f"Scene bundle version {version} is not supported, the latest supported version is {VERSION}")
+        index = json.loads(bytes(self.data[index_offset:index_offset + index_size]))
+        self.scene = index['scene']
+        self.meshes = index['meshes']
+        self.files = index['files']
+        self.instances = index['instances']
+        self.blobs = index['blobs']
+
+    def array(self, blob):
+        offset, size, dtype, shape = self.blobs[blob]
+        return np.frombuffer(self.data, dtype=np.dtype(dtype), count=int(np.prod(shape)), offset=offset).reshape(shape)
+
+    def file_data(self, filename):
+        offset, size, _, _ = self.blobs[self.files[filename]]
+        return memoryview(self.data)[offset:offset + size]
+
+    def mesh_buffers(self, filename):
+        '''
+        Buffers of a bundled mesh: dict with the positions, faces, normals, uvs and attributes
+        arrays (see BundleWriter.add_mesh), or None if it is not in the bundle.
+        '''
+        buffers = self.meshes.get(filename)
+        if buffers is None:
+            return None
+        arrays = {name: self.array(blob) for name, blob in buffers.items() if name != 'attributes'}
+        arrays['attributes'] = {name: self.array(blob) for name, blob in buffers['attributes'].items()}
+        return arrays
+
+    def instance_matrices(self, shape_id):
+        return self.array(self.instances[shape_id])
+
+    def scene_dict(self):
+        '''
+        Scene dict as written by the exporter, with the instances of each shapegroup
+        as separate entries. Files are still referenced by their path in the bundle.
+        '''
+        from mitsuba import ScalarTransform4f
+        scene = decode_value(self.scene)
+        for shape_id in self.instances:
+            for i, matrix in enumerate(self.instance_matrices(shape_id)):
+                scene[f"instance-{shape_id}-{i}"] = {
+                    'type': 'instance',
+                    'shape': {'type': 'ref', 'id': shape_id},
+                    'to_world': ScalarTransform4f(matrix.astype(np.float64))
+                }
+        return scene
+
+    def extract_file(self, filename, directory):
+        '''
+        Write a bundled file in a folder, at its path in the scene. Returns the path of the written file.
+        '''
+        path = os.path.join(directory, *filename.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(self.file_data(filename))
+        return path
+
+def create_mesh(name, buffers, props, to_world=None):
+    '''
+    Create a Mitsuba mesh from bundled buffers.
+
+    Params
+    ------
+    name: Name of the mesh
+    buffers: Mesh buffers, see Bundle.mesh_buffers
+    props: Properties given to the mesh constructor (e.g. its BSDF)
+    to_world: Optional 4x4 matrix applied to the vertices, since meshes don't transform their buffers
+    '''
+    from mitsuba import Mesh, traverse
+    positions, normals = buffers['positions'], buffers.get('normals')
+    if to_world is not None:
+        positions = positions @ to_world[:3, :3].T + to_world[:3, 3]
+        if normals is not None:
+            normals = normals @ np.linalg.inv(to_world[:3, :3])
+            normals /= np.linalg.norm(normals, axis=1, keepdims=True)
+    mts_mesh = Mesh(name, len(positions), len(buffers['faces']), props=props,
+                    has_vertex_normals=normals is not None,
+                    has_vertex_texcoords='uvs' in buffers)
+    for attr_name, values in buffers['attributes'].items():
+        mts_mesh.add_attribute(attr_name, values.shape[1], values.ravel())
+    params = traverse(mts_mesh)
+    params['vertex_positions'] = np.ravel(positions.astype(np.float32, copy=False))
+    params['faces'] = buffers['faces'].ravel()
+    if 'uvs' in buffers:
+        params['vertex_texcoords'] = buffers['uvs'].ravel()
+    params.update()
+    if normals is not None:
+        # Updating the positions recomputes the vertex normals, set them afterwards
+        params['vertex_normals'] = np.ravel(normals.astype(np.float32, copy=False))
+        params.update()
+    return mts_mesh
+
+def load_bundle(path):
+    '''
+    Load a scene bundle as a dict for Mitsuba's load_dict.
+    Bundled meshes are created from views of the bundle, and bundled images are decoded from memory.
+    '''
+    from mitsuba import Bitmap, MemoryStream, Properties, load_dict
+    bundle = Bundle(path)
+    scene = bundle.scene_dict()
+    loaded = {} # Id -> Mitsuba object of the BSDFs loaded for the meshes that reference them
+
+    def resolve_files(value):
+        # Images are given to bitmap textures and envmaps as bitmaps, other files are not supported
+        for key, item in value.items():
+            if isinstance(item, dict):
+                resolve_files(item)
+        filename = value.get('filename')
+        if filename in bundle.files:
+            if value['type'] not in {'bitmap', 'envmap'}:
+                raise ValueError(f"Bundled file '{filename}' can't be loaded by a '{value['type']}' plugin")
+            stream = MemoryStream()
+            stream.write(bytes(bundle.file_data(filename)))
+            stream.seek(0)
+            del value['filename']
+            value['bitmap'] = Bitmap(stream)
+
+    def load_bsdf(value):
+        if value['type'] == 'ref':
+            if value['id'] not in loaded:
+                loaded[value['id']] = load_dict(scene[value['id']])
+                scene[value['id']] = loaded[value['id']]
+            return loaded[value['id']]
+        return load_dict(value)
+
+    def build_meshes(name, value):
+        # Replace the bundled meshes by Mitsuba meshes, in shapegroups too
+        if value.get('type') == 'shapegroup':
+            for key, item in value.items():
+                if isinstance(item, dict):
+                    value[key] = build_meshes(key, item)
+            return value
+        buffers = bundle.mesh_buffers(value.get('filename')) if value.get('type') == 'ply' else None
+        if buffers is None:
+            return value
+        props = Properties()
+        if 'bsdf' in value:
+            props['bsdf'] = load_bsdf(value['bsdf'])
+        if 'emitter' in value:
+            # Area emitters sample the mesh when it is created, so an emissive mesh can't be
+            # created empty and filled afterwards: load it from a temporary PLY file instead
+            with tempfile.TemporaryDirectory() as directory:
+                filepath = os.path.join(directory, 'mesh.ply')
+                create_mesh(name, buffers, Properties()).write_ply(filepath)
+                entry = dict(value, filename=filepath)
+                if 'bsdf' in value:
+                    entry['bsdf'] = props['bsdf']
+                return load_dict(entry)
+        if value.get('face_normals', False):
+            # Same as the PLY plugin, which ignores the vertex normals of the file
+            props['face_normals'] = True
+            buffers['normals'] = None
+        to_world = value.get('to_world')
+        if to_world is not None:
+            to_world = np.array(to_world.matrix, dtype=np.float64)
+        return create_mesh(name, buffers, props, to_world)
+
+    for key, value in scene.items():
+        if isinstance(value, dict):
+            resolve_files(value)
+    for key in list(scene):
+        # Entries may have been replaced by loaded objects in the meantime
+        if isinstance(scene[key], dict):
+            scene[key] = build_meshes(key, scene[key])
+    return scene
@@ -1,4 +1,5 @@
 import os
+import shutil
 from collections import defaultdict
 
 if "bpy" in locals():
@@ -13,6 +14,16 @@ if "bpy" in locals():
         importlib.reload(lights)
     if "camera" in locals():
         importlib.reload(camera)
+    if "ply_writer" in locals():
+        importlib.reload(ply_writer)
+    if "incremental" in locals():
+        importlib.reload(incremental)
+    if "instance_writer" in locals():
+        importlib.reload(instance_writer)
+    if "xml_writer" in locals():
+        importlib.reload(xml_writer)
+    if "profiler" in locals():
+        importlib.reload(profiler)
 
 import bpy
 
@@ -21,6 +32,10 @@ from . import materials
 from . import geometry
 from . import lights
 from . import camera
+from . import ply_writer
+from . import incremental
+from . import instance_writer
+from . import profiler
 
 class SceneConverter:
     '''
@@ -29,9 +44,20 @@ class SceneConverter:
     '''
     def __init__(self, render=False, include_auxiliary_output=False):
         self.export_ctx = export_context.ExportContext()
+        # When rendering, meshes are handed to Mitsuba directly instead of being written to disk
+        self.export_ctx.keep_meshes_in_memory = render
         self.use_selection = False # Only export selection
         self.ignore_background = True
         self.render = render
+        self.ply_writer_threads = 0 # Number of background threads writing meshes. 0 writes them on the main thread
+        self.incremental = False # Only re-export what changed since the previous export to the same file. Must be set before set_path
+        self.streaming = False # Write the XML entries during scene_to_dict instead of keeping them in the scene dict. Must be set before set_path
+        self.bundle = False # Write a single scene bundle file instead of XML, mesh and texture files. Must be set before set_path
+        self.manifest_path = ''
+        self.staging_dir = None # Folder where an incremental export writes its XML files, see incremental.commit_staged_files
+        self.xml_path = ''
+        self.fragment_names = [] # Instance fragments written by the export, relative to the scene folder
+        self.profile_path = '' # Where export_scene wrote the profiling report, if enabled
 
         self.include_auxiliary_output = include_auxiliary_output # Whether to include auxiliary outputs in the XML file
         self.auxiliary_output_dict = {
@@ -42,87 +68,273 @@ class SceneConverter:
     def set_path(self, name, split_files=False):
         from mitsuba.python.xml import WriteXML
         # Ideally, this should only be created if we want to write a scene.
-        # For now we need it to save meshes and packed textures.
+        # When rendering, meshes stay in memory but we still need it to save packed textures.
         # TODO: get rid of all writing to disk when creating the dict
+        if not self.render and self.bundle:
+            from ..bundle import BundleWriter
+            self.export_ctx.bundle = BundleWriter(name)
+            self.xml_path = name
+            # Meshes go to the bundle directly, files that must be encoded first (e.g. packed images) to a temporary folder
+            self.export_ctx.directory = self.export_ctx.bundle.staging_dir
+            return
         if not self.render:
-            self.xml_writer = WriteXML(name, self.export_ctx.subfolders,
-                                       split_files=split_files)
+            xml_path = name
+            if self.incremental:
+                # Scene files are written to a staging folder, and only the changed ones replace the
+                # previous ones. The files keep their name, so that the includes of the fragments match
+                self.staging_dir = incremental.staging_dir(name)
+                xml_path = os.path.join(self.staging_dir, os.path.basename(name))
+                self.manifest_path = f"{os.path.splitext(name)[0]}.manifest.json"
+            if self.streaming:
+                from .xml_writer import StreamingWriteXML
+                self.xml_writer = StreamingWriteXML(xml_path, self.export_ctx.subfolders, split_files=split_files)
+                self.export_ctx.xml_stream = self.xml_writer
+                self.export_ctx.instance_streams = {}
+            else:
+                self.xml_writer = WriteXML(xml_path, self.export_ctx.subfolders,
+                                           split_files=split_files)
+            if self.staging_dir is not None:
+                # Paths of the meshes and textures are relative to the scene folder, not the staging one
+                self.xml_writer.directory = os.path.dirname(name) or '.'
+                self.xml_writer.textures_folder = os.path.join(self.xml_writer.directory, self.xml_writer.subfolders['texture'])
+                self.export_ctx.fragment_directory = self.staging_dir
+            self.xml_path = name
+            self.export_ctx.scene_name = os.path.splitext(os.path.basename(name))[0]
         # Give the path to the export context, for saving meshes and files
         self.export_ctx.directory, _ = os.path.split(name)
 
-    def scene_to_dict(self, depsgraph, window_manager):
-        # Switch to object mode before exporting stuff, so everything is defined properly
-        if bpy.ops.object.mode_set.poll():
+    def enable_mesh_cache(self, directory=''):
+        '''
+        Reuse previously exported meshes whose content did not change.
+        Defaults to a cache folder next to the exported meshes. Must be called after set_path.
+        '''
+        if not directory:
+            directory = os.path.join(self.export_ctx.directory, self.export_ctx.subfolders['shape'], '.cache')
+        self.export_ctx.mesh_cache = export_context.MeshCache(directory)
+
+    def scene_to_dict(self, depsgraph, window_manager=None):
+        # Switch to object mode before exporting stuff, so everything is defined properly.
+        # Renders read the evaluated depsgraph, and must not change the mode of the user (e.g. in the viewport)
+        if not self.render and bpy.ops.object.mode_set.poll():
             bpy.ops.object.mode_set(mode='OBJECT')
 
         #depsgraph = context.evaluated_depsgraph_get()
         self.export_ctx.deg = depsgraph
 
         b_scene = depsgraph.scene #TODO: what if there are multiple scenes?
+        self.export_ctx.data_add(self.integrator_dict(b_scene))
+
+        with self.export_ctx.profile('export_world'):
+            materials.export_world(self.export_ctx, b_scene.world, self.ignore_background)
+
+        particles = self.particle_objects()
+
+        # Linked duplicates are exported once, and instanced
+        if not self.render:
+            self.export_ctx.shared_meshes = geometry.shared_mesh_data(depsgraph)
+
+        if self.incremental and not self.render:
+            settings = {'axis_mat': [list(row) for row in self.export_ctx.axis_mat]}
+            self.export_ctx.manifest = incremental.ExportManifest(self.manifest_path, settings,
+                                                                  b_scene.frame_current + b_scene.frame_subframe)
+
+        if self.ply_writer_threads > 0:
+            self.export_ctx.ply_writer = ply_writer.PlyWriterPool(self.ply_writer_threads)
+        try:
+            self.export_objects(depsgraph, b_scene, particles, window_manager)
+        except BaseException:
+            if self.export_ctx.ply_writer is not None:
+                # Let the running jobs finish, but report the export error rather than theirs
+                pool, self.export_ctx.ply_writer = self.export_ctx.ply_writer, None
+                for error in pool.wait(raise_errors=False):
+                    self.export_ctx.log(f'Failed to write a mesh: {error}', 'WARN')
+            raise
+        if self.export_ctx.ply_writer is not None:
+            # All meshes must be on disk before the scene is written or loaded
+            pool, self.export_ctx.ply_writer = self.export_ctx.ply_writer, None
+            with self.export_ctx.profile('wait_ply_writer'):
+                pool.wait()
+
+        with self.export_ctx.profile('export_instances'):
+            self.export_instances()
+
+        if self.export_ctx.manifest is not None:
+            self.export_ctx.manifest.save()
+
+    @staticmethod
+    def integrator_dict(b_scene):
         if b_scene.render.engine == 'MITSUBA':
-            integrator = getattr(b_scene.mitsuba.available_integrators,b_scene.mitsuba.active_integrator).to_dict()
-        else:
-            integrator = {
-                'type':'path',
-                'max_depth': b_scene.cycles.max_bounces
-            }
-        self.export_ctx.data_add(integrator)
+            return getattr(b_scene.mitsuba.available_integrators,b_scene.mitsuba.active_integrator).to_dict()
+        return {
+            'type':'path',
+            'max_depth': b_scene.cycles.max_bounces
+        }
 
-        materials.export_world(self.export_ctx, b_scene.world, self.ignore_background)
+    def export_instances(self):
+        '''
+        Add the instances gathered during the export to the scene, in one batch per shapegroup.
+        Renders get one instance dict per matrix. Saved scenes include one fragment per shapegroup,
+        listing all its instances. When streaming, the fragments are written during the export
+        and only their last block is left. Incremental exports write the fragments to the staging
+        folder with the XML files, and record them in the manifest.
+        '''
+        for shape_id in self.export_ctx.instances:
+            if self.export_ctx.instance_streams is not None:
+                # The fragment already has the previous blocks of instances
+                self.export_ctx.flush_instances(shape_id).close()
+            elif self.render:
+                from mitsuba import ScalarTransform4f
+                shape_ref = {'type': 'ref', 'id': shape_id}
+                for matrix in self.export_ctx.instance_matrices(shape_id):
+                    self.export_ctx.data_add({'type': 'instance', 'shape': shape_ref, 'to_world': ScalarTransform4f(matrix)})
+                continue
+            elif self.export_ctx.bundle is not None:
+                self.export_ctx.bundle.add_instances(shape_id, self.export_ctx.instance_matrices(shape_id))
+                continue
+            else:
+                instance_writer.write_instances(self.export_ctx.instance_fragment_path(shape_id), shape_id,
+                                                self.export_ctx.instance_matrices(shape_id))
+            filename = self.export_ctx.instance_fragment(shape_id)
+            self.fragment_names.append(filename)
+            if self.export_ctx.profiler is not None and self.staging_dir is None: # Staged files are counted once committed
+                self.export_ctx.profiler.add_bytes(os.path.getsize(self.export_ctx.instance_fragment_path(shape_id)))
+            self.export_ctx.data_add({'type': 'include', 'filename': filename}, name=f"instances-{shape_id}")
+        if self.export_ctx.manifest is not None:
+            self.export_ctx.manifest.fragments = list(self.fragment_names)
 
-        # Establish list of particle objects
-        particles = []
+    @staticmethod
+    def particle_objects():
+        '''
+        Names of the objects instanced by particle systems.
+        '''
+        particles = set()
         for particle_sys in bpy.data.particles:
-            if particle_sys.render_type == 'OBJECT':
-                particles.append(particle_sys.instance_object.name)
-            elif particle_sys.render_type == 'COLLECTION':
-                for obj in particle_sys.instance_collection.objects:
-                    particles.append(obj.name)
-
-        progress_counter = 0
-        camera_counter = 0
+            if particle_sys.render_type == 'OBJECT' and particle_sys.instance_object is not None:
+                particles.add(particle_sys.instance_object.name)
+            elif particle_sys.render_type == 'COLLECTION' and particle_sys.instance_collection is not None:
+                particles.update(obj.name for obj in particle_sys.instance_collection.objects)
+        return particles
+
+    def object_exporters(self):
+        '''
+        Export function of each supported object type.
+        They are called with the object instance, the scene and whether the object is instanced by particles.
+        '''
+        #type: enum in [‘MESH’, ‘CURVE’, ‘SURFACE’, ‘META’, ‘FONT’, ‘ARMATURE’, ‘LATTICE’, ‘EMPTY’, ‘GPENCIL’, ‘CAMERA’, ‘LIGHT’, ‘SPEAKER’, ‘LIGHT_PROBE’], default ‘EMPTY’, (readonly)
+        return {
+            'MESH': self.export_mesh,
+            'FONT': self.export_mesh,
+            'SURFACE': self.export_mesh,
+            'META': self.export_mesh,
+            'CAMERA': self.export_camera,
+            'LIGHT': self.export_light,
+        }
+
+    def export_objects(self, depsgraph, b_scene, particles, window_manager):
+        exporters = self.object_exporters()
+        if self.export_ctx.profiler is not None:
+            exporters = {object_type: self.export_ctx.profiler.object_exporter(exporter) for object_type, exporter in exporters.items()}
+        self.camera_counter = 0
+        # Per object data, computed once for all the instances of an object:
+        # (original object, evaluated type) -> (export function or None if it is skipped, whether it is instanced by particles)
+        # The evaluated object of instances is a temporary copy reused by the iterator, it can't be a key.
+        # The same original can be evaluated to several types, e.g. a curve and the mesh of its geometry.
+        object_info = {}
+        # Instancer object -> whether its instances are skipped
+        parent_skipped = {}
+
         # Main export loop
-        for object_instance in depsgraph.object_instances:
-            window_manager.progress_update(progress_counter)
-            progress_counter += 1
-
-            if self.use_selection:
-                #skip if it's not selected or if it's an instance and the parent object is not selected
-                if not object_instance.is_instance and not object_instance.object.original.select_get():
-                    continue
-                if (object_instance.is_instance and object_instance.object.parent
-                    and not object_instance.object.parent.original.select_get()):
-                    continue
+        for progress_counter, object_instance in enumerate(depsgraph.object_instances):
+            if window_manager is not None:
+                window_manager.progress_update(progress_counter)
 
             evaluated_obj = object_instance.object
-            object_type = evaluated_obj.type
-            #type: enum in [‘MESH’, ‘CURVE’, ‘SURFACE’, ‘META’, ‘FONT’, ‘ARMATURE’, ‘LATTICE’, ‘EMPTY’, ‘GPENCIL’, ‘CAMERA’, ‘LIGHT’, ‘SPEAKER’, ‘LIGHT_PROBE’], default ‘EMPTY’, (readonly)
-            if evaluated_obj.hide_render or (object_instance.is_instance
-                and evaluated_obj.parent and evaluated_obj.parent.original.hide_render):
-                self.export_ctx.log("Object: {} is hidden for render. Ignoring it.".format(evaluated_obj.name), 'INFO')
-                continue#ignore it since we don't want it rendered (TODO: hide_viewport)
-            if object_type in {'MESH', 'FONT', 'SURFACE', 'META'}:
-                if self.include_auxiliary_output:
-                    geometry.export_object(object_instance, self.export_ctx, evaluated_obj.name in particles, self.auxiliary_output_dict["texture_optimization"])
-                else:
-                    geometry.export_object(object_instance, self.export_ctx, evaluated_obj.name in particles)
-            elif object_type == 'CAMERA':
-                # When rendering inside blender, export only the active camera # NOTE: what does this mean
-                if (self.render and evaluated_obj.name_full == b_scene.camera.name_full) or not self.render:
-                    if self.include_auxiliary_output:
-                        camera.export_camera(object_instance, b_scene, self.export_ctx, self.auxiliary_output_dict["sensor_indices_for_optimization"], camera_counter)
-                    else:
-                        camera.export_camera(object_instance, b_scene, self.export_ctx)
-                    camera_counter += 1
-                    
-                # TODO: add auxiliary output to export all cams
-            elif object_type == 'LIGHT':
-                lights.export_light(object_instance, self.export_ctx)
-            else:
-                self.export_ctx.log("Object: %s of type '%s' is not supported!" % (evaluated_obj.name_full, object_type), 'WARN')
+            original_obj = evaluated_obj.original
+            info_key = (original_obj, evaluated_obj.type)
+            info = object_info.get(info_key)
+            if info is None:
+                info = self.object_info(evaluated_obj, exporters, particles)
+                object_info[info_key] = info
+            exporter, is_particle = info
+            if exporter is None:
+                continue
+
+            if object_instance.is_instance:
+                # Skip the instances of parents that are not selected, or hidden for render
+                parent = evaluated_obj.parent
+                if parent is not None:
+                    skipped = parent_skipped.get(parent)
+                    if skipped is None:
+                        skipped = parent.original.hide_render or (self.use_selection and not parent.original.select_get())
+                        parent_skipped[parent] = skipped
+                    if skipped:
+                        continue
+            elif self.use_selection and not original_obj.select_get():
+                continue
+
+            exporter(object_instance, b_scene, is_particle)
+
+    def object_info(self, evaluated_obj, exporters, particles):
+        '''
+        Export function of an object and whether it is instanced by particles.
+        The export function is None if the object should not be exported.
+        '''
+        if evaluated_obj.hide_render:
+            self.export_ctx.log("Object: {} is hidden for render. Ignoring it.".format(evaluated_obj.name), 'INFO')
+            return None, False #ignore it since we don't want it rendered (TODO: hide_viewport)
+        exporter = exporters.get(evaluated_obj.type)
+        if exporter is None:
+            self.export_ctx.log("Object: %s of type '%s' is not supported!" % (evaluated_obj.name_full, evaluated_obj.type), 'WARN')
+        return exporter, evaluated_obj.name in particles
+
+    def export_mesh(self, object_instance, b_scene, is_particle):
+        if self.include_auxiliary_output:
+            geometry.export_object(object_instance, self.export_ctx, is_particle, self.auxiliary_output_dict["texture_optimization"])
+        else:
+            geometry.export_object(object_instance, self.export_ctx, is_particle)
+
+    def export_camera(self, object_instance, b_scene, is_particle):
+        # When rendering inside blender, export only the active camera
+        if self.render and object_instance.object.name_full != b_scene.camera.name_full:
+            return
+        if self.include_auxiliary_output:
+            camera.export_camera(object_instance, b_scene, self.export_ctx, self.auxiliary_output_dict["sensor_indices_for_optimization"], self.camera_counter)
+        else:
+            camera.export_camera(object_instance, b_scene, self.export_ctx)
+        self.camera_counter += 1
+        # TODO: add auxiliary output to export all cams
+
+    def export_light(self, object_instance, b_scene, is_particle):
+        lights.export_light(object_instance, self.export_ctx)
 
     def dict_to_xml(self):
-        self.xml_writer.process(self.export_ctx.scene_data)
+        with self.export_ctx.profile('write_xml'):
+            if self.streaming:
+                # The entries are already written, only the main file is left
+                self.xml_writer.close()
+            else:
+                self.xml_writer.process(self.export_ctx.scene_data)
+            # Paths of the written files, relative to the scene folder except the main one
+            file_paths = [self.xml_path] + [os.path.join(self.export_ctx.directory, name) for name in self.xml_writer.file_names[1:]]
+            if self.staging_dir is not None:
+                file_names = [os.path.basename(self.xml_path)] + self.xml_writer.file_names[1:] + self.fragment_names
+                file_paths = incremental.commit_staged_files(self.staging_dir, self.export_ctx.directory, file_names)
+                self.staging_dir = None
+            if self.export_ctx.profiler is not None:
+                self.export_ctx.profiler.add_bytes(sum(os.path.getsize(path) for path in file_paths))
+
+    def discard_staging(self):
+        '''
+        Remove the XML files of a failed incremental export, leaving the previous ones untouched.
+        '''
+        if self.staging_dir is not None:
+            self.xml_writer.exit()
+            shutil.rmtree(self.staging_dir, ignore_errors=True)
+            self.staging_dir = None
+
+    def dict_to_bundle(self):
+        with self.export_ctx.profile('write_bundle'):
+            self.export_ctx.bundle.close(self.export_ctx.scene_data)
 
     def aux_dict_to_yml(self):
         import yaml
@@ -136,3 +348,138 @@ class SceneConverter:
     def dict_to_scene(self):
         from mitsuba import load_dict
         return load_dict(self.export_ctx.scene_data)
+
+def export_scene(filepath, b_scene=None, view_layer=None, use_selection=False, split_files=False,
+                 export_ids=False, ignore_background=True, axis_forward='-Z', axis_up='Y',
+                 ply_writer_threads=4, mesh_cache_dir=None, incremental=False, window_manager=None,
+                 animation=None, streaming=False, bundle=False, profile=False):
+    '''
+    Export a blender scene to a Mitsuba XML file.
+    Same as the export operator, without a user interface: this is the entry point for scripts
+    and background blender processes (e.g. scripts/batch_export.py).
+
+    Params
+    ------
+    filepath: Path of the scene XML file
+    b_scene: Scene to export, defaults to the scene of the context
+    view_layer: View layer to export, defaults to the one of the context for its scene,
+                or the first view layer used for rendering
+    use_selection: Only export the selected objects
+    split_files: Split the scene XML file in smaller fragments
+    export_ids: Add an 'id' field for each object
+    ignore_background: Ignore blender's default constant gray background
+    axis_forward, axis_up: Axes of the exported scene
+    ply_writer_threads: Number of background threads writing the meshes
+    mesh_cache_dir: Folder of the mesh cache. None disables the cache, '' uses the default folder
+    incremental: Only re-export the objects that changed since the previous export to this file
+    window_manager: Window manager reporting the progress, if any
+    animation: AnimationState shared with the other frames, when exporting an animation
+    streaming: Write the XML entries while walking the scene, so that they are not all kept in memory
+    bundle: Write a single scene bundle file (see io/bundle.py) instead of XML, mesh and texture files.
+            Not supported with incremental, streaming and animation exports.
+    profile: Time the stages of the export and the exported objects, and write the report
+             next to the scene as <name>.profile.json (see profiler.py)
+
+    Returns the SceneConverter used for the export, e.g. for its cache statistics.
+    '''
+    from bpy_extras.io_utils import axis_conversion
+    if bundle and (incremental or streaming or animation is not None):
+        raise ValueError('Scene bundles are not supported with incremental, streaming or animation exports')
+    if b_scene is None:
+        b_scene = bpy.context.scene
+    if view_layer is None:
+        if b_scene == bpy.context.scene:
+            view_layer = bpy.context.view_layer
+        else:
+            view_layer = next((layer for layer in b_scene.view_layers if layer.use), b_scene.view_layers[0])
+
+    converter = SceneConverter()
+    converter.export_ctx.axis_mat = axis_conversion(to_forward=axis_forward, to_up=axis_up).to_4x4()
+    converter.export_ctx.export_ids = export_ids
+    converter.use_selection = use_selection
+    converter.ignore_background = ignore_background
+    converter.ply_writer_threads = ply_writer_threads
+    converter.incremental = incremental
+    converter.streaming = streaming
+    converter.bundle = bundle
+    if profile:
+        converter.export_ctx.profiler = profiler.ExportProfiler()
+    if animation is not None:
+        converter.export_ctx.animation = animation
+        converter.export_ctx.exported_textures = animation.textures
+    converter.set_path(filepath, split_files=split_files)
+    if mesh_cache_dir is not None and not bundle:
+        converter.enable_mesh_cache(bpy.path.abspath(mesh_cache_dir))
+
+    try:
+        # The evaluated depsgraph of the context is the one of the active scene and view layer
+        with bpy.context.temp_override(scene=b_scene, view_layer=view_layer):
+            depsgraph = bpy.context.evaluated_depsgraph_get()
+            if window_manager is not None:
+                window_manager.progress_begin(0, len(depsgraph.object_instances))
+            try:
+                converter.scene_to_dict(depsgraph, window_manager)
+            finally:
+                if window_manager is not None:
+                    window_manager.progress_end()
+    except BaseException:
+        if bundle:
+            converter.export_ctx.bundle.abort()
+        converter.discard_staging()
+        raise
+    if bundle:
+        converter.dict_to_bundle()
+    else:
+        try:
+            converter.dict_to_xml()
+        except BaseException:
+            converter.discard_staging()
+            raise
+    if profile:
+        converter.profile_path = f"{os.path.splitext(filepath)[0]}.profile.json"
+        converter.export_ctx.profiler.write(converter.profile_path)
+    return converter
+
+def export_animation(filepath, frame_start, frame_end, frame_step=1, b_scene=None, view_layer=None,
+                     window_manager=None, **options):
+    '''
+    Export a frame range of a blender scene, as one Mitsuba XML file per frame, named <name>_<frame>.xml.
+    The frames share their meshes and textures: meshes are exported in local space with their
+    transform in the XML file, and only the meshes that deform get a new PLY file.
+
+    Params
+    ------
+    filepath: Path of the scene XML file, the frame number is added to it
+    frame_start, frame_end: First and last frame to export (inclusive)
+    frame_step: Number of frames between two exported frames
+    b_scene, view_layer: Scene and view layer to export, see export_scene
+    window_manager: Window manager reporting the progress, if any
+    options: Other export options, see export_scene. Incremental export is not supported.
+
+    Returns the list of exported XML files and the AnimationState, e.g. for its file statistics.
+    '''
+    if options.get('incremental'):
+        raise ValueError('Incremental export is not supported for animations')
+    if b_scene is None:
+        b_scene = bpy.context.scene
+    base_path, ext = os.path.splitext(filepath)
+    frames = range(frame_start, frame_end + 1, frame_step)
+    animation = incremental.AnimationState()
+    frame_files = []
+    current_frame, current_subframe = b_scene.frame_current, b_scene.frame_subframe
+    if window_manager is not None:
+        window_manager.progress_begin(0, len(frames))
+    try:
+        for i, frame in enumerate(frames):
+            b_scene.frame_set(frame)
+            animation.frame = frame
+            frame_path = f"{base_path}_{frame:04d}{ext}"
+            export_scene(frame_path, b_scene, view_layer, animation=animation, **options)
+            frame_files.append(frame_path)
+            if window_manager is not None:
+                window_manager.progress_update(i + 1)
+    finally:
+        b_scene.frame_set(current_frame, subframe=current_subframe)
+        if window_manager is not None:
+            window_manager.progress_end()
+    return frame_files, animation
@@ -35,7 +35,7 @@ def export_camera(camera_instance, b_scene, export_ctx, auxiliary_output_dict =
     #TODO: enable focus thin lens / cam.dof
 
     init_rot = Matrix.Rotation(np.pi, 4, 'Y')
-    params['to_world'] = export_ctx.transform_matrix(b_camera.matrix_world @ init_rot)
+    params['to_world'] = export_ctx.object_transform(b_camera, init_rot, camera_instance.is_instance)
 
     if b_scene.render.engine == 'MITSUBA':
         sampler = getattr(b_camera.data.mitsuba.samplers, b_camera.data.mitsuba.active_sampler).to_dict()
@@ -1,6 +1,8 @@
 from collections import OrderedDict
+from contextlib import nullcontext
 import os
 from shutil import copy2
+import numpy as np
 from numpy import pi
 
 from mathutils import Matrix
@@ -19,6 +21,9 @@ texture_exts = {
     'TARGA_RAW': '.tga',
 }
 
+# Formats Mitsuba can read as is: on-disk images in these formats are copied instead of re-encoded
+copyable_formats = {'BMP', 'HDR', 'JPEG', 'PNG', 'OPEN_EXR', 'TARGA', 'TARGA_RAW'}
+
 convert_format = {
     'CINEON': 'EXR',
     'DPX': 'EXR',
@@ -26,6 +31,8 @@ convert_format = {
     'IRIS': 'PNG'
 }
 
+_not_profiled = nullcontext()
+
 class ExportedMaterialsCache:
     '''
     Store a list of the exported materials, that have both a BSDF and an emitter
@@ -50,6 +57,88 @@ class ExportedMaterialsCache:
         """
         return mat_id in self.mats.keys()
 
+class MeshCache:
+    '''
+    Persistent, content-addressed store of exported PLY meshes.
+    Files are named after a hash of the mesh buffers they were built from, and
+    are hard-linked (or copied, if linking fails) to their place in the exported scene.
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    def cached_path(self, key):
+        return os.path.join(self.directory, f"{key}.ply")
+
+    def fetch(self, key, target_path):
+        """
+        Place the cached mesh for the given key at target_path.
+        Returns False if the key is not in the cache.
+        """
+        cached_path = self.cached_path(key)
+        if not os.path.isfile(cached_path):
+            self.misses += 1
+            # The stale file may be hard-linked to another cache entry: never write through it
+            if os.path.lexists(target_path):
+                os.remove(target_path)
+            return False
+        self._link(cached_path, target_path)
+        self.hits += 1
+        return True
+
+    def store(self, key, source_path):
+        """
+        Add a freshly written mesh file to the cache.
+        """
+        # This may run on several PLY writer threads at once
+        os.makedirs(self.directory, exist_ok=True)
+        cached_path = self.cached_path(key)
+        if not os.path.isfile(cached_path):
+            self._link(source_path, cached_path)
+
+    @staticmethod
+    def _link(source_path, target_path):
+        if os.path.exists(target_path):
+            if os.path.samefile(source_path, target_path):
+                return
+            os.remove(target_path)
+        try:
+            os.link(source_path, target_path)
+        except OSError: # Different file systems, or no hard link support
+            copy2(source_path, target_path)
+
+class InstanceBuffer:
+    '''
+    World matrices of the instances of a shapegroup, in blender's coordinate system.
+    Each matrix is copied in a preallocated (N, 4, 4) float32 array as it is added,
+    instead of keeping a list of blender matrices to convert at the end.
+    Blender matrices are single precision, so nothing is lost.
+    '''
+    initial_capacity = 1024
+
+    def __init__(self):
+        self.data = np.empty((self.initial_capacity, 4, 4), dtype=np.float32)
+        self.count = 0
+
+    def append(self, matrix):
+        if self.is_full():
+            # Double the capacity, so that adding N matrices copies O(N) of them
+            data = np.empty((2 * len(self.data), 4, 4), dtype=np.float32)
+            data[:self.count] = self.data
+            self.data = data
+        self.data[self.count] = matrix
+        self.count += 1
+
+    def is_full(self):
+        return self.count == len(self.data)
+
+    def matrices(self):
+        return self.data[:self.count]
+
+    def clear(self):
+        self.count = 0
+
 class Files:
     MAIN = 0
     MATS = 1
@@ -67,8 +156,29 @@ class ExportContext:
         self.scene_data = OrderedDict([('type','scene')])
         self.counter = 0 # Counter to create unique IDs.
         self.exported_mats = ExportedMaterialsCache()
+        self.material_ids = {} # Material name -> id of its exported BSDF, shared by identical materials
+        self.material_cache = {} # Structural hash of a material -> id of its exported BSDF
         self.export_ids = False # Export Object IDs in the XML file
         self.exported_ids = set()
+        self.exported_textures = {} # (image, colorspace) -> path of the exported texture
+        self.mesh_cache = None # Set by the converter if exported meshes should be cached
+        self.ply_writer = None # Background PLY writer threads, used during scene_to_dict
+        self.keep_meshes_in_memory = False # Put Mitsuba meshes in the scene dict instead of writing PLY files
+        self.manifest = None # Record of the previous export, set by the converter for incremental exports
+        self.animation = None # State shared by the frames of an animation export, set by the converter
+        self.shared_meshes = set() # Names of the meshes used by several exported objects, set by the converter
+        self.mesh_groups = {} # Key of a shared mesh -> (name, parts, whether it is a shapegroup), see geometry.export_shared_mesh
+        self.mesh_group_names = set()
+        self.instances = {} # Shapegroup id -> InstanceBuffer of its instances, added in bulk by the converter
+        self.instance_streams = None # Shapegroup id -> InstanceStream writing its fragment, set to a dict by the converter when streaming
+        self.scene_name = '' # Name of the scene file without its extension, set by the converter
+        self.fragment_directory = None # Folder where the instance fragments are written if not the scene folder, set by the converter for incremental exports
+        self.world_matrices = {} # Object name -> world matrix in Mitsuba's coordinate system, see world_matrix
+        self.loaded_dicts = {} # Dicts of the entries replaced by Mitsuba objects in data_load
+        self.bundle = None # Scene bundle writer, set by the converter to store meshes and files in a single file
+        self.xml_stream = None # Streaming XML writer, set by the converter to write entries as they are added
+        self.streamed_ids = set() # Names given to the entries written by the streaming writer
+        self.profiler = None # ExportProfiler timing the export, set by export_scene when profiling
         # All the args defined below are set in the Converter
         self.directory = ''
         self.axis_mat = Matrix() # Coordinate shift
@@ -87,20 +197,33 @@ class ExportContext:
         If a name is provided it will be used as the key of the element.
         Otherwise the Id of the element is used if it exists
         or a new key is generated incrementally.
+        When streaming, the element is written to the XML file instead,
+        and only its name is kept if it was given.
         '''
-        if mts_dict is None or not isinstance(mts_dict, dict) or len(mts_dict) == 0 or 'type' not in mts_dict:
+        if isinstance(mts_dict, dict):
+            if len(mts_dict) == 0 or 'type' not in mts_dict:
+                return False
+        elif not self.is_mitsuba_object(mts_dict): # Already instantiated objects are valid entries too
             return False
 
+        is_named = True
         if not name:
             try:
                 name = mts_dict['id']
                 #remove the corresponding entry
                 del mts_dict['id']
 
-            except KeyError:
+            except (KeyError, TypeError):
                 name = 'elm__%i' % self.counter
+                is_named = False
 
-        self.scene_data.update([(name, mts_dict)])
+        if self.xml_stream is not None:
+            # Generated names are never referenced, they don't need to be remembered
+            self.xml_stream.add_entry(name, mts_dict, keep_id=is_named)
+            if is_named:
+                self.streamed_ids.add(name)
+        else:
+            self.scene_data.update([(name, mts_dict)])
         self.counter += 1
 
         return True
@@ -108,6 +231,95 @@ class ExportContext:
     def data_get(self, name):
         return self.scene_data.get(name)
 
+    def data_has(self, name):
+        '''
+        Whether an element was added with the given name, even if it was already written by the streaming writer.
+        '''
+        return name in self.scene_data or name in self.streamed_ids
+
+    def material_id(self, b_mat):
+        '''
+        Id of the exported BSDF of a material. Identical materials share the id of the first one exported.
+        '''
+        return self.material_ids.get(b_mat.name, f"mat-{b_mat.name}")
+
+    def add_instance(self, shape_id, matrix):
+        '''
+        Add an instance of a shapegroup. Instances are gathered per shapegroup,
+        and added to the scene in one batch at the end of the export.
+
+        Params
+        ------
+        shape_id: Id of the shapegroup
+        matrix: World matrix of the instance, in blender's coordinate system
+        '''
+        buffer = self.instances.get(shape_id)
+        if buffer is None:
+            buffer = self.instances[shape_id] = InstanceBuffer()
+        elif buffer.is_full() and self.instance_streams is not None:
+            # When streaming, only one block of matrices per shapegroup is kept in memory
+            self.flush_instances(shape_id)
+        buffer.append(matrix)
+
+    def flush_instances(self, shape_id):
+        '''
+        Write the buffered instances of a shapegroup to its fragment, when streaming.
+        Returns the stream of the fragment.
+        '''
+        stream = self.instance_streams.get(shape_id)
+        if stream is None:
+            from .instance_writer import InstanceStream
+            stream = self.instance_streams[shape_id] = InstanceStream(self.instance_fragment_path(shape_id), shape_id)
+        buffer = self.instances[shape_id]
+        stream.write(self.transform_matrices(buffer.matrices()))
+        buffer.clear()
+        return stream
+
+    def instance_fragment(self, shape_id):
+        '''
+        Path of the fragment listing the instances of a shapegroup, relative to the scene folder.
+        They are next to the fragments of split scenes, named after the scene file.
+        '''
+        return f"fragments/{self.scene_name}-instances-{shape_id}.xml"
+
+    def instance_fragment_path(self, shape_id):
+        '''
+        Path where the fragment of a shapegroup is written: in the scene folder,
+        or in the staging folder of an incremental export (see incremental.commit_staged_files).
+        '''
+        return os.path.join(self.fragment_directory or self.directory, self.instance_fragment(shape_id))
+
+    def instance_matrices(self, shape_id):
+        '''
+        (N, 4, 4) to_world matrices of the instances of a shapegroup, in Mitsuba's coordinate system.
+        '''
+        return self.transform_matrices(self.instances[shape_id].matrices())
+
+    @staticmethod
+    def is_mitsuba_object(value):
+        from mitsuba import Object
+        return isinstance(value, Object)
+
+    def data_load(self, name):
+        '''
+        Instantiate an element of the scene dict with load_dict.
+        The entry is replaced by the loaded object, so that it is only created once
+        and the final load_dict call reuses it.
+        '''
+        entry = self.scene_data[name]
+        if isinstance(entry, dict):
+            from mitsuba import load_dict
+            self.loaded_dicts[name] = entry
+            entry = load_dict(entry)
+            self.scene_data[name] = entry
+        return entry
+
+    def data_dict(self, name):
+        '''
+        Return the dict of an element of the scene dict, even if it was instantiated by data_load.
+        '''
+        return self.loaded_dicts.get(name, self.scene_data.get(name))
+
     def log(self, message, level='INFO'):
         '''
         Log something using mitsuba's logging API
@@ -130,15 +342,36 @@ class ExportContext:
             raise ValueError("Invalid logging level '%s'!" % level)
         Log(log_level[level], message)
 
+    def profile(self, stage, object_name=None):
+        '''
+        Context manager timing a stage of the export, when profiling is enabled.
+        See profiler.ExportProfiler.stage
+        '''
+        if self.profiler is None:
+            return _not_profiled
+        return self.profiler.stage(stage, object_name)
+
     def export_texture(self, image):
         """
         Return the path to a texture.
-        Ensure the image is on disk and of a correct type
+        Ensure the image is on disk and of a correct type.
+        Each image is only exported once, and images that are already on disk
+        in a format supported by Mitsuba are copied rather than re-encoded.
 
         image : The Blender Image object
         """
+        texture_key = (image.name_full, image.colorspace_settings.name)
+        if texture_key in self.exported_textures:
+            return self.exported_textures[texture_key]
+        with self.profile('export_texture'):
+            texture_path = self._export_texture(image)
+        self.exported_textures[texture_key] = texture_path
+        return texture_path
+
+    def _export_texture(self, image):
         # TODO: don't save packed images but convert them to a mitsuba texture, and let the XML writer save
         textures_folder = os.path.join(self.directory, self.subfolders['texture'])
+        source_path = self.texture_source_path(image)
         if image.file_format in convert_format:
             msg = "Image format of '%s' is not supported. Converting it to %s." % (image.name, convert_format[image.file_format])
             self.log(msg, 'WARN')
@@ -147,17 +380,64 @@ class ExportContext:
         if original_name != '' and image.name.startswith(original_name): # Try to remove extensions from names of packed files to avoid stuff like 'Image.png.001.png'
             base_name, _ = os.path.splitext(original_name)
             name = image.name.replace(original_name, base_name, 1) # Remove the extension
-            name += texture_exts[image.file_format]
         else:
-            name = "%s%s" % (image.name, texture_exts[image.file_format])
+            name = image.name
+        if source_path is not None:
+            # Keep the extension of the copied file
+            name += os.path.splitext(source_path)[1]
+        else:
+            name += texture_exts[image.file_format]
         target_path = os.path.join(textures_folder, name)
         if not os.path.isdir(textures_folder):
             os.makedirs(textures_folder)
-        old_filepath = image.filepath
-        image.filepath_raw = target_path
-        image.save()
-        image.filepath_raw = old_filepath
-        return f"{self.subfolders['texture']}/{name}"
+        written = True
+        if source_path is not None:
+            if self.bundle is None and not self.is_same_file(source_path, target_path):
+                copy2(source_path, target_path)
+            else:
+                written = self.bundle is not None
+        elif self.manifest is not None and self.manifest.is_unchanged(image) and os.path.isfile(target_path):
+            written = False # Already encoded by the previous export
+        else:
+            # Packed, generated or edited images need to be encoded
+            old_filepath = image.filepath
+            image.filepath_raw = target_path
+            image.save()
+            image.filepath_raw = old_filepath
+        texture_path = f"{self.subfolders['texture']}/{name}"
+        if self.bundle is not None:
+            # Bundled from its source file, or from the encoded image in the staging folder
+            self.bundle.add_file(texture_path, source_path or target_path)
+        if self.profiler is not None and written:
+            self.profiler.add_bytes(os.path.getsize(source_path or target_path))
+        return texture_path
+
+    @staticmethod
+    def texture_source_path(image):
+        """
+        Return the path of the file backing an image, if it can be copied as is, else None.
+        """
+        if image.source != 'FILE' or image.packed_file is not None or image.is_dirty:
+            return None
+        if image.file_format not in copyable_formats:
+            return None
+        source_path = bpy.path.abspath(image.filepath, library=image.library)
+        if not os.path.isfile(source_path):
+            return None
+        return source_path
+
+    @staticmethod
+    def is_same_file(source_path, target_path):
+        """
+        Check whether target_path is source_path or an up to date copy of it.
+        """
+        if not os.path.isfile(target_path):
+            return False
+        if os.path.samefile(source_path, target_path):
+            return True
+        source_stat, target_stat = os.stat(source_path), os.stat(target_path)
+        # copy2 preserves modification times
+        return source_stat.st_size == target_stat.st_size and source_stat.st_mtime == target_stat.st_mtime
 
     def spectrum(self, value, mode='rgb'):
         '''
@@ -204,13 +484,60 @@ class ExportContext:
 
         return spec
 
+    def transform_matrices(self, matrices):
+        '''
+        Apply the coordinate shift to many matrices at once, with a single matrix product.
+
+        Params
+        ------
+        matrices: (N, 4, 4) array, or sequence of 4x4 blender matrices
+
+        Returns a (N, 4, 4) float64 array, in Mitsuba's coordinate system.
+        '''
+        return np.asarray(self.axis_mat, dtype=np.float64) @ np.asarray(matrices, dtype=np.float64)
+
+    def world_matrix(self, b_object, is_instance=False):
+        '''
+        World matrix of an object in Mitsuba's coordinate system, as a (4, 4) array.
+        It is converted once per object, and reused by everything exported for it (shapes, emitters, sensors).
+        The evaluated object of instances is reused by the depsgraph iterator, so instances are not cached.
+
+        Params
+        ------
+        b_object: The evaluated blender object
+        is_instance: Whether the object comes from a depsgraph instance
+        '''
+        if is_instance:
+            return self.transform_matrices([b_object.matrix_world])[0]
+        matrix = self.world_matrices.get(b_object.name_full)
+        if matrix is None:
+            matrix = self.transform_matrices([b_object.matrix_world])[0]
+            self.world_matrices[b_object.name_full] = matrix
+        return matrix
+
+    def object_transform(self, b_object, local_matrix=None, is_instance=False):
+        '''
+        Mitsuba to_world transform of a plugin exported for an object.
+
+        Params
+        ------
+        b_object: The evaluated blender object
+        local_matrix: Matrix applied before the object's transform, e.g. to orient the plugin like the object
+        is_instance: Whether the object comes from a depsgraph instance
+        '''
+        from mitsuba import ScalarTransform4f
+        matrix = self.world_matrix(b_object, is_instance)
+        if local_matrix is not None:
+            matrix = matrix @ np.asarray(local_matrix, dtype=np.float64)
+        return ScalarTransform4f(matrix)
+
     def transform_matrix(self, matrix):
         '''
         Apply coordinate shift and convert to a mitsuba Transform 4f
         '''
         from mitsuba import ScalarTransform4f
         if len(matrix) == 4:
-            mat = self.axis_mat @ matrix
+            mat = self.transform_matrices([matrix])[0]
         else: #3x3
-            mat = matrix.to_4x4()
-        return ScalarTransform4f(list([list(x) for x in mat]))
+            mat = np.asarray(matrix.to_4x4(), dtype=np.float64)
+        return ScalarTransform4f(mat)
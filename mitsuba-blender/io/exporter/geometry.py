@@ -1,100 +1,552 @@
 import os
+import hashlib
+import tempfile
+from collections import defaultdict
+import numpy as np
 import bpy
 
 from .materials import export_material
+from . import ply_writer
 # from .export_context import Files, ExportContext
 
 
-def convert_mesh(export_ctx, b_mesh, matrix_world, name, mat_nr):
+class MeshPart:
     '''
-    This method creates a mitsuba mesh from a blender mesh and returns it.
-    It constructs a dictionary containing the necessary info such as
-    pointers to blender's data strucures and then loads the BlenderMesh
-    plugin via load_dict.
+    Triangle mesh buffers of the part of a blender mesh that uses one material.
+    Buffers are stored as numpy arrays, in Mitsuba's coordinate system.
+    '''
+    def __init__(self, name, positions, faces, normals=None, uvs=None, attributes=None):
+        self.name = name
+        self.positions = positions # (N, 3) float32
+        self.faces = faces # (F, 3) uint32
+        self.normals = normals # (N, 3) float32 or None
+        self.uvs = uvs # (N, 2) float32 or None
+        self.attributes = attributes if attributes is not None else {} # name -> (N, C) float32
+
+    def face_count(self):
+        return len(self.faces)
+
+    def vertex_count(self):
+        return len(self.positions)
+
+    def has_vertex_normals(self):
+        return self.normals is not None
+
+    def to_mitsuba(self, props=None):
+        '''
+        Create a Mitsuba mesh from the buffers.
+
+        props: Optional mitsuba Properties given to the mesh constructor (e.g. its BSDF)
+        '''
+        from mitsuba import Mesh, Properties, traverse
+        mts_mesh = Mesh(self.name, self.vertex_count(), self.face_count(),
+                        props=props if props is not None else Properties(),
+                        has_vertex_normals=self.has_vertex_normals(),
+                        has_vertex_texcoords=self.uvs is not None)
+        for attr_name, values in self.attributes.items():
+            mts_mesh.add_attribute(attr_name, values.shape[1], values.ravel())
+        params = traverse(mts_mesh)
+        params['vertex_positions'] = self.positions.ravel()
+        params['faces'] = self.faces.ravel()
+        if self.uvs is not None:
+            params['vertex_texcoords'] = self.uvs.ravel()
+        params.update()
+        if self.normals is not None:
+            # Updating the positions recomputes the vertex normals, set them afterwards
+            params['vertex_normals'] = self.normals.ravel()
+            params.update()
+        return mts_mesh
+
+    def write_ply(self, filepath):
+        ply_writer.write_ply(filepath, self.positions, self.faces, self.normals, self.uvs, self.attributes)
+
+
+def _foreach_get(collection, attr, count, dtype):
+    '''
+    Read an attribute of every element of a blender collection into a flat numpy array.
+    '''
+    buffer = np.empty(count, dtype=dtype)
+    collection.foreach_get(attr, buffer)
+    return buffer
+
+
+class MeshBuffers:
+    '''
+    Triangulated data of a blender mesh, read once with bulk foreach_get calls.
+
+    Triangles are bucketed by material index, so building every per-material
+    MeshPart is linear in the number of triangles instead of being proportional
+    to triangles x material slots.
+    '''
+    def __init__(self, export_ctx, b_mesh, to_world, name, mat_count):
+        '''
+        Params
+        ------
+        export_ctx:   The export context.
+        b_mesh:       The blender mesh to export.
+        to_world:     The mesh's (4, 4) transform in Mitsuba's coordinate system (see ExportContext.world_matrix),
+                      or None if it should not be baked in the vertices.
+        name:         The name of the mesh, for logging purposes.
+        mat_count:    The number of material slots of the mesh. If it is 0, all triangles go to part 0.
+        '''
+        self.name = name
+        self.slot_count = max(mat_count, 1)
+
+        if bpy.app.version < (4, 0, 0):
+            b_mesh.calc_normals()
+        if bpy.app.version < (4, 1, 0):
+            # Split normals are computed on demand starting with Blender 4.1
+            b_mesh.calc_normals_split()
+        # Compute the triangle tesselation
+        b_mesh.calc_loop_triangles()
+
+        tri_count = len(b_mesh.loop_triangles)
+        self.tri_count = tri_count
+        if tri_count == 0:
+            export_ctx.log(f"Mesh: {name} has no faces. Skipping.", 'WARN')
+
+        loop_tris = b_mesh.loop_triangles
+        self.tri_loops = _foreach_get(loop_tris, 'loops', 3 * tri_count, np.int32)
+        self.tri_verts = _foreach_get(loop_tris, 'vertices', 3 * tri_count, np.int32)
+        self.tri_smooth = _foreach_get(loop_tris, 'use_smooth', tri_count, bool)
+        self.tri_normals = _foreach_get(loop_tris, 'split_normals', 9 * tri_count, np.float32).reshape(-1, 3)
+        if mat_count > 0:
+            self.tri_mats = _foreach_get(loop_tris, 'material_index', tri_count, np.int32)
+        else:
+            self.tri_mats = np.zeros(tri_count, dtype=np.int32)
+
+        vert_count = len(b_mesh.vertices)
+        self.positions = _foreach_get(b_mesh.vertices, 'co', 3 * vert_count, np.float32).reshape(-1, 3)
+
+        # Per-corner attributes, indexed by loop
+        loop_count = len(b_mesh.loops)
+        if len(b_mesh.uv_layers) > 1:
+            export_ctx.log(f"Mesh: '{name}' has multiple UV layers. Mitsuba only supports one. Exporting the one set active for render.", 'WARN')
+        self.loop_uvs = None
+        for uv_layer in b_mesh.uv_layers:
+            if uv_layer.active_render: # If there is only 1 UV layer, it is always active
+                self.loop_uvs = _foreach_get(uv_layer.data, 'uv', 2 * loop_count, np.float32).reshape(-1, 2)
+                # Mitsuba's UV origin is the top left corner
+                self.loop_uvs[:, 1] = 1.0 - self.loop_uvs[:, 1]
+                break
+
+        self.loop_colors = {}
+        for color_layer in b_mesh.vertex_colors:
+            colors = _foreach_get(color_layer.data, 'color', 4 * loop_count, np.float32).reshape(-1, 4)
+            self.loop_colors[f'vertex_{color_layer.name}'] = np.ascontiguousarray(colors[:, :3])
+
+        # Apply coordinate change
+        self.to_world = None
+        if to_world is not None:
+            self.to_world = np.asarray(to_world, dtype=np.float64)
+            self.positions = (self.positions @ self.to_world[:3, :3].T + self.to_world[:3, 3]).astype(np.float32)
+            normal_mat = np.linalg.inv(self.to_world[:3, :3]).T
+            tri_normals = self.tri_normals @ normal_mat.T
+            tri_normals /= np.maximum(np.linalg.norm(tri_normals, axis=1, keepdims=True), 1e-12)
+            self.tri_normals = tri_normals.astype(np.float32)
+
+        # Bucket the triangles by material index in a single pass
+        self.tri_order = np.argsort(self.tri_mats, kind='stable')
+        self.tri_bounds = np.searchsorted(self.tri_mats[self.tri_order], np.arange(self.slot_count + 1))
+
+    def material_triangles(self, mat_nr):
+        '''
+        Indices of the triangles using a given material slot.
+        '''
+        return self.tri_order[self.tri_bounds[mat_nr]:self.tri_bounds[mat_nr + 1]]
+
+    def used_materials(self):
+        '''
+        Material slots that have at least one triangle.
+        '''
+        return [mat_nr for mat_nr in range(self.slot_count) if self.tri_bounds[mat_nr + 1] > self.tri_bounds[mat_nr]]
+
+    def has_smooth_faces(self, mat_nr):
+        '''
+        Whether vertex normals are needed for a material slot. Otherwise Mitsuba uses face normals.
+        '''
+        return bool(self.tri_smooth[self.material_triangles(mat_nr)].any())
+
+    def digest(self):
+        '''
+        Hash of all the buffers that contribute to the exported meshes.
+        '''
+        h = hashlib.blake2b(digest_size=16)
+        for buffer in (self.tri_loops, self.tri_verts, self.tri_smooth, self.tri_normals,
+                       self.tri_mats, self.positions, self.loop_uvs, self.to_world):
+            h.update(b'-' if buffer is None else np.ascontiguousarray(buffer).tobytes())
+        for attr_name, colors in sorted(self.loop_colors.items()):
+            h.update(attr_name.encode('utf-8'))
+            h.update(colors.tobytes())
+        return h.hexdigest()
+
+    def build_part(self, mat_nr, name=None):
+        '''
+        Build the MeshPart of a given material slot.
+        '''
+        tris = self.material_triangles(mat_nr)
+        corners = (3 * tris[:, None] + np.arange(3)).ravel()
+        corner_verts = self.tri_verts[corners]
+        corner_loops = self.tri_loops[corners]
+
+        use_normals = self.has_smooth_faces(mat_nr)
+        columns = [corner_verts.astype(np.float64)[:, None]]
+        if use_normals:
+            columns.append(self.tri_normals[corners])
+        if self.loop_uvs is not None:
+            columns.append(self.loop_uvs[corner_loops])
+        for colors in self.loop_colors.values():
+            columns.append(colors[corner_loops])
+
+        # Merge corners that share the same vertex and attributes
+        keys = np.ascontiguousarray(np.hstack(columns).astype(np.float64))
+        keys = keys.view(np.dtype((np.void, keys.dtype.itemsize * keys.shape[1]))).ravel()
+        _, first_corner, corner_to_vert = np.unique(keys, return_index=True, return_inverse=True)
+        unique_loops = corner_loops[first_corner]
+
+        return MeshPart(
+            name or self.name,
+            self.positions[corner_verts[first_corner]],
+            corner_to_vert.reshape(-1, 3).astype(np.uint32),
+            normals=self.tri_normals[corners][first_corner] if use_normals else None,
+            uvs=self.loop_uvs[unique_loops] if self.loop_uvs is not None else None,
+            attributes={attr_name: colors[unique_loops] for attr_name, colors in self.loop_colors.items()}
+        )
+
+
+def write_mesh_part(export_ctx, mesh_buffers, part_nr, name, filepath, cache_key=None):
+    '''
+    Build one mesh part and save it as binary PLY. This does not touch blender data,
+    so it can run on the PLY writer threads.
+    '''
+    mesh_buffers.build_part(part_nr, name).write_ply(filepath)
+    if export_ctx.profiler is not None:
+        export_ctx.profiler.add_bytes(os.path.getsize(filepath))
+    if cache_key is not None:
+        export_ctx.mesh_cache.store(cache_key, filepath)
+
+
+def bundle_mesh_part(export_ctx, mesh_buffers, part_nr, name, filename):
+    '''
+    Build one mesh part and add its buffers to the scene bundle, under its path in the scene.
+    Like write_mesh_part, this can run on the PLY writer threads.
+    '''
+    part = mesh_buffers.build_part(part_nr, name)
+    export_ctx.bundle.add_mesh(filename, part.positions, part.faces, part.normals, part.uvs, part.attributes)
+    if export_ctx.profiler is not None:
+        export_ctx.profiler.add_bytes(sum(array.nbytes for array in (part.positions, part.faces, part.normals, part.uvs,
+                                                                     *part.attributes.values()) if array is not None))
+
+
+def in_memory_mesh(export_ctx, mesh_part, params):
+    '''
+    Create the Mitsuba mesh described by a 'ply' shape dict directly from the mesh buffers,
+    so that it can be put in the scene dict without going through a file.
+    The referenced BSDF is instantiated (once) from the scene dict.
+    Emissive meshes are the exception: Mitsuba builds their sampling table in the Mesh constructor
+    and has no way to add an emitter to an existing mesh, so they still go through a temporary PLY file.
+    '''
+    from mitsuba import Properties, load_dict
+    bsdf = export_ctx.data_load(params['bsdf']['id'])
+    if 'emitter' in params:
+        # The Mesh constructor fails for an emissive mesh without its data (empty sampling table)
+        with tempfile.TemporaryDirectory() as directory:
+            filepath = os.path.join(directory, 'mesh.ply')
+            mesh_part.write_ply(filepath)
+            return load_dict({
+                'type': 'ply',
+                'filename': filepath,
+                'face_normals': params.get('face_normals', False),
+                'bsdf': bsdf,
+                'emitter': params['emitter'],
+            })
+    props = Properties()
+    props['bsdf'] = bsdf
+    return mesh_part.to_mitsuba(props)
+
+
+def mesh_part_params(export_ctx, b_object, part, auxiliary_output_dict=None):
+    '''
+    Build the scene dict entry of an exported mesh part, referencing its material.
 
     Params
     ------
-    export_ctx:   The export context.
-    b_mesh:       The blender mesh to export.
-    matrix_world: The mesh's transform matrix.
-    name:         The name to give to the mesh. It will not be saved, so this is mostly
-                  for logging/debug purposes.
-    mat_nr:       The material ID to export.
-    '''
-    from mitsuba import load_dict, Point3i
-    props = {
-        'type': 'blender',
-        'version': ".".join(map(str,bpy.app.version))
+    export_ctx: The export context
+    b_object: The blender object the part belongs to
+    part: Dict with the name, material slot and shading of the part
+    auxiliary_output_dict: Set of the optimizable materials, if auxiliary outputs are exported
+    '''
+    params = {
+        'type': 'ply',
+        'filename': f"{export_ctx.subfolders['shape']}/{part.get('file', part['name'])}.ply"
     }
 
-    if bpy.app.version < (4, 0, 0):
-        b_mesh.calc_normals()
-    # Compute the triangle tesselation
-    b_mesh.calc_loop_triangles()
+    # Add flat shading flag if needed
+    if part['face_normals']:
+        params["face_normals"] = True
+
+    # Add material info
+    mat_nr = part['mat_nr']
+    if mat_nr == -1:
+        if not export_ctx.data_has('default-bsdf'): # We only need to add it once
+            default_bsdf = {
+                'type': 'twosided',
+                'id': 'default-bsdf',
+                'bsdf': {'type':'diffuse'}
+            }
+            export_ctx.data_add(default_bsdf)
+        params['bsdf'] = {'type':'ref', 'id':'default-bsdf'}
+    else:
+        mat_id = export_ctx.material_id(b_object.data.materials[mat_nr])
+        if export_ctx.exported_mats.has_mat(mat_id): # Add one emitter *and* one bsdf
+            mixed_mat = export_ctx.exported_mats.mats[mat_id]
+            params['bsdf'] = {'type': 'ref', 'id': mixed_mat['bsdf']}
+            params['emitter'] = mixed_mat['emitter']
+        else:
+            params['bsdf'] = {'type': 'ref', 'id': mat_id}
 
-    props['name'] = name
-    loop_tri_count = len(b_mesh.loop_triangles)
-    if loop_tri_count == 0:
-        export_ctx.log(f"Mesh: {name} has no faces. Skipping.", 'WARN')
-        return
-    props['loop_tri_count'] = loop_tri_count
-
-    if len(b_mesh.uv_layers) > 1:
-        export_ctx.log(f"Mesh: '{name}' has multiple UV layers. Mitsuba only supports one. Exporting the one set active for render.", 'WARN')
-    for uv_layer in b_mesh.uv_layers:
-        if uv_layer.active_render: # If there is only 1 UV layer, it is always active
-            if uv_layer.name in b_mesh.attributes:
-                props['uvs'] = b_mesh.attributes[uv_layer.name].data[0].as_pointer()
-            else:
-                props['uvs'] = uv_layer.data[0].as_pointer()
-            break
+        if auxiliary_output_dict is not None:
+            optimizable_flag = b_object.data.materials[mat_nr].get("optimizable", False)
+            if optimizable_flag:
+                auxiliary_output_dict.add(mat_id)
+
+    return params
 
-    for color_layer in b_mesh.vertex_colors:
-        if color_layer.name in b_mesh.attributes:
-            props[f'vertex_{color_layer.name}'] = b_mesh.attributes[color_layer.name].data[0].as_pointer()
-        else:
-            props[f'vertex_{color_layer.name}'] = color_layer.data[0].as_pointer()
 
-    props['loop_tris'] = b_mesh.loop_triangles[0].as_pointer()
+def convert_mesh_parts(export_ctx, b_object, name_clean, transform, manifest_key=None, mesh_buffers=None):
+    '''
+    Triangulate an object, split it in one mesh per material, export its materials
+    and write the meshes to disk (unless they are kept in memory).
 
-    if '.corner_vert' in b_mesh.attributes:
-        # Blender 3.6+ layout
-        props['loops'] = b_mesh.attributes['.corner_vert'].data[0].as_pointer()
+    Params
+    ------
+    export_ctx: The export context
+    b_object: The evaluated blender object
+    name_clean: Name of the object, usable in file names
+    transform: World matrix to bake in the meshes, in Mitsuba's coordinate system, or None
+    manifest_key: Key of the object in the export manifest, if the export is incremental
+    mesh_buffers: MeshBuffers of the object, if they were already read
+
+    Returns the list of exported parts and the mesh buffers they are built from.
+    '''
+    if b_object.type == 'MESH':
+        b_mesh = b_object.data
+    else: # Metaballs, text, surfaces
+        b_mesh = b_object.to_mesh()
+
+    # Convert the mesh into one mitsuba mesh per different material
+    mat_count = len(b_mesh.materials)
+    converted_parts = []
+
+    # Triangulate and bucket the mesh by material in a single pass
+    if mesh_buffers is None:
+        with export_ctx.profile('convert_mesh'):
+            mesh_buffers = MeshBuffers(export_ctx, b_mesh, transform, name_clean, mat_count)
+    used_materials = mesh_buffers.used_materials()
+
+    if mat_count == 0: # No assigned material
+        if used_materials:
+            converted_parts.append((name_clean, -1))
     else:
-        props['loops'] = b_mesh.loops[0].as_pointer()
+        refs_per_mat = {}
+        for mat_nr in used_materials:
+            mat = b_mesh.materials[mat_nr]
+            if not mat:
+                continue
+
+            # Ensures that the exported mesh parts have unique names,
+            # even if multiple material slots refer to the same material.
+            n_mat_refs = refs_per_mat.get(mat.name, 0)
+            name = f'{name_clean}-{mat.name}'
+
+            if n_mat_refs >= 1:
+                name += f'-{n_mat_refs:03d}'
+
+            converted_parts.append((name, mat_nr))
+            refs_per_mat[mat.name] = n_mat_refs + 1
+
+            if n_mat_refs == 0:
+                # Only export this material once
+                export_material(export_ctx, mat)
+
+    manifest = export_ctx.manifest
+    animation = export_ctx.animation
+    if export_ctx.mesh_cache is not None or manifest is not None or animation is not None:
+        mesh_digest = mesh_buffers.digest()
+    else:
+        mesh_digest = None
+
+    if b_object.type != 'MESH':
+        b_object.to_mesh_clear()
+
+    parts = []
+    files = []
+    for (name, mat_nr) in converted_parts:
+        name = name_clean if len(converted_parts) == 1 else name
+        part_nr = max(mat_nr, 0)
+        part = {
+            'name': name,
+            'mat_nr': mat_nr,
+            'material': b_object.data.materials[mat_nr].name if mat_nr >= 0 else None,
+            'face_normals': not mesh_buffers.has_smooth_faces(part_nr)
+        }
+        parts.append(part)
+
+        if export_ctx.keep_meshes_in_memory:
+            continue
+
+        file_name = name
+        if animation is not None:
+            file_name, is_new = animation.part_file(name, mesh_digest)
+            part['file'] = file_name
+            if not is_new:
+                continue # Written for a previous frame
+
+        filename = f"{export_ctx.subfolders['shape']}/{file_name}.ply"
+        if export_ctx.bundle is not None:
+            write_part = bundle_mesh_part
+            if export_ctx.profiler is not None:
+                write_part = export_ctx.profiler.bind(write_part, 'bundle_mesh')
+            if export_ctx.ply_writer is not None:
+                export_ctx.ply_writer.submit(write_part, export_ctx, mesh_buffers, part_nr, name, filename)
+            else:
+                write_part(export_ctx, mesh_buffers, part_nr, name, filename)
+            continue
+
+        # Save as binary ply
+        mesh_folder = os.path.join(export_ctx.directory, export_ctx.subfolders['shape'])
+        if not os.path.isdir(mesh_folder):
+            os.makedirs(mesh_folder)
+        filepath = os.path.join(mesh_folder,  f"{file_name}.ply")
+        files.append(filename)
+        if manifest is not None and manifest.is_up_to_date(manifest_key, mesh_digest, part, filename):
+            continue # The previous export already wrote this exact mesh
+        cache_key = None
+        if export_ctx.mesh_cache is not None:
+            cache_key = f"{mesh_digest}-{part_nr}"
+        if cache_key is None or not export_ctx.mesh_cache.fetch(cache_key, filepath):
+            write_part = write_mesh_part
+            if export_ctx.profiler is not None:
+                write_part = export_ctx.profiler.bind(write_part, 'write_ply')
+            if export_ctx.ply_writer is not None:
+                export_ctx.ply_writer.submit(write_part, export_ctx, mesh_buffers, part_nr, name, filepath, cache_key)
+            else:
+                write_part(export_ctx, mesh_buffers, part_nr, name, filepath, cache_key)
 
-    if 'sharp_face' in b_mesh.attributes:
-        props['sharp_face'] = b_mesh.attributes['sharp_face'].data[0].as_pointer()
+    if manifest is not None:
+        manifest.record(manifest_key, mesh_digest, parts, files)
 
-    if bpy.app.version >= (3, 6, 0):
-        props['polys'] = b_mesh.loop_triangle_polygons[0].as_pointer()
-    else:
-        props['polys'] = b_mesh.polygons[0].as_pointer()
+    return parts, mesh_buffers
 
-    if 'position' in b_mesh.attributes:
-        # Blender 3.5+ layout
-        props['verts'] = b_mesh.attributes['position'].data[0].as_pointer()
-    else:
-        props['verts'] = b_mesh.vertices[0].as_pointer()
 
-    if bpy.app.version > (3, 0, 0):
-        props['normals'] = b_mesh.vertex_normals[0].as_pointer()
+def export_part_materials(export_ctx, b_object, parts):
+    '''
+    Export the materials of mesh parts that were not converted again, e.g. because they are up to date on disk.
+    '''
+    exported = set()
+    for part in parts:
+        mat = b_object.data.materials[part['mat_nr']] if part['mat_nr'] >= 0 else None
+        if mat and mat.name not in exported:
+            export_material(export_ctx, mat)
+            exported.add(mat.name)
+
 
-    props['vert_count'] = len(b_mesh.vertices)
-    # Apply coordinate change
-    if matrix_world:
-        props['to_world'] = export_ctx.transform_matrix(matrix_world)
+def shared_mesh_data(depsgraph):
+    '''
+    Names of the meshes used by several rendered objects of a scene, e.g. linked duplicates.
+    '''
+    users = defaultdict(int)
+    for b_object in depsgraph.objects:
+        if b_object.type == 'MESH' and not b_object.hide_render:
+            users[b_object.original.data.name_full] += 1
+    return {name for name, count in users.items() if count > 1}
 
-    # material index to export, as only a single material per mesh is suported in mitsuba
-    props['mat_nr'] = mat_nr
-    if 'material_index' in b_mesh.attributes:
-        # Blender 3.4+ layout
-        props['mat_indices'] = b_mesh.attributes['material_index'].data[0].as_pointer()
+
+def is_shared_mesh(export_ctx, b_object):
+    # Meshes kept in memory are updated per object by the render engine, they are not shared
+    return (b_object.type == 'MESH' and not export_ctx.keep_meshes_in_memory
+            and b_object.original.data.name_full in export_ctx.shared_meshes)
+
+
+def export_shared_mesh(b_object, export_ctx, auxiliary_output_dict=None):
+    '''
+    Export an object whose mesh is used by other objects as an instance of a shapegroup,
+    holding the mesh in local space. Objects share the shapegroup if they have no modifiers,
+    or if their modifiers give the same mesh and materials.
+    Shapegroups can't hold emitters: emissive meshes are exported as separate shapes
+    referencing the same PLY files instead.
+
+    Params
+    ------
+    b_object: The evaluated blender object
+    export_ctx: The export context
+    auxiliary_output_dict: Set of the optimizable materials, if auxiliary outputs are exported
+    '''
+    data_name = b_object.original.data.name_full
+    mesh_buffers = None
+    if len(b_object.original.modifiers) == 0:
+        # The evaluated mesh is the same for all the objects using the data
+        group_key = (data_name,)
     else:
-        props['mat_indices'] = 0
+        # Modifier results may differ between objects, compare them
+        b_mesh = b_object.data
+        mesh_buffers = MeshBuffers(export_ctx, b_mesh, None, data_name, len(b_mesh.materials))
+        materials = tuple(mat.name_full if mat else '' for mat in b_mesh.materials)
+        group_key = (data_name, materials, mesh_buffers.digest())
+
+    if group_key not in export_ctx.mesh_groups:
+        group_name = f"shared-{bpy.path.clean_name(data_name)}"
+        if group_name in export_ctx.mesh_group_names:
+            group_name += f"-{len(export_ctx.mesh_groups):03d}"
+        export_ctx.mesh_group_names.add(group_name)
+        group_id = f"mesh-{group_name}"
+        manifest_key = f"{group_id}-local"
+        parts = None
+        if export_ctx.manifest is not None and mesh_buffers is None:
+            parts = export_ctx.manifest.lookup(manifest_key, b_object)
+        if parts is None:
+            parts, _ = convert_mesh_parts(export_ctx, b_object, group_name, None, manifest_key, mesh_buffers)
+        else:
+            export_part_materials(export_ctx, b_object, parts)
 
-    # Return the mitsuba mesh
-    return load_dict(props)
+        part_params = [mesh_part_params(export_ctx, b_object, part, auxiliary_output_dict) for part in parts]
+        use_shapegroup = len(parts) > 0 and not any('emitter' in params for params in part_params)
+        if use_shapegroup:
+            group = {'type': 'shapegroup'}
+            for part, params in zip(parts, part_params):
+                group[part['name']] = params
+            export_ctx.data_add(group, name=group_id)
+        export_ctx.mesh_groups[group_key] = (group_name, parts, use_shapegroup)
+
+    group_name, parts, use_shapegroup = export_ctx.mesh_groups[group_key]
+    name_clean = bpy.path.clean_name(b_object.name_full)
+    if use_shapegroup and not export_ctx.export_ids:
+        export_ctx.add_instance(f"mesh-{group_name}", b_object.matrix_world)
+        return
+
+    to_world = export_ctx.object_transform(b_object)
+    if use_shapegroup:
+        # Keep one entry per object, with the id of the object
+        params = {
+            'type': 'instance',
+            'shape': {
+                'type': 'ref',
+                'id': f"mesh-{group_name}"
+            },
+            'to_world': to_world
+        }
+        export_ctx.data_add(params, name=f"mesh-{name_clean}")
+        return
+
+    for part in parts:
+        params = mesh_part_params(export_ctx, b_object, part, auxiliary_output_dict)
+        params['to_world'] = to_world
+        if export_ctx.export_ids:
+            # Same ids as the parts of an object that is not shared
+            part_suffix = part['name'][len(group_name):]
+            export_ctx.data_add(params, name=f"mesh-{name_clean}{part_suffix}")
+        else:
+            export_ctx.data_add(params)
 
 
 def export_object(deg_instance, export_ctx, is_particle, auxiliary_output_dict=None):
@@ -116,109 +568,51 @@ def export_object(deg_instance, export_ctx, is_particle, auxiliary_output_dict=N
     is_instance_emitter = b_object.parent is not None and b_object.parent.is_instancer
     is_instance = deg_instance.is_instance
 
+    if not (is_instance or is_instance_emitter or is_particle) and is_shared_mesh(export_ctx, b_object):
+        export_shared_mesh(b_object, export_ctx, auxiliary_output_dict)
+        return
+
     # Only write to file objects that have never been exported before
-    if export_ctx.data_get(object_id) is None:
-        if b_object.type == 'MESH':
-            b_mesh = b_object.data
-        else: # Metaballs, text, surfaces
-            b_mesh = b_object.to_mesh()
-
-        # Convert the mesh into one mitsuba mesh per different material
-        mat_count = len(b_mesh.materials)
-        converted_parts = []
+    if not export_ctx.data_has(object_id):
+        # Use a ShapeGroup for instances and split meshes
+        use_shapegroup = is_instance or is_instance_emitter or is_particle
+        to_world = None
         if is_instance or is_instance_emitter:
             transform = None
+        elif export_ctx.animation is not None and not use_shapegroup:
+            # Keep the mesh in local space, so that moving it does not change its file between frames
+            transform = None
+            to_world = export_ctx.object_transform(b_object)
         else:
-            transform = b_object.matrix_world
-
-
-        if mat_count == 0: # No assigned material
-            mts_mesh = convert_mesh(export_ctx, b_mesh, transform, name_clean, 0)
-            if mts_mesh is not None and mts_mesh.face_count() > 0:
-                converted_parts.append((name_clean, -1, mts_mesh))
+            transform = export_ctx.world_matrix(b_object)
+
+        # Instanced meshes are exported in local space, the others in world space
+        manifest_key = f"{object_id}-local" if transform is None else object_id
+        parts = None
+        mesh_buffers = None
+        if export_ctx.manifest is not None:
+            parts = export_ctx.manifest.lookup(manifest_key, b_object)
+        if parts is None:
+            parts, mesh_buffers = convert_mesh_parts(export_ctx, b_object, name_clean, transform, manifest_key)
         else:
-            refs_per_mat = {}
-            for mat_nr in range(mat_count):
-                mat = b_mesh.materials[mat_nr]
-                if not mat:
-                    continue
-
-                # Ensures that the exported mesh parts have unique names,
-                # even if multiple material slots refer to the same material.
-                n_mat_refs = refs_per_mat.get(mat.name, 0)
-                name = f'{name_clean}-{mat.name}'
-
-                if n_mat_refs >= 1:
-                    name += f'-{n_mat_refs:03d}'
-
-                mts_mesh = convert_mesh(export_ctx,
-                                        b_mesh,
-                                        transform,
-                                        name,
-                                        mat_nr)
-                if mts_mesh is not None and mts_mesh.face_count() > 0:
-                    converted_parts.append((name, mat_nr, mts_mesh))
-                    refs_per_mat[mat.name] = n_mat_refs + 1
-
-                    if n_mat_refs == 0:
-                        # Only export this material once
-                        export_material(export_ctx, mat)
-
-        if b_object.type != 'MESH':
-            b_object.to_mesh_clear()
+            # The meshes are up to date on disk, only the materials need to be exported again
+            export_part_materials(export_ctx, b_object, parts)
 
-        # Use a ShapeGroup for instances and split meshes
-        use_shapegroup = is_instance or is_instance_emitter or is_particle
         # TODO: Check if shapegroups for split meshes is worth it
         if use_shapegroup:
             group = {
                 'type': 'shapegroup'
             }
 
-        for (name, mat_nr, mts_mesh) in converted_parts:
-            name = name_clean if len(converted_parts) == 1 else name
+        for part in parts:
+            name = part['name']
             mesh_id = f"mesh-{name}"
+            params = mesh_part_params(export_ctx, b_object, part, auxiliary_output_dict)
+            if to_world is not None:
+                params['to_world'] = to_world
 
-            # Save as binary ply
-            mesh_folder = os.path.join(export_ctx.directory, export_ctx.subfolders['shape'])
-            if not os.path.isdir(mesh_folder):
-                os.makedirs(mesh_folder)
-            filepath = os.path.join(mesh_folder,  f"{name}.ply")
-            mts_mesh.write_ply(filepath)
-
-            # Build dictionary entry
-            params = {
-                'type': 'ply',
-                'filename': f"{export_ctx.subfolders['shape']}/{name}.ply"
-            }
-
-            # Add flat shading flag if needed
-            if not mts_mesh.has_vertex_normals():
-                params["face_normals"] = True
-
-            # Add material info
-            if mat_nr == -1:
-                if not export_ctx.data_get('default-bsdf'): # We only need to add it once
-                    default_bsdf = {
-                        'type': 'twosided',
-                        'id': 'default-bsdf',
-                        'bsdf': {'type':'diffuse'}
-                    }
-                    export_ctx.data_add(default_bsdf)
-                params['bsdf'] = {'type':'ref', 'id':'default-bsdf'}
-            else:
-                mat_id = f"mat-{b_object.data.materials[mat_nr].name}"
-                if export_ctx.exported_mats.has_mat(mat_id): # Add one emitter *and* one bsdf
-                    mixed_mat = export_ctx.exported_mats.mats[mat_id]
-                    params['bsdf'] = {'type': 'ref', 'id': mixed_mat['bsdf']}
-                    params['emitter'] = mixed_mat['emitter']
-                else:
-                    params['bsdf'] = {'type': 'ref', 'id': mat_id}
-
-                if auxiliary_output_dict is not None:
-                    optimizable_flag = b_object.data.materials[mat_nr].get("optimizable", False)
-                    if optimizable_flag:
-                        auxiliary_output_dict.add(mat_id)
+            if export_ctx.keep_meshes_in_memory:
+                params = in_memory_mesh(export_ctx, mesh_buffers.build_part(max(part['mat_nr'], 0), name), params)
 
             # Add dict to the scene dict
             if use_shapegroup:
@@ -233,12 +627,4 @@ def export_object(deg_instance, export_ctx, is_particle, auxiliary_output_dict=N
             export_ctx.data_add(group, name=object_id)
 
     if is_instance or is_particle:
-        params = {
-            'type': 'instance',
-            'shape': {
-                'type': 'ref',
-                'id': object_id
-            },
-            'to_world': export_ctx.transform_matrix(deg_instance.matrix_world)
-        }
-        export_ctx.data_add(params)
+        export_ctx.add_instance(object_id, deg_instance.matrix_world)
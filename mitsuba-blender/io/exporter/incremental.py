@@ -0,0 +1,255 @@
+import os
+import json
+import uuid
+import shutil
+import hashlib
+import tempfile
+
+import bpy
+
+class UpdateTracker:
+    '''
+    Keep track of the datablocks modified during the session, using depsgraph update notifications.
+    Each update is stamped with an increasing tick, so that an export can tell
+    which datablocks changed since a previous export.
+    '''
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        '''
+        Forget all updates. Manifests written before this can't be trusted anymore.
+        '''
+        self.session = uuid.uuid4().hex
+        self.tick = 0
+        self.updates = {} # (id_type, name) -> tick of the last update
+
+    def record(self, depsgraph):
+        self.tick += 1
+        for update in depsgraph.updates:
+            b_id = update.id.original
+            self.updates[(b_id.id_type, b_id.name_full)] = self.tick
+
+    def changed_since(self, tick, b_id):
+        return self.updates.get((b_id.id_type, b_id.name_full), 0) > tick
+
+tracker = UpdateTracker()
+
+@bpy.app.handlers.persistent
+def track_depsgraph_update(scene, depsgraph):
+    tracker.record(depsgraph)
+
+@bpy.app.handlers.persistent
+def reset_tracker(*args):
+    # After loading a file or undoing, names may refer to other data than what was tracked
+    tracker.reset()
+
+handlers = (
+    (bpy.app.handlers.depsgraph_update_post, track_depsgraph_update),
+    (bpy.app.handlers.load_post, reset_tracker),
+    (bpy.app.handlers.undo_post, reset_tracker),
+    (bpy.app.handlers.redo_post, reset_tracker),
+)
+
+def register():
+    for handler_list, handler in handlers:
+        if handler not in handler_list:
+            handler_list.append(handler)
+
+def unregister():
+    for handler_list, handler in handlers:
+        if handler in handler_list:
+            handler_list.remove(handler)
+
+class ExportManifest:
+    '''
+    Record of the meshes exported for each object, saved next to the scene file.
+    On the next export to the same file, objects that were not modified in between
+    reuse their recorded mesh parts instead of reading and writing the mesh again.
+    Modified objects whose mesh data is identical (same digest) keep their files as well.
+    The instance fragments are recorded too, so that the ones of removed shapegroups are deleted.
+    Without a path, the manifest only records the exported parts in memory.
+
+    Changing frames does not send depsgraph updates, so the manifest also records the frame:
+    after a frame change, animated objects would look unchanged to the tracker.
+    '''
+    version = 1
+
+    def __init__(self, path, settings, frame=None):
+        self.path = path
+        self.settings = settings # Export settings that change the content of the meshes
+        self.frame = frame # Exported frame, nothing is reused from an export of another frame
+        self.session = tracker.session
+        self.tick = tracker.tick
+        self.previous = self.load_previous()
+        self.objects = {}
+        self.fragments = [] # Instance fragments written by this export, relative to the scene folder
+        self.reused = 0
+        self.converted = 0
+
+    def load_previous(self):
+        if self.path is None:
+            return None
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest.get('version') != self.version or manifest.get('settings') != self.settings:
+            return None
+        return manifest
+
+    def previous_entry(self, key):
+        if self.previous is None:
+            return None
+        return self.previous['objects'].get(key)
+
+    def lookup(self, key, b_object):
+        '''
+        Return the parts recorded for an object if it did not change since the previous export, else None.
+
+        Params
+        ------
+        key: Manifest key of the object
+        b_object: The evaluated blender object
+        '''
+        entry = self.previous_entry(key)
+        original = b_object.original
+        if entry is None or not (self.is_unchanged(original) and self.is_unchanged(original.data)):
+            return None
+        directory = os.path.dirname(self.path)
+        if not all(os.path.isfile(os.path.join(directory, filename)) for filename in entry['files']):
+            return None
+        self.objects[key] = entry
+        self.reused += 1
+        return entry['parts']
+
+    def is_unchanged(self, b_id):
+        '''
+        Check whether a datablock was not modified since the previous export.
+        '''
+        if self.previous is None or self.previous['session'] != self.session:
+            return False
+        if self.previous.get('frame') != self.frame:
+            return False
+        return not tracker.changed_since(self.previous['tick'], b_id)
+
+    def is_up_to_date(self, key, digest, part, filename):
+        '''
+        Check whether a mesh file written by the previous export has the expected content.
+        '''
+        entry = self.previous_entry(key)
+        if entry is None or digest is None or entry['digest'] != digest:
+            return False
+        if part not in entry['parts'] or filename not in entry['files']:
+            return False
+        return os.path.isfile(os.path.join(os.path.dirname(self.path), filename))
+
+    def record(self, key, digest, parts, files):
+        self.objects[key] = {
+            'digest': digest,
+            'parts': parts,
+            'files': files
+        }
+        self.converted += 1
+
+    def stale_files(self):
+        '''
+        Files written by the previous export that are not part of this one anymore.
+        '''
+        if self.previous is None:
+            return set()
+        previous_files = set(self.previous.get('fragments', []))
+        for entry in self.previous['objects'].values():
+            previous_files.update(entry['files'])
+        for entry in self.objects.values():
+            previous_files.difference_update(entry['files'])
+        previous_files.difference_update(self.fragments)
+        return previous_files
+
+    def save(self):
+        if self.path is None:
+            return
+        directory = os.path.dirname(self.path)
+        for filename in self.stale_files():
+            filepath = os.path.join(directory, filename)
+            if os.path.isfile(filepath):
+                os.remove(filepath)
+        manifest = {
+            'version': self.version,
+            'session': self.session,
+            'tick': self.tick,
+            'frame': self.frame,
+            'settings': self.settings,
+            'objects': self.objects,
+            'fragments': self.fragments
+        }
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+
+class AnimationState:
+    '''
+    Data shared by the frames of an animation export.
+    Meshes are exported in local space, so that only deforming meshes differ between frames.
+    Each distinct version of a mesh part is written once: the first one as <name>.ply,
+    the next ones after the frame they first appear in, e.g. <name>-0042.ply.
+    '''
+    def __init__(self):
+        self.frame = 0
+        self.versions = {} # part name -> {mesh digest: file name}
+        self.textures = {} # Exported textures, shared by all the frames
+        self.written = 0
+        self.reused = 0
+
+    def part_file(self, name, digest):
+        '''
+        File name (without extension) of a version of a mesh part, and whether it still needs to be written.
+        '''
+        versions = self.versions.setdefault(name, {})
+        if digest in versions:
+            self.reused += 1
+            return versions[digest], False
+        file_name = name if not versions else f"{name}-{self.frame:04d}"
+        versions[digest] = file_name
+        self.written += 1
+        return file_name, True
+
+def staging_dir(path):
+    '''
+    Temporary folder next to a scene file, where an incremental export writes its XML files
+    before commit_staged_files moves the changed ones in place.
+    '''
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    return tempfile.mkdtemp(prefix='.mitsuba-staging-', dir=directory)
+
+def commit_staged_files(staging, directory, file_names):
+    '''
+    Move the files written in a staging folder to the scene folder, except the ones whose
+    content did not change: those are not rewritten, so they look untouched to build and
+    sync tools. Removes the staging folder. Returns the paths of the rewritten files.
+
+    Params
+    ------
+    staging: The staging folder, see staging_dir
+    directory: The scene folder
+    file_names: Paths of the files relative to both folders
+    '''
+    rewritten = []
+    for file_name in file_names:
+        staged_path = os.path.join(staging, file_name)
+        path = os.path.join(directory, file_name)
+        if os.path.isfile(path) and file_digest(path) == file_digest(staged_path):
+            continue
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        os.replace(staged_path, path)
+        rewritten.append(path)
+    shutil.rmtree(staging, ignore_errors=True)
+    return rewritten
+
+def file_digest(path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
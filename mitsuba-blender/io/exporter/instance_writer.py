@@ -0,0 +1,53 @@
+import os
+from xml.sax.saxutils import quoteattr
+
+import numpy as np
+
+class InstanceStream:
+    '''
+    Fragment listing the instances of a shapegroup, written block by block as instances are added.
+    Each instance is one line, formatted in a single pass over a block of matrices instead of
+    going through one dict per instance.
+
+    Params
+    ------
+    xml_path: Path of the fragment
+    shape_id: Id of the instanced shapegroup
+    '''
+    def __init__(self, xml_path, shape_id):
+        os.makedirs(os.path.dirname(xml_path), exist_ok=True)
+        # 9 significant digits round trip float32 values
+        ref = quoteattr(shape_id).replace('%', '%%')
+        self.line_format = (f'\t<shape type="instance"><ref id={ref}/><transform name="to_world"><matrix value="'
+                            + ' '.join(['%.9g'] * 16) + '"/></transform></shape>')
+        self.file = open(xml_path, 'w', encoding='utf-8')
+        self.file.write('<scene version="2.1.0">\n')
+
+    def write(self, matrices):
+        '''
+        Add a block of instances.
+
+        Params
+        ------
+        matrices: (N, 4, 4) to_world matrices of the instances, in Mitsuba's coordinate system
+        '''
+        np.savetxt(self.file, np.asarray(matrices, dtype=np.float32).reshape(-1, 16), fmt=self.line_format)
+
+    def close(self):
+        self.file.write('</scene>\n')
+        self.file.close()
+
+def write_instances(xml_path, shape_id, matrices):
+    '''
+    Write all the instances of a shapegroup as a scene fragment, included by the main scene file.
+    See InstanceStream.
+
+    Params
+    ------
+    xml_path: Path of the fragment
+    shape_id: Id of the instanced shapegroup
+    matrices: (N, 4, 4) to_world matrices of the instances, in Mitsuba's coordinate system
+    '''
+    stream = InstanceStream(xml_path, shape_id)
+    stream.write(matrices)
+    stream.close()
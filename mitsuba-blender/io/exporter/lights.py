@@ -2,7 +2,7 @@ from mathutils import Matrix
 import numpy as np
 from .export_context import Files
 
-def convert_area_light(b_light, export_ctx):
+def convert_area_light(b_light, export_ctx, is_instance=False):
     params = {}
 
     # Mitsuba default disks and rectangles are twice as big as blender's
@@ -39,7 +39,7 @@ def convert_area_light(b_light, export_ctx):
         raise NotImplementedError("Light shape: %s is not supported." % b_light.data.shape)
 
     #object transform
-    params['to_world'] = export_ctx.transform_matrix(b_light.matrix_world @ scale_mat)
+    params['to_world'] = export_ctx.object_transform(b_light, scale_mat, is_instance)
     emitter = {
         'type': 'area'
     }
@@ -55,14 +55,13 @@ def convert_area_light(b_light, export_ctx):
     params['bsdf'] = bsdf
     return params
 
-def convert_point_light(b_light, export_ctx):
+def convert_point_light(b_light, export_ctx, is_instance=False):
     #normalize by the solid angle of a sphere
     energy = b_light.data.energy / (4*np.pi)
     intensity = export_ctx.spectrum(energy * b_light.data.color)
 
     #get the world position. b_light.location is only local
-    transform = export_ctx.transform_matrix(b_light.matrix_world)
-    position = list(transform.translation())
+    position = export_ctx.world_matrix(b_light, is_instance)[:3, 3].tolist()
 
     if b_light.data.shadow_soft_size:
         export_ctx.log("Light '%s' has a non-zero soft shadow radius. It will be ignored." % b_light.name_full, 'WARN')
@@ -73,7 +72,7 @@ def convert_point_light(b_light, export_ctx):
         'intensity' : intensity
     }
 
-def convert_sun_light(b_light, export_ctx):
+def convert_sun_light(b_light, export_ctx, is_instance=False):
     params = {
         'type': 'directional'
     }
@@ -81,10 +80,10 @@ def convert_sun_light(b_light, export_ctx):
     params['irradiance'] = export_ctx.spectrum(irradiance)
     init_mat = Matrix.Rotation(np.pi, 4, 'X')
     #change default position, apply transform and change coordinates
-    params['to_world'] = export_ctx.transform_matrix(b_light.matrix_world @ init_mat)
+    params['to_world'] = export_ctx.object_transform(b_light, init_mat, is_instance)
     return params
 
-def convert_spot_light(b_light, export_ctx):
+def convert_spot_light(b_light, export_ctx, is_instance=False):
     params = {
         'type': 'spot'
     }
@@ -99,7 +98,7 @@ def convert_spot_light(b_light, export_ctx):
     params['beam_width'] = np.degrees(np.arccos(b + (1.0-b) * np.cos(alpha)))
     init_mat = Matrix.Rotation(np.pi, 4, 'X')
     #change default position, apply transform and change coordinates
-    params['to_world'] = export_ctx.transform_matrix(b_light.matrix_world @ init_mat)
+    params['to_world'] = export_ctx.object_transform(b_light, init_mat, is_instance)
     #TODO: look_at
     return params
 
@@ -114,7 +113,7 @@ def export_light(light_instance, export_ctx):
 
     b_light = light_instance.object
     try:
-        params = light_converters[b_light.data.type](b_light, export_ctx)
+        params = light_converters[b_light.data.type](b_light, export_ctx, light_instance.is_instance)
         if export_ctx.export_ids:
             export_ctx.data_add(params, name="emit-%s" % b_light.name_full)
         else:
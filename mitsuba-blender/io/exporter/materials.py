@@ -1,3 +1,5 @@
+import hashlib
+
 import bpy
 import numpy as np
 from mathutils import Matrix
@@ -377,21 +379,93 @@ def b_material_to_dict(export_ctx, b_mat):
 
     return mat_params
 
+# Properties common to all shader nodes (name, location, selection...), that don't change the material
+_node_base_properties = set()
+# Common properties that the converters read nonetheless (e.g. the color of RGB nodes)
+_node_converted_properties = ('color',)
+
+def _rna_value(value):
+    '''
+    Hashable description of a node property or socket value.
+    '''
+    if isinstance(value, bpy.types.Image):
+        # Textures are exported per image and color space
+        return ('IMAGE', value.name_full, value.colorspace_settings.name)
+    if isinstance(value, bpy.types.ID):
+        return (value.id_type, value.name_full)
+    if isinstance(value, (bool, int, float, str)) or value is None:
+        return value
+    try:
+        return tuple(value) # Vectors, colors and arrays
+    except TypeError:
+        return type(value).__name__ # Nested structs (e.g. texture mapping) are not converted
+
+def material_key(b_mat):
+    '''
+    Structural hash of a material: node types, node settings, unlinked input values, output values
+    (RGB and value nodes), links and referenced images. Materials with the same key convert to the
+    same Mitsuba dicts.
+    '''
+    if not _node_base_properties:
+        _node_base_properties.update(prop.identifier for prop in bpy.types.ShaderNode.bl_rna.properties)
+        _node_base_properties.difference_update(_node_converted_properties)
+
+    h = hashlib.blake2b(digest_size=16)
+    def add(*values):
+        h.update(repr(values).encode('utf-8'))
+
+    add(b_mat.use_nodes, tuple(b_mat.diffuse_color))
+    if b_mat.get("optimizable", False):
+        add(b_mat.name) # Optimizable materials are recorded by id, they keep their own BSDF
+    if b_mat.use_nodes and b_mat.node_tree is not None:
+        for node in sorted(b_mat.node_tree.nodes, key=lambda node: node.name):
+            add(node.name, node.bl_idname)
+            for prop in node.bl_rna.properties:
+                if prop.identifier in _node_base_properties or prop.type == 'COLLECTION':
+                    continue
+                add(prop.identifier, _rna_value(getattr(node, prop.identifier)))
+            for socket in node.inputs:
+                if not socket.is_linked and hasattr(socket, 'default_value'):
+                    add(socket.identifier, _rna_value(socket.default_value))
+            for socket in node.outputs:
+                if hasattr(socket, 'default_value'):
+                    add('output', socket.identifier, _rna_value(socket.default_value))
+        add(sorted((link.from_node.name, link.from_socket.identifier, link.to_node.name, link.to_socket.identifier)
+                   for link in b_mat.node_tree.links))
+    return h.hexdigest()
+
 def export_material(export_ctx, material):
+    '''
+    Convert a material and add it to the scene dict, unless it was already exported.
+    Materials with the same content as an exported one (e.g. duplicates with another name)
+    are not converted again: they reuse its BSDF, see ExportContext.material_id.
+    '''
     mat_params = {}
 
     if material is None:
         return mat_params
 
-    mat_id = "mat-%s" % material.name
+    if material.name in export_ctx.material_ids:
+        return # Already exported, or mapped to an identical material
 
-    mat_params = b_material_to_dict(export_ctx, material)
+    key = material_key(material)
+    mat_id = export_ctx.material_cache.get(key)
+    if mat_id is not None:
+        export_ctx.material_ids[material.name] = mat_id
+        return
+
+    mat_id = "mat-%s" % material.name
+    export_ctx.material_ids[material.name] = mat_id
+    export_ctx.material_cache[key] = mat_id
 
     #TODO: hide emitters
-    if export_ctx.data_get(mat_id) is not None:
+    if export_ctx.data_has(mat_id):
         #material was already exported
         return
 
+    with export_ctx.profile('export_material'):
+        mat_params = b_material_to_dict(export_ctx, material)
+
     if isinstance(mat_params, list): # Add/mix shader
         mats = {}
         for mat in mat_params:
@@ -406,7 +480,7 @@ def export_material(export_ctx, material):
         if mat_params['type'] == 'area': # Emitter with no bsdf
             mats = {}
             # We want the emitter object to be "shadeless", so we need to add it a dummy, empty bsdf, because all objects have a bsdf by default in mitsuba
-            if not export_ctx.data_get('empty-emitter-bsdf'): # We only need to add one of this, but we may have multiple emitter materials
+            if not export_ctx.data_has('empty-emitter-bsdf'): # We only need to add one of this, but we may have multiple emitter materials
                 empty_bsdf = {
                     'type':'diffuse',
                     'reflectance':export_ctx.spectrum(0.0), # No interaction with light
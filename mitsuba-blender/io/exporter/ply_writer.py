@@ -0,0 +1,83 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+def write_ply(filepath, positions, faces, normals=None, uvs=None, attributes=None):
+    '''
+    Write a triangle mesh as a binary little endian PLY file, with the same layout
+    as Mitsuba's Mesh.write_ply. This only uses numpy, so it can run on any thread.
+
+    Params
+    ------
+    filepath:   Path of the file to write.
+    positions:  (N, 3) float32 vertex positions.
+    faces:      (F, 3) uint32 vertex indices.
+    normals:    (N, 3) float32 vertex normals, optional.
+    uvs:        (N, 2) float32 texture coordinates, optional.
+    attributes: Dict of additional (N, C) float32 vertex attributes, e.g. 'vertex_Col'.
+    '''
+    vertex_fields = [('x', '<f4'), ('y', '<f4'), ('z', '<f4')]
+    columns = [positions]
+    if normals is not None:
+        vertex_fields += [('nx', '<f4'), ('ny', '<f4'), ('nz', '<f4')]
+        columns.append(normals)
+    if uvs is not None:
+        vertex_fields += [('u', '<f4'), ('v', '<f4')]
+        columns.append(uvs)
+    for attr_name, values in (attributes or {}).items():
+        # Mitsuba groups '<name>_0', '<name>_1'... back into a 'vertex_<name>' attribute on load,
+        # while '<name>_r', '<name>_g'... would become a 'vertex_<name>_color' attribute
+        prefix = attr_name[len('vertex_'):] if attr_name.startswith('vertex_') else attr_name
+        for i in range(values.shape[1]):
+            vertex_fields.append((f'{prefix}_{i}', '<f4'))
+        columns.append(values)
+
+    vertices = np.empty(len(positions), dtype=vertex_fields)
+    vertices.view('<f4').reshape(len(positions), -1)[:] = np.hstack(columns)
+
+    face_records = np.empty(len(faces), dtype=[('n', 'u1'), ('indices', '<u4', 3)])
+    face_records['n'] = 3
+    face_records['indices'] = faces
+
+    header = ['ply', 'format binary_little_endian 1.0', f'element vertex {len(vertices)}']
+    header += [f'property float {field}' for field, _ in vertex_fields]
+    header += [f'element face {len(face_records)}', 'property list uchar int vertex_indices', 'end_header']
+
+    with open(filepath, 'wb') as f:
+        f.write(('\n'.join(header) + '\n').encode('ascii'))
+        f.write(vertices.tobytes())
+        f.write(face_records.tobytes())
+
+
+class PlyWriterPool:
+    '''
+    Run mesh encoding and writing jobs on background threads.
+    The number of pending jobs is bounded: when the disk is slower than the
+    export, submit() blocks instead of accumulating mesh buffers in memory.
+    '''
+    def __init__(self, thread_count, max_pending=None):
+        self.executor = ThreadPoolExecutor(max_workers=thread_count, thread_name_prefix='mitsuba-ply')
+        self.pending = threading.BoundedSemaphore(max_pending or 2 * thread_count)
+        self.errors = []
+
+    def _job_done(self, future):
+        if future.exception() is not None:
+            self.errors.append(future.exception())
+        self.pending.release()
+
+    def submit(self, fn, *args):
+        self.pending.acquire()
+        future = self.executor.submit(fn, *args)
+        future.add_done_callback(self._job_done)
+
+    def wait(self, raise_errors=True):
+        '''
+        Wait for all jobs to finish, and raise the first error that occured, if any.
+        With raise_errors=False, the errors are returned instead, e.g. to log them
+        while another exception is being handled.
+        '''
+        self.executor.shutdown(wait=True)
+        if self.errors and raise_errors:
+            raise self.errors[0]
+        return self.errors
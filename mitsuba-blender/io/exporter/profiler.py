@@ -0,0 +1,138 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+def _totals():
+    return {'seconds': 0.0, 'calls': 0, 'bytes': 0}
+
+class ExportProfiler:
+    '''
+    Opt-in instrumentation of an export: wall time, call count and bytes written per stage
+    (e.g. 'export_mesh', 'export_material', 'write_ply') and per exported object.
+
+    Stages can be nested, e.g. a material converted while exporting a mesh: the time of a stage
+    includes the stages it contains, while bytes go to the innermost stage. The time and bytes
+    of an object are the ones of the stages started for it, including the meshes written for
+    it by the PLY writer threads.
+
+    The report is a Chrome trace (chrome://tracing, https://ui.perfetto.dev) with one event per
+    timed stage, and the totals in its 'stages' and 'objects' entries.
+    '''
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+        self.events = [] # Chrome trace events
+        self.stages = defaultdict(_totals) # Stage -> totals
+        self.objects = defaultdict(_totals) # Object name -> totals
+        self.local = threading.local() # Stack of the stages running on each thread
+
+    def _stack(self):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def current_object(self):
+        '''
+        Name of the object whose stages are running on this thread, if any.
+        '''
+        stack = self._stack()
+        return stack[-1]['object'] if stack else None
+
+    @contextmanager
+    def stage(self, name, object_name=None, count_object=True):
+        '''
+        Time a stage of the export.
+
+        Params
+        ------
+        name: Name of the stage
+        object_name: Object the stage is run for. Defaults to the object of the enclosing stage
+        count_object: Whether this counts as a call for the object, see bind
+        '''
+        stack = self._stack()
+        parent_object = stack[-1]['object'] if stack else None
+        # Nested stages of the same object are already timed by the enclosing one
+        owner = object_name is not None and object_name != parent_object
+        if object_name is None:
+            object_name = parent_object
+        frame = {'object': object_name, 'bytes': 0}
+        stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            stack.pop()
+            event = {
+                'name': name, 'cat': 'export', 'ph': 'X', 'pid': os.getpid(), 'tid': threading.get_ident(),
+                'ts': round((start - self.start) * 1e6, 3), 'dur': round(duration * 1e6, 3),
+                'args': {'object': object_name, 'bytes': frame['bytes']}
+            }
+            with self.lock:
+                self.events.append(event)
+                totals = self.stages[name]
+                totals['seconds'] += duration
+                totals['calls'] += 1
+                totals['bytes'] += frame['bytes']
+                if owner:
+                    totals = self.objects[object_name]
+                    totals['seconds'] += duration
+                    totals['calls'] += count_object
+
+    def add_bytes(self, size):
+        '''
+        Count bytes written by the current stage, and its object.
+        '''
+        stack = self._stack()
+        if not stack:
+            return
+        stack[-1]['bytes'] += size
+        if stack[-1]['object'] is not None:
+            with self.lock:
+                self.objects[stack[-1]['object']]['bytes'] += size
+
+    def bind(self, fn, stage):
+        '''
+        Wrap a function to be run on another thread (e.g. by the PLY writer pool),
+        so that it is timed as a stage of the current object.
+        '''
+        object_name = self.current_object()
+        def timed(*args):
+            with self.stage(stage, object_name, count_object=False):
+                return fn(*args)
+        return timed
+
+    def object_exporter(self, exporter):
+        '''
+        Wrap an export function of SceneConverter.object_exporters, to time each object it exports.
+        '''
+        def timed(object_instance, b_scene, is_particle):
+            with self.stage(exporter.__name__, object_instance.object.name_full):
+                exporter(object_instance, b_scene, is_particle)
+        return timed
+
+    def slowest_objects(self, count=10):
+        '''
+        Names and totals of the objects that took the longest to export, slowest first.
+        '''
+        with self.lock:
+            objects = sorted(self.objects.items(), key=lambda item: item[1]['seconds'], reverse=True)
+        return objects[:count]
+
+    def report(self):
+        with self.lock:
+            return {
+                'traceEvents': list(self.events),
+                'displayTimeUnit': 'ms',
+                'seconds': time.perf_counter() - self.start,
+                'stages': dict(self.stages),
+                'objects': dict(self.objects),
+            }
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f)
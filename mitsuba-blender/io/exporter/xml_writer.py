@@ -0,0 +1,130 @@
+import shutil
+import tempfile
+from collections import OrderedDict
+
+from mitsuba.python.xml import WriteXML, Files
+
+class StreamingWriteXML(WriteXML):
+    '''
+    XML writer that writes each entry of the scene as soon as it is added, instead of
+    writing the whole scene dict at the end like WriteXML.process.
+    Entries go to the fragment of their category when splitting files, or to a temporary
+    file per category which is copied in the main file by close(), so that the output is
+    the same as the one of WriteXML.process. Only the ids of the written entries stay in
+    memory, to check the refs.
+    '''
+
+    # Section comment and file of each category, in the order of WriteXML.preprocess_scene
+    sections = [
+        ("Camera and Rendering Parameters", Files.CAMS),
+        ("Materials", Files.MATS),
+        ("Emitters", Files.EMIT),
+        ("Shapes", Files.GEOM),
+        ("Volumes", Files.VOLS),
+    ]
+
+    def __init__(self, path, subfolders=None, split_files=False):
+        super().__init__(path, subfolders, split_files)
+        self.main_entries = OrderedDict() # Entries of the main file (e.g. includes), written by close()
+        self.plugin_tags = {} # Plugin type -> tag, see get_plugin_tag
+        for _, file in self.sections:
+            if split_files:
+                self.open_scene(file)
+            else:
+                # The entries are written at the indentation of the main file's scene tag
+                self.files.append(tempfile.TemporaryFile('w+', encoding='utf-8', newline="\n"))
+                self.file_tabs.append(1)
+                self.file_stack.append([None, 'scene'])
+
+    def wf(self, ind, st, tabs=0):
+        # Same as WriteXML.wf, without flushing the file after each element
+        if self.files[ind] is None:
+            ind = 0
+        self.files[ind].write('%s%s' % ('\t' * tabs, st))
+
+    def open_scene(self, file):
+        '''
+        Open the scene tag of a file, for writing its entries one by one.
+        write_dict closes the scene tag after the top level entries, which it
+        recognizes by the depth of the tag stack: a placeholder keeps it open.
+        '''
+        self.open_element('scene', {'version': '2.1.0'}, file)
+        self.file_stack[file].insert(0, None)
+
+    def close_scene(self, file):
+        self.file_stack[file].pop(0)
+        self.close_element(file)
+
+    def entry_file(self, value):
+        '''
+        File of a top level entry of the scene, same as WriteXML.preprocess_scene.
+        '''
+        item_type = value['type']
+        if item_type not in self.plugin_tags:
+            self.plugin_tags[item_type] = self.get_plugin_tag(item_type)
+        tag = self.plugin_tags[item_type]
+        if tag == 'emitter':
+            return Files.EMIT
+        if tag == 'shape':
+            if 'emitter' in value: # Emitter nested in a shape (area light)
+                return Files.EMIT
+            if 'medium' in value: # Volume nested in a shape
+                return Files.VOLS
+            return Files.GEOM
+        if tag == 'bsdf':
+            return Files.MATS
+        if tag:
+            return Files.CAMS # The rest is sensor, integrator and other render stuff
+        return Files.MAIN
+
+    def add_entry(self, key, value, keep_id=True):
+        '''
+        Write a top level entry of the scene dict.
+
+        Params
+        ------
+        key: Key of the entry in the scene dict, i.e. its id
+        value: Dict of the entry
+        keep_id: Whether the id may be referenced later. Otherwise it is forgotten once written,
+                 the caller guarantees that it is unique.
+        '''
+        if not isinstance(value, dict):
+            raise ValueError("Unsupported item: %s:%s" % (key, value))
+        entry = self.configure_defaults({key: value})
+        file = self.entry_file(value)
+        if file == Files.MAIN:
+            self.main_entries.update(entry)
+            return
+        self.set_output_file(file)
+        self.write_dict(entry)
+        if not keep_id:
+            self.exported_ids.discard(key)
+
+    def close(self):
+        '''
+        Write the main file and close all the files.
+        '''
+        if self.split_files:
+            for _, file in self.sections:
+                self.close_scene(file)
+
+        self.set_output_file(Files.MAIN)
+        self.open_scene(Files.MAIN)
+        self.write_comment("Defaults, these can be set via the command line: -Darg=value")
+        # configure_defaults adds the defaults to the main dict of the writer
+        self.write_dict(OrderedDict((key, value) for key, value in self.scene_data[Files.MAIN].items() if key != 'type'))
+        self.write_dict(self.main_entries)
+        for comment, file in self.sections:
+            self.write_comment(comment)
+            if self.split_files:
+                self.element('include', {'filename': self.file_names[file]})
+            else:
+                self.files[file].seek(0)
+                shutil.copyfileobj(self.files[file], self.files[Files.MAIN])
+        self.close_scene(Files.MAIN)
+
+        print('Wrote scene files.')
+        for f in self.files:
+            f.close()
+        for name in self.file_names:
+            print(' %s' % name)
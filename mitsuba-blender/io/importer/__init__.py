@@ -1,3 +1,6 @@
+import os
+import shutil
+import tempfile
 import time
 
 if "bpy" in locals():
@@ -32,6 +35,7 @@ from . import world
 from . import textures
 from . import renderer
 from . import mi_props_utils
+from .. import bundle
 
 ########################
 ##     Utilities      ##
@@ -363,26 +367,68 @@ def instantiate_bl_data_node(mi_context, bl_node):
 ##    Main loading     ##
 #########################
 
-def load_mitsuba_scene(bl_context, bl_scene, bl_collection, filepath, global_mat):
-    ''' Load a Mitsuba scene from an XML file into a Blender scene.
+def bundle_to_props(scene_bundle, directory):
+    ''' Extract the objects' properties of a scene bundle.
+    The scene dict of the bundle is written as an XML file in the given folder, and read by
+    Mitsuba's parser like any other scene. The meshes and files it references stay in the bundle.
+    '''
+    from mitsuba import xml_to_props
+    from mitsuba.python.xml import dict_to_xml
+    xml_path = os.path.join(directory, 'scene.xml')
+    dict_to_xml(scene_bundle.scene_dict(), xml_path)
+    return xml_to_props(xml_path)
+
+def load_mitsuba_scene(bl_context, bl_scene, bl_collection, filepath, global_mat, proxy_faces=None):
+    ''' Load a Mitsuba scene from an XML file or a scene bundle into a Blender scene.
     
     Params
     ------
     bl_context: Blender context
     bl_scene: Blender scene
     bl_collection: Blender collection
-    filepath: Path to the Mitsuba XML scene file
+    filepath: Path to the Mitsuba XML scene file, or to a scene bundle
     global_mat: Axis conversion matrix
+    proxy_faces: Import PLY meshes as decimated proxies with about this many faces, e.g. for layout work on huge scans
+    '''
+    if not bundle.is_bundle(filepath):
+        return load_scene_props(bl_context, bl_scene, bl_collection, filepath, global_mat, proxy_faces=proxy_faces)
+
+    scene_bundle = bundle.Bundle(filepath)
+    bundle_dir = tempfile.mkdtemp(prefix='mitsuba-bundle-')
+    try:
+        load_scene_props(bl_context, bl_scene, bl_collection, filepath, global_mat, scene_bundle, bundle_dir, proxy_faces)
+        # Images were loaded from the extracted files, keep them in the blend file
+        for bl_image in bpy.data.images:
+            if bl_image.filepath and bpy.path.abspath(bl_image.filepath).startswith(bundle_dir):
+                bl_image.pack()
+    finally:
+        shutil.rmtree(bundle_dir, ignore_errors=True)
+
+def load_scene_props(bl_context, bl_scene, bl_collection, filepath, global_mat, scene_bundle=None, bundle_dir=None, proxy_faces=None):
+    ''' Convert the objects of a Mitsuba scene to Blender, see load_mitsuba_scene.
+    With a scene bundle, bundle_dir is the folder where its files are extracted for Blender.
     '''
     start_time = time.time()
     # Load the Mitsuba XML and extract the objects' properties
     from mitsuba import xml_to_props
-    raw_props = xml_to_props(filepath)
+    if scene_bundle is not None:
+        raw_props = bundle_to_props(scene_bundle, bundle_dir)
+    else:
+        raw_props = xml_to_props(filepath)
     mi_scene_props = common.MitsubaSceneProperties(raw_props)
     mi_context = common.MitsubaSceneImportContext(bl_context, bl_scene, bl_collection, filepath, mi_scene_props, global_mat)
-
-    _, mi_props = mi_scene_props.get_first_of_class('Scene')
-    bl_scene_data_node = mi_props_to_bl_data_node(mi_context, 'Scene', mi_props)
+    mi_context.bundle = scene_bundle
+    mi_context.bundle_dir = bundle_dir
+    mi_context.proxy_faces = proxy_faces
+
+    # Parse the shape files in parallel while the scene is converted
+    executor = shapes.parse_shape_files(mi_context)
+    try:
+        _, mi_props = mi_scene_props.get_first_of_class('Scene')
+        bl_scene_data_node = mi_props_to_bl_data_node(mi_context, 'Scene', mi_props)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
     if bl_scene_data_node is None:
         mi_context.log('Failed to load Mitsuba scene', 'ERROR')
         return
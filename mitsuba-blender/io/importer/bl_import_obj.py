@@ -13,7 +13,9 @@ http://wiki.blender.org/index.php/Scripts/Manual/Import/wavefront_obj
 
 import array
 import os
+import warnings
 import bpy
+import numpy as np
 
 from bpy_extras.io_utils import unpack_list
 
@@ -381,6 +383,374 @@ def any_number_as_int(svalue):
     return int(float(svalue))
 
 
+# Size of the blocks in which parse_obj reads a file
+OBJ_CHUNK_SIZE = 1 << 24
+
+# Line types of the fast parser
+_LINE_OTHER, _LINE_V, _LINE_VT, _LINE_VN, _LINE_F = range(5)
+# Minimum number of tokens of the vertex data lines, keyword included
+_MIN_TOKENS = {_LINE_V: 4, _LINE_VT: 2, _LINE_VN: 4}
+
+
+def _parse_numbers(text, dtype, count):
+    """
+    Parse count whitespace-separated numbers, None if text holds anything else.
+    """
+    if not count:
+        return np.empty(0, dtype=dtype)
+    with warnings.catch_warnings():
+        # Older NumPy versions only warn about unparsed data
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            values = np.fromstring(text, dtype=dtype, sep=' ')
+        except (ValueError, DeprecationWarning):
+            return None
+    return values if len(values) == count else None
+
+
+def _resolve_indices(indices, count_before, allow_zero):
+    """
+    Convert 1-based, possibly negative (relative) OBJ indices to 0-based ones, like load does.
+    Index 0 is the first item if allowed, e.g. for missing texture coordinates.
+    """
+    resolved = np.where(indices < 0, indices + count_before, indices - 1)
+    if allow_zero:
+        resolved[indices == 0] = 0
+    elif np.any(indices == 0):
+        return None
+    return resolved
+
+
+class FastObjParser:
+    """
+    Vectorized parser for the common OBJ files, see parse_obj.
+    Each call to feed parses a block of whole lines. The parser gives up (failed is set) on anything
+    that the line-by-line parser of load would handle differently.
+    """
+    def __init__(self, use_smooth_groups=True, use_split_objects=True):
+        self.use_smooth_groups = use_smooth_groups
+        self.use_split_objects = use_split_objects
+        self.failed = False
+        self.counts = {_LINE_V: 0, _LINE_VT: 0, _LINE_VN: 0, _LINE_F: 0}  # Lines of each type so far
+        self.tokens = {}  # Line type -> number of tokens of all its lines
+        self.corner_format = None  # (number of slashes, whether they are doubled) in each face corner
+        self.object_name = None
+        self.smooth_group = None
+        self.has_smooth_groups = False
+        self.parts = {_LINE_V: [], _LINE_VT: [], _LINE_VN: [], _LINE_F: []}
+
+    def fail(self):
+        self.failed = True
+        self.parts = None
+
+    def other_line(self, line_split, after_faces):
+        """
+        Handle a line that is not vertex data or a face, returns whether the fast parser supports it.
+        """
+        if not line_split or line_split[0].startswith(b'#'):
+            return True
+        line_start = line_split[0]
+        if len(line_split) == 1:
+            # Skipped by load too
+            return line_start != b'end'
+        if line_start in (b'usemtl', b'mtllib', b'g'):
+            # Not used by load without group splitting
+            return True
+        if line_start == b'o':
+            if self.use_split_objects:
+                # A single object, named before its faces
+                if after_faces or self.object_name is not None:
+                    return False
+                self.object_name = line_value(line_split)
+            return True
+        if line_start == b's':
+            if self.use_smooth_groups:
+                smooth_group = line_value(line_split)
+                if smooth_group == b'off':
+                    smooth_group = None
+                else:
+                    self.has_smooth_groups = True
+                # All faces in the same smooth group, or none
+                if after_faces and smooth_group != self.smooth_group:
+                    return False
+                self.smooth_group = smooth_group
+            return True
+        return False
+
+    def feed(self, data):
+        """
+        Parse a block of whole lines, ending with a line break.
+        """
+        if self.failed:
+            return
+        if b'\\' in data:
+            # Multi-line continuations
+            return self.fail()
+
+        space = ord(' ')
+        # Padded, so that the first 3 bytes of every line can be read
+        buf = np.frombuffer(data + b'  ', dtype=np.uint8).copy()
+        buf[(buf == ord('\r')) | (buf == ord('\t'))] = space
+        ends = np.flatnonzero(buf == ord('\n'))
+        starts = np.empty_like(ends)
+        starts[0] = 0
+        starts[1:] = ends[:-1] + 1
+        first, second, third = buf[starts], buf[starts + 1], buf[starts + 2]
+
+        line_types = np.full(len(starts), _LINE_OTHER, dtype=np.uint8)
+        line_types[(first == ord('v')) & (second == space)] = _LINE_V
+        line_types[(first == ord('v')) & (second == ord('t')) & (third == space)] = _LINE_VT
+        line_types[(first == ord('v')) & (second == ord('n')) & (third == space)] = _LINE_VN
+        line_types[(first == ord('f')) & (second == space)] = _LINE_F
+        byte_types = np.repeat(line_types, np.diff(starts, append=len(buf)))
+
+        # Number of whitespace-separated tokens of each line
+        solid = (buf != space) & (buf != ord('\n'))
+        token_starts = solid.copy()
+        token_starts[1:] &= ~solid[:-1]
+        line_tokens = np.add.reduceat(token_starts, starts, dtype=np.int32)
+
+        # Other lines, in order
+        faces_before = self.counts[_LINE_F] + np.cumsum(line_types == _LINE_F)
+        for i in np.flatnonzero(line_types == _LINE_OTHER):
+            if not self.other_line(data[starts[i]:ends[i]].split(), faces_before[i] > 0):
+                return self.fail()
+
+        # Number of lines of each type before each line
+        lines_before = {}
+        for line_type in self.parts:
+            rows = np.flatnonzero(line_types == line_type)
+            if not len(rows):
+                continue
+            tokens = self.tokens.setdefault(line_type, line_tokens[rows[0]])
+            if np.any(line_tokens[rows] != tokens) or tokens < _MIN_TOKENS.get(line_type, 4):
+                # Inconsistent number of values, or faces that are not at least triangles
+                return self.fail()
+            lines_before[line_type] = self.counts[line_type] + np.cumsum(line_types == line_type)
+
+        is_slash = buf == ord('/')
+        for line_type, min_tokens in _MIN_TOKENS.items():
+            rows = np.flatnonzero(line_types == line_type)
+            if not len(rows):
+                continue
+            # Drop the keywords, and parse the values of all the lines at once
+            buf[starts[rows]] = space
+            buf[starts[rows] + 1] = space
+            columns = self.tokens[line_type] - 1
+            values = _parse_numbers(buf[byte_types == line_type].tobytes(), np.float64, len(rows) * columns)
+            if values is None:
+                return self.fail()
+            values = values.reshape(len(rows), columns)
+            if line_type == _LINE_VT and columns == 1:
+                # Some files do not write the 'v' value when it's 0.0, see T68249
+                values = np.hstack((values, np.zeros_like(values)))
+            self.parts[line_type].append(values[:, :3 if line_type != _LINE_VT else 2].astype(np.float32))
+
+        rows = np.flatnonzero(line_types == _LINE_F)
+        if len(rows):
+            corner_count = self.tokens[_LINE_F] - 1
+            if self.corner_format is None:
+                corner = data[starts[rows[0]]:ends[rows[0]]].split()[1]
+                self.corner_format = (corner.count(b'/'), b'//' in corner)
+            slashes, doubled = self.corner_format
+            # All the corners have the format of the first one: v, v/vt, v/vt/vn or v//vn
+            is_double = is_slash.copy()
+            is_double[:-1] &= is_slash[1:]
+            line_slashes = np.add.reduceat(is_slash, starts, dtype=np.int32)[rows]
+            line_doubles = np.add.reduceat(is_double, starts, dtype=np.int32)[rows]
+            if (slashes > 2 or np.any(line_slashes != slashes * corner_count)
+                    or np.any(line_doubles != (corner_count if doubled else 0))):
+                return self.fail()
+            buf[starts[rows]] = space
+            buf[is_slash] = space
+            values_per_corner = 1 + slashes - doubled
+            indices = _parse_numbers(buf[byte_types == _LINE_F].tobytes(), np.int64,
+                                     len(rows) * corner_count * values_per_corner)
+            if indices is None:
+                return self.fail()
+            indices = indices.reshape(len(rows), corner_count, values_per_corner)
+
+            # Vertex, texture and normal index of each corner, None if not given
+            slots = [(_LINE_V, indices[:, :, 0]), (_LINE_VT, None), (_LINE_VN, None)]
+            if slashes >= 1 and not doubled:
+                slots[1] = (_LINE_VT, indices[:, :, 1])
+            if slashes == 2:
+                slots[2] = (_LINE_VN, indices[:, :, -1])
+            face_indices = []
+            for line_type, slot in slots:
+                if slot is not None:
+                    count_before = lines_before[line_type][rows, None] if line_type in lines_before else self.counts[line_type]
+                    slot = _resolve_indices(slot, count_before, allow_zero=line_type != _LINE_V)
+                    if slot is None:
+                        return self.fail()
+                face_indices.append(slot)
+            self.parts[_LINE_F].append(face_indices)
+
+        for line_type in self.counts:
+            self.counts[line_type] += int(np.count_nonzero(line_types == line_type))
+
+    def result(self, filepath):
+        """
+        Mesh parsed from the fed lines, see parse_obj.
+        """
+        if self.failed:
+            return None
+
+        def concatenate(parts, columns):
+            return np.concatenate(parts) if parts else np.empty((0, columns), dtype=np.float32)
+
+        positions = concatenate(self.parts[_LINE_V], 3)
+        texcoords = concatenate(self.parts[_LINE_VT], 2)
+        normals = concatenate(self.parts[_LINE_VN], 3)
+
+        name = os.path.splitext(os.path.basename(filepath))[0]
+        mesh = {
+            "name": name,
+            "positions": positions,
+            "loops": np.empty(0, dtype=np.int32),
+            "loop_total": np.empty(0, dtype=np.int32),
+            "loop_uvs": None,
+            "loop_normals": None,
+            "smooth": False,
+            "has_smooth_groups": self.has_smooth_groups,
+            "sharp_edges": None,
+        }
+        if not self.parts[_LINE_F]:
+            return mesh
+
+        def corner_indices(slot, count):
+            # Index 0 for the corners without one, like load
+            parts = [part[slot] if part[slot] is not None else np.zeros_like(part[0]) for part in self.parts[_LINE_F]]
+            indices = np.concatenate(parts)
+            if np.any(indices < 0) or np.any(indices >= count):
+                return None
+            return indices
+
+        faces = corner_indices(0, len(positions))
+        if faces is None:
+            return None
+        corners = np.sort(faces, axis=1)
+        if np.any(corners[:, 1:] == corners[:, :-1]):
+            # Faces using a vertex more than once are tessellated by load
+            return None
+
+        if self.use_split_objects:
+            # Only the vertices of the faces, in the order they are first used
+            used, first_use, loops = np.unique(faces.ravel(), return_index=True, return_inverse=True)
+            order = np.argsort(first_use)
+            rank = np.empty_like(order)
+            rank[order] = np.arange(len(order))
+            faces = rank[loops.ravel()].reshape(faces.shape)
+            mesh["positions"] = positions[used[order]]
+            if self.object_name:
+                mesh["name"] = self.object_name.decode('utf-8', 'replace')
+
+        mesh["loops"] = faces.astype(np.int32).ravel()
+        mesh["loop_total"] = np.full(len(faces), faces.shape[1], dtype=np.int32)
+        if len(texcoords):
+            uvs = corner_indices(1, len(texcoords))
+            if uvs is None:
+                return None
+            mesh["loop_uvs"] = texcoords[uvs.ravel()]
+        if len(normals):
+            nors = corner_indices(2, len(normals))
+            if nors is None:
+                return None
+            mesh["loop_normals"] = normals[nors.ravel()]
+
+        if self.smooth_group:
+            mesh["smooth"] = True
+            # Edges on the boundary of the smooth group are sharp
+            edges = np.stack((faces, np.roll(faces, -1, axis=1)), axis=2).reshape(-1, 2).astype(np.int64)
+            edges.sort(axis=1)
+            vertex_count = len(mesh["positions"])
+            keys, users = np.unique(edges[:, 0] * vertex_count + edges[:, 1], return_counts=True)
+            keys = keys[users == 1]
+            mesh["sharp_edges"] = np.stack((keys // vertex_count, keys % vertex_count), axis=1)
+        return mesh
+
+
+def parse_obj(filepath, use_smooth_groups=True, use_split_objects=True):
+    """
+    Fast path of load for the common OBJ files: v, vt, vn and f lines, faces with the same number of
+    corners and the same v/vt/vn format, in at most one object and one smooth group. Materials are
+    ignored, like in load. The file is parsed in large blocks into NumPy arrays, without bpy.
+
+    Returns a dict with the name, positions, loops, loop_total, loop_uvs, loop_normals, smooth,
+    has_smooth_groups and sharp_edges of the mesh, see mesh_from_obj_buffers, or None if the file
+    needs the line-by-line parser.
+    """
+    parser = FastObjParser(use_smooth_groups, use_split_objects)
+    with open(filepath, 'rb') as f:
+        rest = b''
+        while not parser.failed:
+            block = f.read(OBJ_CHUNK_SIZE)
+            if not block:
+                if rest.strip():
+                    parser.feed(rest + b'\n')
+                break
+            block = rest + block
+            end = block.rfind(b'\n') + 1
+            if end:
+                parser.feed(block[:end])
+            rest = block[end:]
+    return parser.result(filepath)
+
+
+def mesh_from_obj_buffers(mesh):
+    """
+    Create the mesh parsed by parse_obj, like create_mesh.
+    """
+    loops = mesh["loops"]
+    loop_total = mesh["loop_total"]
+    loop_normals = mesh["loop_normals"]
+    loop_uvs = mesh["loop_uvs"]
+
+    me = bpy.data.meshes.new(mesh["name"])
+    me.vertices.add(len(mesh["positions"]))
+    me.loops.add(len(loops))
+    me.polygons.add(len(loop_total))
+
+    me.vertices.foreach_set("co", mesh["positions"].ravel())
+    me.loops.foreach_set("vertex_index", loops)
+    me.polygons.foreach_set("loop_start", np.cumsum(loop_total, dtype=np.int32) - loop_total)
+    me.polygons.foreach_set("loop_total", loop_total)
+    me.polygons.foreach_set("use_smooth", np.full(len(loop_total), mesh["smooth"]))
+
+    if loop_normals is not None:
+        # Temporary normals in the loops, see create_mesh
+        me.create_normals_split()
+        me.loops.foreach_set("normal", loop_normals.ravel())
+
+    if loop_uvs is not None:
+        me.uv_layers.new(do_init=False)
+        me.uv_layers[0].data.foreach_set("uv", loop_uvs.ravel())
+
+    me.validate(clean_customdata=False)  # *Very* important to not remove lnors here!
+    me.update()
+
+    sharp_edges = mesh["sharp_edges"]
+    if sharp_edges is not None and len(sharp_edges):
+        edges = np.empty(len(me.edges) * 2, dtype=np.int32)
+        me.edges.foreach_get("vertices", edges)
+        edges = np.sort(edges.reshape(-1, 2), axis=1).astype(np.int64)
+        vertex_count = len(me.vertices)
+        keys = edges[:, 0] * vertex_count + edges[:, 1]
+        me.edges.foreach_set("use_edge_sharp", np.isin(keys, sharp_edges[:, 0] * vertex_count + sharp_edges[:, 1]))
+
+    if loop_normals is not None:
+        clnors = np.empty(len(me.loops) * 3, dtype=np.float32)
+        me.loops.foreach_get("normal", clnors)
+
+        if not mesh["has_smooth_groups"]:
+            me.polygons.foreach_set("use_smooth", np.ones(len(me.polygons), dtype=bool))
+
+        me.normals_split_custom_set(clnors.reshape(-1, 3))
+        me.use_auto_smooth = True
+
+    return me
+
+
 def load(filepath,
          *,
          use_smooth_groups=True,
@@ -388,13 +758,20 @@ def load(filepath,
          use_split_objects=True,
          use_split_groups=False,
          use_groups_as_vgroups=False,
+         use_fast_parser=True,
          ):
     """
     Called by the user interface or another script.
     load_obj(path) - should give acceptable results.
     This function passes the file and sends the data off
         to be split into objects and then converted into mesh objects
+    Common files are parsed by parse_obj, unless use_fast_parser is False.
     """
+    if use_fast_parser and not (use_split_groups or use_groups_as_vgroups):
+        mesh = parse_obj(filepath, use_smooth_groups, use_split_objects)
+        if mesh is not None:
+            return [mesh_from_obj_buffers(mesh)]
+
     def unique_name(existing_names, name_orig):
         i = 0
         if name_orig is None:
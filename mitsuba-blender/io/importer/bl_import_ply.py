@@ -18,6 +18,9 @@
 
 # <pep8 compliant>
 
+# Number of elements processed at once when going over large arrays, e.g. memory-mapped ones
+CHUNK_SIZE = 1 << 18
+
 
 class ElementSpec:
     __slots__ = (
@@ -42,6 +45,83 @@ class ElementSpec:
                 return i
         return -1
 
+    def block_dtype(self, format, list_lengths):
+        """
+        NumPy record type of the elements, or None if they can't be read as fixed-size records.
+        Each property is a field, in the order of the properties, so that records can be indexed
+        like the rows of the per-element path. List properties are subarrays of list_lengths[i]
+        values, after their count field which has no name.
+        """
+        import numpy as np
+
+        names, formats, offsets = [], [], []
+        offset = 0
+        for i, p in enumerate(self.properties):
+            if p.numeric_type == 's' or p.list_type == 's':
+                return None
+            name = p.name.decode('latin-1')
+            if name in names:
+                return None
+            names.append(name)
+            offsets.append(offset)
+            if p.list_type is None:
+                formats.append(np.dtype(format + p.numeric_type))
+            else:
+                offsets[-1] += np.dtype(p.list_type).itemsize
+                formats.append(np.dtype((format + p.numeric_type, (list_lengths[i],))))
+            offset = offsets[-1] + formats[-1].itemsize
+        return np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': offset})
+
+    def load_block(self, format, stream, use_mmap=False):
+        """
+        Read all the elements at once, as a NumPy structured array of fixed-size records.
+        This requires a binary file, and lists of the same length in all the elements (e.g. triangle
+        faces), which is checked on the read data. Returns None otherwise, with the stream left
+        where it was, so that the elements can be read one by one instead.
+        With use_mmap, the array is a read-only memory map of the file instead: its pages are
+        only read when accessed, and can be dropped by the system afterwards.
+        """
+        import os
+        import numpy as np
+
+        if format == b'ascii' or self.count == 0:
+            return None
+        start = stream.tell()
+        # The length of the lists is the one of the first element
+        first = self.load(format, stream)
+        stream.seek(start)
+        list_lengths = [len(value) if p.list_type is not None else None for p, value in zip(self.properties, first)]
+        dtype = self.block_dtype(format, list_lengths)
+        if dtype is None:
+            return None
+
+        size = self.count * dtype.itemsize
+        if use_mmap:
+            if os.fstat(stream.fileno()).st_size < start + size:
+                return None
+            data = np.memmap(stream.name, dtype=dtype, mode='r', offset=start, shape=(self.count,))
+            stream.seek(start + size)
+        else:
+            buffer = np.empty(size, dtype=np.uint8)
+            if stream.readinto(buffer) != buffer.nbytes:
+                stream.seek(start)
+                return None
+            data = buffer.view(dtype)
+
+        for i, p in enumerate(self.properties):
+            if p.list_type is None:
+                continue
+            count_offset = dtype.fields[p.name.decode('latin-1')][1] - np.dtype(p.list_type).itemsize
+            count_dtype = np.dtype({'names': ['count'], 'formats': [format + p.list_type],
+                                    'offsets': [count_offset], 'itemsize': dtype.itemsize})
+            counts = data.view(count_dtype)['count']
+            for begin in range(0, self.count, CHUNK_SIZE):
+                if np.any(counts[begin:begin + CHUNK_SIZE] != list_lengths[i]):
+                    # Lists of different lengths, e.g. a mix of triangles and quads
+                    stream.seek(start)
+                    return None
+        return data
+
 
 class PropertySpec:
     __slots__ = (
@@ -109,16 +189,48 @@ class ObjectSpec:
         # A list of element_specs
         self.specs = []
 
-    def load(self, format, stream):
-        return {
-            i.name: [
-                i.load(format, stream) for j in range(i.count)
-            ]
-            for i in self.specs
-        }
-
-
-def read(filepath):
+    def load(self, format, stream, use_mmap=False):
+        obj = {}
+        for i in self.specs:
+            # Fixed-size binary records are read in a single block, see ElementSpec.load_block
+            block = i.load_block(format, stream, use_mmap)
+            if block is None:
+                block = [i.load(format, stream) for j in range(i.count)]
+            obj[i.name] = block
+        return obj
+
+
+def element_columns(el, elements):
+    """
+    Values of each property of the elements read by ObjectSpec.load, as NumPy arrays:
+    (count,) for scalar properties, (count, length) for list properties. Lists of
+    different lengths are returned as a list of arrays instead.
+
+    el:       The ElementSpec of the elements.
+    elements: The elements, as loaded by ObjectSpec.load.
+    """
+    import numpy as np
+
+    columns = {}
+    for i, p in enumerate(el.properties):
+        if not isinstance(elements, list):
+            columns[p.name] = elements[p.name.decode('latin-1')]
+        elif p.list_type is None:
+            columns[p.name] = np.array([e[i] for e in elements])
+        else:
+            values = [np.array(e[i]) for e in elements]
+            if values and all(len(v) == len(values[0]) for v in values):
+                values = np.stack(values)
+            columns[p.name] = values
+    return columns
+
+
+def read(filepath, use_mmap=False):
+    """
+    Read a PLY file. Returns its ObjectSpec, its elements (see ObjectSpec.load) and its texture,
+    or None for the three of them if the file is invalid.
+    With use_mmap, fixed-size binary elements are memory mapped instead of being read in memory.
+    """
     import re
 
     format = b''
@@ -244,15 +356,149 @@ def read(filepath):
             print("Invalid header ('end_header' line not found!)")
             return invalid_ply
 
-        obj = obj_spec.load(format_specs[format], plyf)
+        obj = obj_spec.load(format_specs[format], plyf, use_mmap)
 
     return obj_spec, obj, texture
 
 
-def load_ply_mesh(filepath, ply_name):
+def fix_face_order(loops, loop_start, loop_total):
+    """
+    Rotate the triangles and quads whose last vertex is the vertex 0, in place.
+    EVIL EEKADOODLE - face order annoyance, done when the mesh has UVs or colors.
+
+    loops:      Vertex index of each face corner, faces after each other.
+    loop_start: Index of the first corner of each face.
+    loop_total: Number of corners of each face.
+    """
+    import numpy as np
+
+    for total, rotate, order in ((3, [2], [1, 2, 0]), (4, [2, 3], [2, 3, 0, 1])):
+        starts = loop_start[loop_total == total]
+        for begin in range(0, len(starts), CHUNK_SIZE):
+            corners = starts[begin:begin + CHUNK_SIZE, None] + np.arange(total)
+            face_loops = loops[corners]
+            rotated = np.any(face_loops[:, rotate] == 0, axis=1)
+            loops[corners[rotated]] = face_loops[rotated][:, order]
+
+
+def new_mesh(name, positions, loops=None, loop_total=None, edges=None, loop_uvs=None, loop_colors=None):
+    """
+    Create a mesh from NumPy arrays, with bulk foreach_set calls.
+    foreach_set fills a whole collection at once, so the arrays are passed in full:
+    Blender can't be fed in chunks, and keeps its own copy of the data.
+
+    name:        Name of the mesh.
+    positions:   (N, 3) vertex positions.
+    loops:       Vertex index of each face corner, faces after each other.
+    loop_total:  Number of corners of each face.
+    edges:       (E, 2) vertex indices of loose edges, optional.
+    loop_uvs:    (L, 2) texture coordinates of each corner, optional.
+    loop_colors: (L, 4) RGBA color of each corner, optional.
+    """
     import bpy
+    import numpy as np
+
+    mesh = bpy.data.meshes.new(name=name)
+    mesh.vertices.add(len(positions))
+    mesh.vertices.foreach_set("co", np.ascontiguousarray(positions, dtype=np.float32).ravel())
+
+    if edges is not None and len(edges):
+        mesh.edges.add(len(edges))
+        mesh.edges.foreach_set("vertices", np.ascontiguousarray(edges, dtype=np.int32).ravel())
+
+    if loop_total is not None and len(loop_total):
+        loop_total = np.asarray(loop_total, dtype=np.int32)
+        mesh.loops.add(len(loops))
+        mesh.polygons.add(len(loop_total))
+        mesh.loops.foreach_set("vertex_index", np.ascontiguousarray(loops, dtype=np.int32))
+        mesh.polygons.foreach_set("loop_start", (np.cumsum(loop_total) - loop_total).astype(np.int32))
+        mesh.polygons.foreach_set("loop_total", loop_total)
+
+        if loop_uvs is not None:
+            uv_layer = mesh.uv_layers.new()
+            uv_layer.data.foreach_set("uv", np.ascontiguousarray(loop_uvs, dtype=np.float32).ravel())
+
+        if loop_colors is not None:
+            vcol_lay = mesh.vertex_colors.new()
+            vcol_lay.data.foreach_set("color", np.ascontiguousarray(loop_colors, dtype=np.float32).ravel())
 
-    obj_spec, obj, texture = read(filepath)
+    mesh.update()
+    # As the per-element importer did: adds the edges of the faces, which foreach_set doesn't
+    # create, and removes invalid faces (e.g. with a repeated vertex)
+    mesh.validate()
+    return mesh
+
+
+def stack_columns(columns, dtype, rows=None):
+    """
+    Copy (N,) or (N, k) columns side by side in a new array, CHUNK_SIZE rows at a time:
+    memory-mapped columns are read a chunk at a time, without temporary copies of whole columns.
+
+    columns: Arrays with the same number of rows, e.g. from element_columns.
+    dtype:   Type of the returned array.
+    rows:    Indices of the rows to copy, optional.
+    """
+    import numpy as np
+
+    count = len(columns[0]) if rows is None else len(rows)
+    widths = [1 if column.ndim == 1 else column.shape[1] for column in columns]
+    stacked = np.empty((count, sum(widths)), dtype=dtype)
+    for begin in range(0, count, CHUNK_SIZE):
+        end = min(begin + CHUNK_SIZE, count)
+        index = slice(begin, end) if rows is None else rows[begin:end]
+        first = 0
+        for column, width in zip(columns, widths):
+            stacked[begin:end, first:first + width] = column[index].reshape(end - begin, width)
+            first += width
+    return stacked
+
+
+def face_loops(vertex_indices, step=1):
+    """
+    Flatten the vertex_indices lists of faces: returns the corners and the number of corners of each face.
+    Only one face every step faces is kept.
+    """
+    import numpy as np
+
+    vertex_indices = vertex_indices[::step]
+    if isinstance(vertex_indices, np.ndarray):
+        return stack_columns([vertex_indices], np.int32).ravel(), np.full(len(vertex_indices), vertex_indices.shape[1], dtype=np.int32)
+    loop_total = np.array([len(indices) for indices in vertex_indices], dtype=np.int32)
+    loops = np.concatenate(vertex_indices) if len(vertex_indices) else np.empty(0, dtype=np.int32)
+    return loops, loop_total
+
+
+def strip_triangles(vertex_indices):
+    """
+    Triangles of triangle strips, as a (T, 3) array.
+    """
+    import numpy as np
+    from numpy.lib.stride_tricks import sliding_window_view
+
+    if isinstance(vertex_indices, np.ndarray):
+        if vertex_indices.shape[1] < 3:
+            return np.empty((0, 3), dtype=vertex_indices.dtype)
+        return sliding_window_view(vertex_indices, 3, axis=1).reshape(-1, 3)
+    strips = [sliding_window_view(strip, 3) for strip in vertex_indices if len(strip) >= 3]
+    return np.concatenate(strips) if strips else np.empty((0, 3), dtype=np.int64)
+
+
+def parse_ply_mesh(filepath, use_mmap=False, proxy_faces=None):
+    """
+    Read the mesh of a PLY file in NumPy arrays: returns the arguments of new_mesh besides its name,
+    or None if the file is invalid. Does not use bpy, so that files can be parsed on worker threads.
+    Memory mapped files are decoded in chunks of CHUNK_SIZE elements, but the returned arrays hold
+    the whole mesh, since new_mesh needs them in full: the peak memory of an import is about the
+    decoded mesh plus Blender's copy of it, not the size of the file.
+
+    filepath:    Path of the PLY file.
+    use_mmap:    Memory map the file instead of reading it in memory, see read.
+    proxy_faces: Import a decimated proxy of the mesh with about this many faces, keeping one face
+                 every few faces and their vertices. Point clouds keep about this many vertices.
+    """
+    import numpy as np
+
+    obj_spec, obj, texture = read(filepath, use_mmap)
     # XXX28: use texture
     if obj is None:
         print("Invalid file")
@@ -260,148 +506,139 @@ def load_ply_mesh(filepath, ply_name):
 
     uvindices = colindices = None
     colmultiply = None
+    columns = {}
 
     # TODO import normals
-    # noindices = None
 
     for el in obj_spec.specs:
+        columns[el.name] = element_columns(el, obj[el.name])
         if el.name == b'vertex':
-            vindices_x, vindices_y, vindices_z = el.index(b'x'), el.index(b'y'), el.index(b'z')
-            # noindices = (el.index('nx'), el.index('ny'), el.index('nz'))
-            # if -1 in noindices: noindices = None
-            uvindices = (el.index(b's'), el.index(b't'))
-            if -1 in uvindices:
-                uvindices = (el.index(b'u'), el.index(b'v'))
-                if -1 in uvindices:
+            uvindices = (b's', b't')
+            if -1 in (el.index(b's'), el.index(b't')):
+                uvindices = (b'u', b'v')
+                if -1 in (el.index(b'u'), el.index(b'v')):
                     uvindices = None
             # ignore alpha if not present
             if el.index(b'alpha') == -1:
-                colindices = el.index(b'red'), el.index(b'green'), el.index(b'blue')
+                colindices = (b'red', b'green', b'blue')
             else:
-                colindices = el.index(b'red'), el.index(b'green'), el.index(b'blue'), el.index(b'alpha')
-            if -1 in colindices:
-                if any(idx > -1 for idx in colindices):
+                colindices = (b'red', b'green', b'blue', b'alpha')
+            if -1 in (el.index(name) for name in colindices):
+                if any(el.index(name) > -1 for name in colindices):
                     print("Warning: At least one obligatory color channel is missing, ignoring vertex colors.")
                 colindices = None
             else:  # if not a float assume uchar
-                colmultiply = [1.0 if el.properties[i].numeric_type in {'f', 'd'} else (1.0 / 255.0) for i in colindices]
-
-        elif el.name == b'face':
-            findex = el.index(b'vertex_indices')
-        elif el.name == b'tristrips':
-            trindex = el.index(b'vertex_indices')
-        elif el.name == b'edge':
-            eindex1, eindex2 = el.index(b'vertex1'), el.index(b'vertex2')
-
-    mesh_faces = []
-    mesh_uvs = []
-    mesh_colors = []
-
-    def add_face(vertices, indices, uvindices, colindices):
-        mesh_faces.append(indices)
-        if uvindices:
-            # Mitsuba seems to flip the UVS on the y-axis when exporting. We account for this here by flipping them
-            # back to the original coordinates.
-            mesh_uvs.extend([(vertices[index][uvindices[0]], 1-vertices[index][uvindices[1]]) for index in indices])
-        if colindices:
-            if len(colindices) == 3:
-                mesh_colors.extend([
-                    (
-                        vertices[index][colindices[0]] * colmultiply[0],
-                        vertices[index][colindices[1]] * colmultiply[1],
-                        vertices[index][colindices[2]] * colmultiply[2],
-                        1.0,
-                    )
-                    for index in indices
-                ])
-            elif len(colindices) == 4:
-                mesh_colors.extend([
-                    (
-                        vertices[index][colindices[0]] * colmultiply[0],
-                        vertices[index][colindices[1]] * colmultiply[1],
-                        vertices[index][colindices[2]] * colmultiply[2],
-                        vertices[index][colindices[3]] * colmultiply[3],
-                    )
-                    for index in indices
-                ])
-
+                colmultiply = [1.0 if el.properties[el.index(name)].numeric_type in {'f', 'd'} else (1.0 / 255.0) for name in colindices]
+
+    vertex = columns[b'vertex']
+    vertex_count = len(vertex[b'x'])
+
+    # Faces, then the triangles of the triangle strips
+    triangles = None
+    if b'tristrips' in columns:
+        triangles = strip_triangles(columns[b'tristrips'][b'vertex_indices'])
+    step = 1
+    if proxy_faces is not None:
+        face_count = len(columns[b'face'][b'vertex_indices']) if b'face' in columns else 0
+        if triangles is not None:
+            face_count += len(triangles)
+        step = max(1, -(-face_count // max(proxy_faces, 1)))
+    parts = []
+    if b'face' in columns:
+        parts.append(face_loops(columns[b'face'][b'vertex_indices'], step))
+    if triangles is not None:
+        triangles = triangles[::step]
+        parts.append((triangles.ravel(), np.full(len(triangles), 3, dtype=np.int32)))
+        del triangles
+    if len(parts) == 1:
+        loops, loop_total = parts[0]
+    elif parts:
+        loops = np.concatenate([part[0] for part in parts])
+        loop_total = np.concatenate([part[1] for part in parts])
+    else:
+        loops, loop_total = np.empty(0), np.empty(0)
+    del parts
+    loops = loops.astype(np.int32, copy=False)
+    loop_total = loop_total.astype(np.int32, copy=False)
+
+    # Vertices to import, all of them unless importing a proxy
+    vertex_rows = None
+    if proxy_faces is not None:
+        if len(loop_total):
+            # Only the vertices of the kept faces
+            vertex_rows, loops = np.unique(loops, return_inverse=True)
+            loops = loops.astype(np.int32).ravel()
+        elif vertex_count > proxy_faces:
+            vertex_rows = np.arange(0, vertex_count, -(-vertex_count // max(proxy_faces, 1)))
+    positions = stack_columns([vertex[b'x'], vertex[b'y'], vertex[b'z']], np.float32, vertex_rows)
+
+    loop_uvs = loop_colors = None
     if uvindices or colindices:
         # If we have Cols or UVs then we need to check the face order.
-        add_face_simple = add_face
-
-        # EVIL EEKADOODLE - face order annoyance.
-        def add_face(vertices, indices, uvindices, colindices):
-            if len(indices) == 4:
-                if indices[2] == 0 or indices[3] == 0:
-                    indices = indices[2], indices[3], indices[0], indices[1]
-            elif len(indices) == 3:
-                if indices[2] == 0:
-                    indices = indices[1], indices[2], indices[0]
-
-            add_face_simple(vertices, indices, uvindices, colindices)
-
-    verts = obj[b'vertex']
-
-    if b'face' in obj:
-        for f in obj[b'face']:
-            ind = f[findex]
-            add_face(verts, ind, uvindices, colindices)
-
-    if b'tristrips' in obj:
-        for t in obj[b'tristrips']:
-            ind = t[trindex]
-            len_ind = len(ind)
-            for j in range(len_ind - 2):
-                add_face(verts, (ind[j], ind[j + 1], ind[j + 2]), uvindices, colindices)
-
-    mesh = bpy.data.meshes.new(name=ply_name)
-
-    mesh.vertices.add(len(obj[b'vertex']))
-
-    mesh.vertices.foreach_set("co", [a for v in obj[b'vertex'] for a in (v[vindices_x], v[vindices_y], v[vindices_z])])
-
-    if b'edge' in obj:
-        mesh.edges.add(len(obj[b'edge']))
-        mesh.edges.foreach_set("vertices", [a for e in obj[b'edge'] for a in (e[eindex1], e[eindex2])])
-
-    if mesh_faces:
-        loops_vert_idx = []
-        faces_loop_start = []
-        faces_loop_total = []
-        lidx = 0
-        for f in mesh_faces:
-            nbr_vidx = len(f)
-            loops_vert_idx.extend(f)
-            faces_loop_start.append(lidx)
-            faces_loop_total.append(nbr_vidx)
-            lidx += nbr_vidx
-
-        mesh.loops.add(len(loops_vert_idx))
-        mesh.polygons.add(len(mesh_faces))
-
-        mesh.loops.foreach_set("vertex_index", loops_vert_idx)
-        mesh.polygons.foreach_set("loop_start", faces_loop_start)
-        mesh.polygons.foreach_set("loop_total", faces_loop_total)
-
-        if uvindices:
-            uv_layer = mesh.uv_layers.new()
-            for i, uv in enumerate(uv_layer.data):
-                uv.uv = mesh_uvs[i]
-
-        if colindices:
-            vcol_lay = mesh.vertex_colors.new()
-
-            for i, col in enumerate(vcol_lay.data):
-                col.color[0] = mesh_colors[i][0]
-                col.color[1] = mesh_colors[i][1]
-                col.color[2] = mesh_colors[i][2]
-                col.color[3] = mesh_colors[i][3]
-
-    mesh.update()
-    mesh.validate()
+        fix_face_order(loops, np.cumsum(loop_total, dtype=np.int64) - loop_total, loop_total)
+    if uvindices:
+        # Mitsuba seems to flip the UVS on the y-axis when exporting. We account for this here by flipping them
+        # back to the original coordinates.
+        uvs = stack_columns([vertex[name] for name in uvindices], np.float32, vertex_rows)
+        uvs[:, 1] = 1.0 - uvs[:, 1]
+        loop_uvs = uvs[loops]
+        del uvs
+    if colindices:
+        colors = np.ones((len(positions), 4), dtype=np.float32)
+        colors[:, :len(colindices)] = stack_columns([vertex[name] for name in colindices], np.float64, vertex_rows) * colmultiply
+        loop_colors = colors[loops]
+        del colors
+
+    edges = None
+    if b'edge' in columns:
+        edges = stack_columns([columns[b'edge'][b'vertex1'], columns[b'edge'][b'vertex2']], np.int64)
+        if vertex_rows is not None:
+            # Keep the edges between imported vertices
+            index = np.searchsorted(vertex_rows, edges).clip(max=max(len(vertex_rows) - 1, 0))
+            edges = index[np.all(vertex_rows[index] == edges, axis=1)] if len(vertex_rows) else edges[:0]
 
     if texture and uvindices:
         # TODO add support for using texture.
         pass
 
-    return mesh
+    return {
+        "positions": positions,
+        "loops": loops,
+        "loop_total": loop_total,
+        "edges": edges,
+        "loop_uvs": loop_uvs,
+        "loop_colors": loop_colors,
+    }
+
+
+def load_ply_mesh(filepath, ply_name, use_mmap=False, proxy_faces=None):
+    """
+    Create a mesh from a PLY file, see parse_ply_mesh.
+
+    filepath:    Path of the PLY file.
+    ply_name:    Name of the mesh.
+    """
+    buffers = parse_ply_mesh(filepath, use_mmap, proxy_faces)
+    if buffers is None:
+        return
+    return new_mesh(ply_name, **buffers)
+
+
+def mesh_from_buffers(name, positions, faces, uvs=None):
+    """
+    Create a mesh from triangle buffers, e.g. the ones of a scene bundle.
+
+    name:      Name of the mesh.
+    positions: (N, 3) float32 vertex positions.
+    faces:     (F, 3) vertex indices.
+    uvs:       (N, 2) float32 texture coordinates, optional.
+    """
+    import numpy as np
+
+    loops = np.ascontiguousarray(faces, dtype=np.int32).ravel()
+    loop_uvs = None
+    if uvs is not None:
+        # Flip the UVs back, like load_ply_mesh
+        loop_uvs = uvs[loops].astype(np.float32)
+        loop_uvs[:, 1] = 1.0 - loop_uvs[:, 1]
+    return new_mesh(name, positions, loops, np.full(len(faces), 3, dtype=np.int32), loop_uvs=loop_uvs)
@@ -212,6 +212,10 @@ class MitsubaSceneImportContext:
         self.axis_matrix_inv = axis_matrix.inverted()
         self.bl_material_cache = {}
         self.bl_image_cache = {}
+        self.bundle = None # Scene bundle being imported, if any
+        self.bundle_dir = None # Folder of the files extracted from the bundle
+        self.proxy_faces = None # Import PLY meshes as decimated proxies with about this many faces, if set
+        self.shape_files = {} # Shape id -> (path of its file, future of the parsed buffers), see shapes.parse_shape_files
 
     def log(self, message, level='INFO'):
         '''
@@ -242,6 +246,8 @@ class MitsubaSceneImportContext:
         return self.axis_matrix_inv @ matrix
 
     def resolve_scene_relative_path(self, path):
+        if self.bundle is not None and path in self.bundle.files:
+            return self.bundle.extract_file(path, self.bundle_dir)
         abs_path = os.path.join(self.directory, path)
         if not os.path.exists(abs_path):
             self.log(f'Cannot resolve scene relative path "{path}".', 'ERROR')
@@ -1,4 +1,6 @@
+import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 if "bpy" in locals():
     import importlib
@@ -42,6 +44,63 @@ def _set_bl_mesh_shading(bl_mesh, flat_shading=True, flip_normals=False):
         bl_mesh.flip_normals()
     bl_mesh.update()
 
+######################
+##   File parsing   ##
+######################
+
+def _shape_file_job(mi_context, shape_type, abs_path):
+    ''' Function and arguments parsing the file of a shape in NumPy buffers, without bpy.
+    Returns None for the shape types whose files are parsed by their converter.
+    '''
+    if shape_type == 'ply':
+        return bl_import_ply.parse_ply_mesh, (abs_path, True, mi_context.proxy_faces)
+    if shape_type == 'obj':
+        return bl_import_obj.parse_obj, (abs_path,)
+    return None
+
+def _shape_file_executor(job_count):
+    ''' Pool of workers parsing shape files, or None if there are too few files to be worth it.
+
+    Files are parsed on threads: forking Blender is unsafe (and unsupported on macOS and Windows),
+    and spawned processes would import the add-on, and bpy with it. The parsers spend most of
+    their time in file reads and numpy calls, which release the GIL.
+    '''
+    worker_count = min(job_count, os.cpu_count() or 1)
+    if worker_count < 2:
+        return None
+    return ThreadPoolExecutor(worker_count, thread_name_prefix='mitsuba-import')
+
+def parse_shape_files(mi_context):
+    ''' Start parsing the files of all the file-backed shapes of the scene on a pool of workers.
+    Parsing does not depend on bpy, so only the meshes are built on the main thread, when the
+    converters pick up the parsed buffers from mi_context.shape_files.
+
+    Returns the pool, to shut down once the shapes are converted, or None if the files are
+    left to the converters.
+    '''
+    jobs = []
+    for cls, mi_props in mi_context.mi_scene_props:
+        if cls != 'Shape' or not mi_props.has_property('filename'):
+            continue
+        filename = mi_props['filename']
+        if mi_context.bundle is not None and filename in mi_context.bundle.meshes:
+            # Built from the buffers of the bundle
+            continue
+        if _shape_file_job(mi_context, mi_props.plugin_name(), filename) is not None:
+            jobs.append(mi_props)
+
+    executor = _shape_file_executor(len(jobs))
+    if executor is None:
+        return None
+    for mi_props in jobs:
+        abs_path = mi_context.resolve_scene_relative_path(mi_props['filename'])
+        future = None
+        if abs_path is not None:
+            fn, args = _shape_file_job(mi_context, mi_props.plugin_name(), abs_path)
+            future = executor.submit(fn, *args)
+        mi_context.shape_files[mi_props.id()] = (abs_path, future)
+    return executor
+
 ######################
 ##    Converters    ##
 ######################
@@ -50,10 +109,19 @@ def mi_ply_to_bl_shape(mi_context, mi_shape):
     assert mi_shape.has_property('filename')
 
     filename = mi_shape['filename']
-    abs_path = mi_context.resolve_scene_relative_path(filename)
-
-    # Load .PLY mesh from file
-    bl_mesh = bl_import_ply.load_ply_mesh(abs_path, mi_shape.id())
+    buffers = mi_context.bundle.mesh_buffers(filename) if mi_context.bundle is not None else None
+    if buffers is not None:
+        # Bundled mesh, build it from the buffers of the bundle
+        bl_mesh = bl_import_ply.mesh_from_buffers(mi_shape.id(), buffers['positions'], buffers['faces'], buffers.get('uvs'))
+    elif mi_shape.id() in mi_context.shape_files:
+        # Already parsed along with the other shape files, see parse_shape_files
+        abs_path, future = mi_context.shape_files.pop(mi_shape.id())
+        buffers = future.result() if future is not None else None
+        bl_mesh = bl_import_ply.new_mesh(mi_shape.id(), **buffers) if buffers is not None else None
+    else:
+        abs_path = mi_context.resolve_scene_relative_path(filename)
+        # Load .PLY mesh from file. The file is memory mapped, so that huge meshes are not read in memory at once
+        bl_mesh = bl_import_ply.load_ply_mesh(abs_path, mi_shape.id(), use_mmap=True, proxy_faces=mi_context.proxy_faces)
     if not bl_mesh:
         mi_context.log(f'Cannot load PLY mesh file "{filename}".', 'ERROR')
         return None
@@ -71,10 +139,19 @@ def mi_obj_to_bl_shape(mi_context, mi_shape):
     assert mi_shape.has_property('filename')
 
     filename = mi_shape.get('filename')
-    abs_path = mi_context.resolve_scene_relative_path(filename)
-
-    # Load the mesh from the file
-    bl_meshes = bl_import_obj.load(abs_path)
+    if mi_shape.id() in mi_context.shape_files:
+        # Already parsed along with the other shape files, see parse_shape_files
+        abs_path, future = mi_context.shape_files.pop(mi_shape.id())
+        mesh = future.result() if future is not None else None
+        if mesh is not None:
+            bl_meshes = [bl_import_obj.mesh_from_obj_buffers(mesh)]
+        else:
+            # Not supported by the fast parser
+            bl_meshes = bl_import_obj.load(abs_path, use_fast_parser=False)
+    else:
+        abs_path = mi_context.resolve_scene_relative_path(filename)
+        # Load the mesh from the file
+        bl_meshes = bl_import_obj.load(abs_path)
     # FIXME: Handle multiple objects if supported by Mistuba.
     if len(bl_meshes) > 1:
         mi_context.log('OBJ file containing more than one mesh. Only the first one will be loaded.', 'WARN')
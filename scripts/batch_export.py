@@ -0,0 +1,182 @@
+'''
+Export many .blend files to Mitsuba scenes, with a pool of background blender processes.
+
+The manifest is a JSON file listing the scenes to export:
+    [
+        {"blend": "assets/chair.blend"},
+        {"blend": "assets/room.blend", "scene": "Night", "output": "room/night.xml", "options": {"split_files": true}}
+    ]
+Relative paths are relative to the manifest. "scene" defaults to the active scene of the file, "output" to
+<output dir>/<blend name>/<scene or blend name>.xml, and "options" are keyword arguments of the
+export_scene function of the add-on exporter.
+
+Each export runs in its own 'blender -b' process, which loads the file and runs this script with the
+add-on enabled. The add-on must be installed in blender (see the README), with Mitsuba initialized.
+One JSON line per export is printed and appended to the status log when it finishes, with its status
+('done' or 'failed') and timings. Running again with the same status log skips the exports that are
+already done, e.g. after a crash.
+
+Usage: python scripts/batch_export.py manifest.json --blender /path/to/blender [--jobs 4] [--status status.jsonl]
+'''
+import argparse
+import importlib
+import json
+import os
+import subprocess
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Prefix of the line holding the result of a blender process in its output
+RESULT_PREFIX = 'MITSUBA_BATCH_RESULT '
+
+def load_jobs(manifest_path, output_dir):
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+    jobs = []
+    for entry in entries:
+        blend = os.path.normpath(os.path.join(base_dir, entry['blend']))
+        scene = entry.get('scene')
+        blend_name = os.path.splitext(os.path.basename(blend))[0]
+        output = entry.get('output') or os.path.join(output_dir, blend_name, f"{scene or blend_name}.xml")
+        jobs.append({
+            'blend': blend,
+            'scene': scene,
+            'output': os.path.normpath(os.path.join(base_dir, output)),
+            'options': entry.get('options', {}),
+        })
+    return jobs
+
+def job_key(job):
+    return (job['blend'], job['scene'], job['output'])
+
+def finished_jobs(status_path):
+    '''
+    Keys of the exports marked as done in the status log, and whose scene file still exists.
+    A line cut by a crash is ignored.
+    '''
+    finished = set()
+    if not os.path.exists(status_path):
+        return finished
+    with open(status_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get('status') == 'done' and os.path.exists(record['output']):
+                finished.add(job_key(record))
+            else:
+                finished.discard(job_key(record))
+    return finished
+
+def open_status_log(status_path):
+    line_cut = False
+    if os.path.exists(status_path) and os.path.getsize(status_path) > 0:
+        with open(status_path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            line_cut = f.read(1) != b'\n'
+    status_file = open(status_path, 'a', encoding='utf-8')
+    # Terminate a line cut by a crash, so that the next record starts on its own line
+    if line_cut:
+        status_file.write('\n')
+    return status_file
+
+def run_job(job, args):
+    '''
+    Export one scene in a background blender process. Returns its status record.
+    '''
+    command = [
+        args.blender, '-b', job['blend'],
+        '--addons', args.addon,
+        '--python-exit-code', '1',
+        '--python', os.path.realpath(__file__),
+        '--', '--addon', args.addon, '--worker', json.dumps(job),
+    ]
+    record = {key: job[key] for key in ('blend', 'scene', 'output')}
+    start = time.perf_counter()
+    try:
+        process = subprocess.run(command, capture_output=True, text=True, timeout=args.timeout)
+    except subprocess.TimeoutExpired:
+        record.update(status='failed', error=f"Timed out after {args.timeout} seconds")
+    else:
+        result = None
+        for line in process.stdout.splitlines():
+            if line.startswith(RESULT_PREFIX):
+                result = json.loads(line[len(RESULT_PREFIX):])
+        if result is None:
+            # Blender failed before running the export, e.g. a missing file or add-on
+            result = {'error': '\n'.join((process.stderr or process.stdout).splitlines()[-20:])}
+        record.update(result)
+        record['status'] = 'done' if process.returncode == 0 and 'error' not in result else 'failed'
+        record['returncode'] = process.returncode
+    record['seconds'] = round(time.perf_counter() - start, 3)
+    return record
+
+def run_batch(args):
+    jobs = load_jobs(args.manifest, args.output_dir)
+    status_path = args.status or f"{os.path.splitext(args.manifest)[0]}.status.jsonl"
+    finished = finished_jobs(status_path)
+    pending = [job for job in jobs if job_key(job) not in finished]
+    print(f"{len(jobs) - len(pending)} of {len(jobs)} exports already done, {len(pending)} to go.", file=sys.stderr)
+
+    failures = 0
+    with open_status_log(status_path) as status_file, ThreadPoolExecutor(args.jobs) as pool:
+        # Each thread waits on its own blender process
+        futures = [pool.submit(run_job, job, args) for job in pending]
+        for future in as_completed(futures):
+            record = future.result()
+            failures += record['status'] != 'done'
+            line = json.dumps(record)
+            print(line, flush=True)
+            status_file.write(line + '\n')
+            status_file.flush()
+            os.fsync(status_file.fileno())
+    return 1 if failures else 0
+
+def run_worker(job, addon):
+    '''
+    Export a scene of the loaded .blend file. Runs inside blender.
+    '''
+    import bpy
+    result = {}
+    try:
+        if not bpy.context.preferences.addons[addon].preferences.is_mitsuba_initialized:
+            raise RuntimeError('Mitsuba is not initialized, check the add-on preferences')
+        exporter = importlib.import_module(f"{addon}.io.exporter")
+        b_scene = bpy.data.scenes[job['scene']] if job['scene'] else bpy.context.scene
+        os.makedirs(os.path.dirname(job['output']), exist_ok=True)
+        start = time.perf_counter()
+        exporter.export_scene(job['output'], b_scene, **job['options'])
+        result['scene_name'] = b_scene.name
+        result['export_seconds'] = round(time.perf_counter() - start, 3)
+    except Exception as e:
+        traceback.print_exc()
+        result['error'] = f"{type(e).__name__}: {e}"
+    print(RESULT_PREFIX + json.dumps(result), flush=True)
+    return 1 if 'error' in result else 0
+
+def main():
+    # Inside blender, the arguments of the script follow '--'
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else sys.argv[1:]
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('manifest', nargs='?', help='JSON file listing the .blend files and scenes to export')
+    parser.add_argument('--blender', default='blender', help='Path to the blender executable')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='Number of blender processes running at the same time')
+    parser.add_argument('--output-dir', default='export', help='Folder of the scenes without an output path, relative to the manifest')
+    parser.add_argument('--status', help='Status log, defaults to <manifest>.status.jsonl')
+    parser.add_argument('--timeout', type=float, help='Maximum duration of one export in seconds')
+    parser.add_argument('--addon', default='mitsuba-blender', help='Module name of the add-on in blender')
+    parser.add_argument('--worker', help=argparse.SUPPRESS) # Export job, run by the blender processes
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        sys.exit(run_worker(json.loads(args.worker), args.addon))
+    if args.manifest is None:
+        parser.error('the manifest is required')
+    sys.exit(run_batch(args))
+
+if __name__ == '__main__':
+    main()
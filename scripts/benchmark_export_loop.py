@@ -0,0 +1,117 @@
+'''
+Benchmark the object loop of SceneConverter.scene_to_dict on a synthetic scene.
+
+The scene is a plane scattering hair particles, rendered as instances of a collection of small objects.
+The loop is timed with no-op export functions, so that only the cost of iterating the depsgraph,
+filtering hidden and unselected objects and dispatching by type is measured. The previous loop
+(list lookup of the particle objects, parent visibility and selection queried for every instance) is
+timed the same way for comparison.
+
+Runs inside blender:
+    blender -b --factory-startup -P scripts/benchmark_export_loop.py -- [--instances 1000000] [--prototypes 100] [--use-selection]
+'''
+import argparse
+import importlib
+import os
+import sys
+import time
+
+import bpy
+
+def load_exporter():
+    # Import the add-on from this repository, it does not need to be installed
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+    return importlib.import_module('mitsuba-blender.io.exporter')
+
+def build_scene(instance_count, prototype_count):
+    bpy.ops.wm.read_homefile(use_empty=True)
+    b_scene = bpy.context.scene
+
+    prototypes = bpy.data.collections.new('Prototypes')
+    b_scene.collection.children.link(prototypes)
+    bpy.context.view_layer.layer_collection.children['Prototypes'].exclude = True
+    bpy.ops.mesh.primitive_cube_add(size=0.01)
+    cube = bpy.context.active_object
+    for collection in cube.users_collection:
+        collection.objects.unlink(cube)
+    prototypes.objects.link(cube)
+    for i in range(1, prototype_count):
+        duplicate = cube.copy()
+        duplicate.name = f'Prototype{i:04d}'
+        prototypes.objects.link(duplicate)
+
+    bpy.ops.mesh.primitive_plane_add(size=100)
+    emitter = bpy.context.active_object
+    emitter.modifiers.new('Scatter', 'PARTICLE_SYSTEM')
+    settings = emitter.particle_systems[0].settings
+    settings.type = 'HAIR'
+    settings.count = instance_count
+    settings.hair_length = 0.01
+    settings.render_type = 'COLLECTION'
+    settings.instance_collection = prototypes
+    emitter.select_set(True)
+    return b_scene
+
+def previous_loop(depsgraph, particles, use_selection, export):
+    particles = list(particles)
+    for object_instance in depsgraph.object_instances:
+        if use_selection:
+            if not object_instance.is_instance and not object_instance.object.original.select_get():
+                continue
+            if (object_instance.is_instance and object_instance.object.parent
+                and not object_instance.object.parent.original.select_get()):
+                continue
+        evaluated_obj = object_instance.object
+        object_type = evaluated_obj.type
+        if evaluated_obj.hide_render or (object_instance.is_instance
+            and evaluated_obj.parent and evaluated_obj.parent.original.hide_render):
+            continue
+        if object_type in {'MESH', 'FONT', 'SURFACE', 'META'}:
+            export(object_instance, None, evaluated_obj.name in particles)
+        elif object_type in {'CAMERA', 'LIGHT'}:
+            export(object_instance, None, False)
+
+def current_loop(exporter, depsgraph, particles, use_selection, export):
+    converter = exporter.SceneConverter()
+    converter.use_selection = use_selection
+    converter.object_exporters = lambda: {object_type: export for object_type in ('MESH', 'FONT', 'SURFACE', 'META', 'CAMERA', 'LIGHT')}
+    converter.export_objects(depsgraph, depsgraph.scene, particles, None)
+
+def main():
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--instances', type=int, default=1000000, help='Number of particle instances')
+    parser.add_argument('--prototypes', type=int, default=100, help='Number of objects in the instanced collection')
+    parser.add_argument('--use-selection', action='store_true', help='Only export the selection')
+    args = parser.parse_args(argv)
+
+    exporter = load_exporter()
+    start = time.perf_counter()
+    build_scene(args.instances, args.prototypes)
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    print(f"Scene built in {time.perf_counter() - start:.1f} s, {len(depsgraph.object_instances)} object instances")
+
+    exported = [0]
+    def export(object_instance, b_scene, is_particle):
+        exported[0] += 1
+
+    particles = exporter.SceneConverter.particle_objects()
+    timings = {}
+    start = time.perf_counter()
+    for object_instance in depsgraph.object_instances:
+        object_instance.object
+    timings['iteration only'] = time.perf_counter() - start
+    for label, loop in (('previous loop', lambda: previous_loop(depsgraph, particles, args.use_selection, export)),
+                        ('current loop', lambda: current_loop(exporter, depsgraph, particles, args.use_selection, export))):
+        exported[0] = 0
+        start = time.perf_counter()
+        loop()
+        timings[label] = time.perf_counter() - start
+        print(f"{label}: {exported[0]} objects exported")
+
+    print(f"{'loop':>15} {'time (s)':>9} {'per instance (us)':>18}")
+    for label, duration in timings.items():
+        print(f"{label:>15} {duration:>9.3f} {1e6 * duration / args.instances:>18.3f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+'''
+Benchmark the transfer of the film of the MITSUBA render engine to blender render passes.
+
+Compares the time and peak memory of the current transfer (engine/film.py) with the previous
+one (averaged bitmap, split, dstack, flip, reshape and list assignment to RenderPass.rect).
+The 'pass' rows measure a whole progressive pass: adding the film values of the pass to the
+accumulation buffer, then the transfer.
+Runs outside of blender: the film and the render passes are simulated by preallocated arrays.
+
+Usage: python scripts/benchmark_render_result.py [--resolutions 4k 8k] [--aovs 10] [--repeat 3]
+'''
+import argparse
+import importlib.util
+import os
+import time
+import tracemalloc
+
+import numpy as np
+
+resolutions = {
+    '1080p': (1920, 1080),
+    '4k': (3840, 2160),
+    '8k': (7680, 4320),
+}
+
+def load_film_module():
+    film_path = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'mitsuba-blender', 'engine', 'film.py')
+    spec = importlib.util.spec_from_file_location('film', film_path)
+    film = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(film)
+    return film
+
+def film_channel_names(aov_count):
+    # An AOV integrator: RGBA image, then alternating 3 channel and 2 channel AOVs
+    names = ['R', 'G', 'B', 'A']
+    for i in range(aov_count):
+        channels = ['X', 'Y', 'Z'] if i % 2 == 0 else ['U', 'V']
+        names += [f'aov{i}.{c}' for c in channels]
+    return names
+
+def previous_accumulate(accumulation, pixels, spp):
+    accumulation += pixels * np.float32(spp)
+
+def previous_pass(film, accumulation, pixels, spp, rendered_spp, passes, rects):
+    previous_accumulate(accumulation, pixels, spp)
+    previous_transfer(film, accumulation, rendered_spp, passes, rects)
+
+def current_pass(film, accumulation, pixels, spp, rendered_spp, passes, rects, buffers):
+    film.accumulate(pixels, spp, accumulation)
+    current_transfer(film, accumulation, rendered_spp, passes, rects, buffers)
+
+def previous_transfer(film, accumulation, rendered_spp, passes, rects):
+    averaged = accumulation / rendered_spp # Bitmap(accumulation / rendered_spp).split()
+    for pass_name, channels, _ in passes:
+        render_pixels = np.array(averaged[..., channels])
+        if render_pixels.shape[2] == 2:
+            render_pixels = np.dstack((render_pixels, np.zeros((*render_pixels.shape[:2], 1))))
+        height, width = render_pixels.shape[:2]
+        # layer.rect = ... converts the pixels to the float storage of the pass
+        rects[pass_name][...] = np.flip(render_pixels, 0).reshape((width * height, -1))
+
+def current_transfer(film, accumulation, rendered_spp, passes, rects, buffers):
+    for (pass_name, channels, _), buffer in zip(passes, buffers):
+        film.write_pass(accumulation, channels, rendered_spp, buffer)
+        # rect.foreach_set(buffer.ravel()) copies the buffer into the pass
+        np.copyto(rects[pass_name].reshape(-1), buffer.ravel())
+
+def measure(fn, repeat):
+    times = []
+    peak = 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return min(times), peak
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--resolutions', nargs='+', default=['4k', '8k'], choices=list(resolutions))
+    parser.add_argument('--aovs', type=int, default=10, help='Number of AOVs of the film')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs, the fastest one is reported')
+    args = parser.parse_args()
+
+    film = load_film_module()
+    print(f"{'resolution':>10} {'stage':>9} {'version':>9} {'time (s)':>9} {'peak (MiB)':>11} {'film (MiB)':>11}")
+    for resolution in args.resolutions:
+        width, height = resolutions[resolution]
+        channel_names = film_channel_names(args.aovs)
+        rng = np.random.default_rng(0)
+        accumulation = rng.random((height, width, len(channel_names)), dtype=np.float32)
+        # Film values of a pass, scaled in place by the current accumulation like the film's bitmap
+        pixels = rng.random((height, width, len(channel_names)), dtype=np.float32)
+        passes = film.film_passes(channel_names)
+        rects = {pass_name: np.empty((width * height, film.pass_channel_count(channels.stop - channels.start)), dtype=np.float32)
+                 for pass_name, channels, _ in passes}
+        buffers = [film.allocate_pass_buffer(width, height, channels.stop - channels.start) for _, channels, _ in passes]
+        film_size = accumulation.nbytes / 2**20
+
+        runs = (
+            ('transfer', 'previous', lambda: previous_transfer(film, accumulation, 4, passes, rects)),
+            ('transfer', 'current', lambda: current_transfer(film, accumulation, 4, passes, rects, buffers)),
+            ('pass', 'previous', lambda: previous_pass(film, accumulation, pixels, 2, 4, passes, rects)),
+            ('pass', 'current', lambda: current_pass(film, accumulation, pixels, 2, 4, passes, rects, buffers)),
+        )
+        for stage, label, fn in runs:
+            duration, peak = measure(fn, args.repeat)
+            print(f"{resolution:>10} {stage:>9} {label:>9} {duration:>9.3f} {peak / 2**20:>11.1f} {film_size:>11.1f}")
+
+if __name__ == '__main__':
+    main()
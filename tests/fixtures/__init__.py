@@ -153,3 +153,23 @@ class MitsubaRenderTester:
 @pytest.fixture
 def mitsuba_scene_ztest(mitsuba_scene_renderer):
     return MitsubaRenderTester(mitsuba_scene_renderer)
+
+######################
+##  Mesh test data  ##
+######################
+
+def random_mesh(vertex_count=64, face_count=100, seed=0):
+    '''
+    Random triangle mesh, as the keyword arguments of ply_writer.write_ply.
+    Normals are normalized, since Mitsuba normalizes them when loading the mesh.
+    '''
+    rng = np.random.default_rng(seed)
+    normals = rng.random((vertex_count, 3), dtype=np.float32) - 0.5
+    normals /= np.linalg.norm(normals, axis=1, keepdims=True)
+    return {
+        'positions': rng.random((vertex_count, 3), dtype=np.float32),
+        'faces': rng.integers(0, vertex_count, (face_count, 3)).astype(np.uint32),
+        'normals': normals,
+        'uvs': rng.random((vertex_count, 2), dtype=np.float32),
+        'attributes': {'vertex_Col': rng.random((vertex_count, 3), dtype=np.float32)},
+    }
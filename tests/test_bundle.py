@@ -0,0 +1,135 @@
+import importlib
+import os
+
+import numpy as np
+import pytest
+
+from fixtures import *
+
+def write_texture(filepath):
+    from mitsuba import Bitmap, Struct
+    pixels = np.random.default_rng(0).random((4, 4, 3), dtype=np.float32)
+    Bitmap(pixels).convert(Bitmap.PixelFormat.RGB, Struct.Type.UInt8, True).write(filepath)
+
+def test_bundle_round_trip(tmp_path):
+    bundle = importlib.import_module("mitsuba-blender.io.bundle")
+    from mitsuba import ScalarTransform4f
+
+    mesh = random_mesh()
+    texture_path = str(tmp_path / "wood.png")
+    with open(texture_path, 'wb') as f:
+        f.write(os.urandom(1000))
+    matrices = np.random.default_rng(1).random((5, 4, 4), dtype=np.float32)
+    to_world = ScalarTransform4f.translate([1, 2, 3])
+    scene_dict = {
+        'type': 'scene',
+        'mesh': {'type': 'ply', 'filename': 'meshes/mesh.ply', 'to_world': to_world},
+        'mat': {'type': 'diffuse', 'reflectance': {'type': 'bitmap', 'filename': 'textures/wood.png'}},
+    }
+
+    bundle_path = str(tmp_path / "scene.mib")
+    writer = bundle.BundleWriter(bundle_path)
+    writer.add_mesh('meshes/mesh.ply', **mesh)
+    writer.add_file('textures/wood.png', texture_path)
+    writer.add_file('textures/wood-copy.png', texture_path)
+    writer.add_instances('mesh-group', matrices)
+    writer.close(scene_dict)
+    assert bundle.is_bundle(bundle_path)
+    assert not os.path.exists(f"{bundle_path}.part")
+
+    loaded = bundle.Bundle(bundle_path)
+    buffers = loaded.mesh_buffers('meshes/mesh.ply')
+    for name in ('positions', 'faces', 'normals', 'uvs'):
+        assert buffers[name].dtype == mesh[name].dtype
+        assert np.array_equal(buffers[name], mesh[name]), name
+        # Views of the bundle, aligned so that they can be used in place
+        assert not buffers[name].flags.writeable
+        assert buffers[name].ctypes.data % bundle.ALIGNMENT == 0
+    assert np.array_equal(buffers['attributes']['vertex_Col'], mesh['attributes']['vertex_Col'])
+    assert loaded.mesh_buffers('meshes/missing.ply') is None
+
+    with open(texture_path, 'rb') as f:
+        assert bytes(loaded.file_data('textures/wood.png')) == f.read()
+    # Files with the same content are stored once
+    assert loaded.files['textures/wood.png'] == loaded.files['textures/wood-copy.png']
+    assert np.array_equal(loaded.instance_matrices('mesh-group'), matrices)
+
+    scene = loaded.scene_dict()
+    assert np.array_equal(np.array(scene['mesh']['to_world'].matrix), np.array(to_world.matrix))
+    assert scene['mat'] == scene_dict['mat']
+    instances = [scene[f"instance-mesh-group-{i}"] for i in range(len(matrices))]
+    assert all(instance['shape'] == {'type': 'ref', 'id': 'mesh-group'} for instance in instances)
+    assert np.allclose([np.array(instance['to_world'].matrix) for instance in instances], matrices)
+
+    extracted = loaded.extract_file('textures/wood.png', str(tmp_path / "extracted"))
+    assert extracted == os.path.join(str(tmp_path), "extracted", "textures", "wood.png")
+    with open(extracted, 'rb') as f, open(texture_path, 'rb') as g:
+        assert f.read() == g.read()
+
+def test_bundle_abort(tmp_path):
+    bundle = importlib.import_module("mitsuba-blender.io.bundle")
+
+    bundle_path = str(tmp_path / "scene.mib")
+    writer = bundle.BundleWriter(bundle_path)
+    writer.add_mesh('meshes/mesh.ply', **random_mesh())
+    staging_dir = writer.staging_dir
+    writer.abort()
+    assert not os.path.exists(bundle_path)
+    assert not os.path.exists(f"{bundle_path}.part")
+    assert not os.path.exists(staging_dir)
+
+def test_bundle_incomplete(tmp_path):
+    bundle = importlib.import_module("mitsuba-blender.io.bundle")
+
+    bundle_path = str(tmp_path / "scene.mib")
+    writer = bundle.BundleWriter(bundle_path)
+    writer.add_mesh('meshes/mesh.ply', **random_mesh())
+    writer.close({'type': 'scene'})
+    with open(bundle_path, 'r+b') as f:
+        f.truncate(f.seek(0, 2) - 1)
+    with pytest.raises(ValueError):
+        bundle.Bundle(bundle_path)
+
+def test_bundle_loads_like_files(tmp_path):
+    bundle = importlib.import_module("mitsuba-blender.io.bundle")
+    ply_writer = importlib.import_module("mitsuba-blender.io.exporter.ply_writer")
+    from mitsuba import ScalarTransform4f, load_dict, traverse
+
+    def scene_dict():
+        return {
+            'type': 'scene',
+            'mat': {'type': 'diffuse', 'reflectance': {'type': 'bitmap', 'filename': 'textures/tex.png'}},
+            'mesh': {'type': 'ply', 'filename': 'meshes/mesh.ply', 'bsdf': {'type': 'ref', 'id': 'mat'},
+                     'to_world': ScalarTransform4f.translate([0, 1, 0]).scale(2)},
+            'light': {'type': 'ply', 'filename': 'meshes/light.ply',
+                      'emitter': {'type': 'area', 'radiance': {'type': 'rgb', 'value': [1, 1, 1]}}},
+        }
+    meshes = {'meshes/mesh.ply': random_mesh(seed=0), 'meshes/light.ply': random_mesh(seed=1)}
+
+    # The same scene as loose files, and as a bundle
+    scene_dir = tmp_path / "files"
+    (scene_dir / "meshes").mkdir(parents=True)
+    (scene_dir / "textures").mkdir()
+    write_texture(str(scene_dir / "textures" / "tex.png"))
+    for filename, mesh in meshes.items():
+        ply_writer.write_ply(str(scene_dir / filename), **mesh)
+    bundle_path = str(tmp_path / "scene.mib")
+    writer = bundle.BundleWriter(bundle_path)
+    writer.add_file('textures/tex.png', str(scene_dir / "textures" / "tex.png"))
+    for filename, mesh in meshes.items():
+        writer.add_mesh(filename, **mesh)
+    writer.close(scene_dict())
+
+    files_dict = scene_dict()
+    for key in ('mesh', 'light'):
+        files_dict[key]['filename'] = str(scene_dir / files_dict[key]['filename'])
+    files_dict['mat']['reflectance']['filename'] = str(scene_dir / "textures" / "tex.png")
+    reference = {shape.id(): traverse(shape) for shape in load_dict(files_dict).shapes()}
+    shapes = {shape.id(): shape for shape in load_dict(bundle.load_bundle(bundle_path)).shapes()}
+
+    assert shapes.keys() == reference.keys()
+    assert shapes['light'].emitter() is not None
+    for shape_id, shape in shapes.items():
+        params = traverse(shape)
+        for key in ('vertex_positions', 'faces', 'vertex_normals', 'vertex_texcoords', 'vertex_Col'):
+            assert np.allclose(np.array(params[key]), np.array(reference[shape_id][key]), atol=1e-5), (shape_id, key)
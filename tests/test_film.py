@@ -0,0 +1,45 @@
+import importlib
+
+import numpy as np
+import pytest
+
+def test_film_passes():
+    film = importlib.import_module("mitsuba-blender.engine.film")
+
+    channel_names = ['R', 'G', 'B', 'A', 'albedo.R', 'albedo.G', 'albedo.B', 'uv.U', 'uv.V', 'depth.T']
+    assert film.film_passes(channel_names) == [
+        ('Main', slice(0, 4), 'RGBA'),
+        ('albedo', slice(4, 7), 'RGB'),
+        ('uv', slice(7, 9), 'UV'),
+        ('depth', slice(9, 10), 'T'),
+    ]
+    assert [film.pass_channel_count(3), film.pass_channel_count(2), film.pass_channel_count(1)] == [3, 3, 1]
+
+def test_film_accumulation():
+    film = importlib.import_module("mitsuba-blender.engine.film")
+
+    rng = np.random.default_rng(0)
+    pass_pixels = [rng.random((6, 5, 4), dtype=np.float32) for _ in range(3)]
+    pass_spp = [4, 1, 3]
+    expected = sum(pixels * spp for pixels, spp in zip(pass_pixels, pass_spp))
+
+    accumulation = film.accumulate(pass_pixels[0].copy(), pass_spp[0])
+    for pixels, spp in zip(pass_pixels[1:], pass_spp[1:]):
+        assert film.accumulate(pixels.copy(), spp, accumulation) is accumulation
+    assert accumulation.dtype == np.float32
+    assert np.allclose(accumulation, expected)
+
+@pytest.mark.parametrize("channel_names", [['R', 'G', 'B', 'A'], ['R', 'G', 'B', 'A', 'uv.U', 'uv.V']])
+def test_film_write_pass(channel_names):
+    film = importlib.import_module("mitsuba-blender.engine.film")
+
+    height, width, rendered_spp = 6, 5, 8
+    accumulation = np.random.default_rng(0).random((height, width, len(channel_names)), dtype=np.float32)
+    for pass_name, channels, _ in film.film_passes(channel_names):
+        channel_count = channels.stop - channels.start
+        buffer = film.allocate_pass_buffer(width, height, channel_count)
+        film.write_pass(accumulation, channels, rendered_spp, buffer)
+        # Averaged, with the bottom row first, and the dummy third channel of 2 channel passes left to 0
+        expected = np.zeros((height, width, film.pass_channel_count(channel_count)), dtype=np.float32)
+        expected[..., :channel_count] = np.flip(accumulation[..., channels], 0) / rendered_spp
+        assert np.allclose(buffer, expected), pass_name
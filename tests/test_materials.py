@@ -0,0 +1,36 @@
+import importlib
+
+import pytest
+
+def rgb_material(output_color=(0.8, 0.1, 0.1, 1.0), node_color=(0.6, 0.6, 0.6)):
+    '''
+    Diffuse material whose color comes from an RGB node.
+    '''
+    import bpy
+    mat = bpy.data.materials.new("rgb")
+    mat.use_nodes = True
+    nodes, links = mat.node_tree.nodes, mat.node_tree.links
+    nodes.clear()
+    output = nodes.new('ShaderNodeOutputMaterial')
+    diffuse = nodes.new('ShaderNodeBsdfDiffuse')
+    rgb = nodes.new('ShaderNodeRGB')
+    rgb.outputs[0].default_value = output_color
+    rgb.color = node_color
+    links.new(rgb.outputs[0], diffuse.inputs['Color'])
+    links.new(diffuse.outputs[0], output.inputs['Surface'])
+    return mat
+
+@pytest.mark.parametrize("other", [
+    {'output_color': (0.1, 0.8, 0.1, 1.0)},
+    {'node_color': (0.1, 0.8, 0.1)},
+])
+def test_material_key_rgb_node(other):
+    import bpy
+    materials = importlib.import_module("mitsuba-blender.io.exporter.materials")
+
+    mat, duplicate, different = rgb_material(), rgb_material(), rgb_material(**other)
+    assert materials.material_key(mat) == materials.material_key(duplicate)
+    assert materials.material_key(mat) != materials.material_key(different)
+
+    for material in (mat, duplicate, different):
+        bpy.data.materials.remove(material)
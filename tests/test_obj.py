@@ -0,0 +1,140 @@
+import importlib
+
+import numpy as np
+import pytest
+
+def grid_obj(size=4):
+    '''
+    Quad grid in a single smooth group, with texture coordinates and normals.
+    '''
+    lines = ['o Grid', 's 1']
+    for y in range(size):
+        for x in range(size):
+            lines.append(f'v {x * 0.1:.6f} {y * 0.1:.6f} 0.000000')
+            lines.append(f'vt {x / (size - 1):.6f} {y / (size - 1):.6f}')
+    lines.append('vn 0.0000 0.0000 1.0000')
+    for y in range(size - 1):
+        for x in range(size - 1):
+            corners = [y * size + x + 1, y * size + x + 2, (y + 1) * size + x + 2, (y + 1) * size + x + 1]
+            lines.append('f ' + ' '.join(f'{i}/{i}/1' for i in corners))
+    return '\n'.join(lines) + '\n'
+
+# Files that the fast parser reads
+fast_files = {
+    'cube': '# cube\nmtllib cube.mtl\no Cube\n'
+            'v 1 1 -1\nv 1 -1 -1\nv 1 1 1\nv 1 -1 1\nv -1 1 -1\nv -1 -1 -1\nv -1 1 1\nv -1 -1 1\nv 5 5 5\n'
+            'vt 0.625 0.5\nvt 0.875 0.5\nvt 0.875 0.75\nvt 0.625 0.75\n'
+            'vn 0 1 0\nvn 0 0 1\nvn -1 0 0\nvn 0 -1 0\nvn 1 0 0\nvn 0 0 -1\n'
+            'usemtl Material\ns off\n'
+            'f 1/1/1 5/2/1 7/3/1 3/4/1\nf 4/1/2 3/2/2 7/3/2 8/4/2\nf 8/1/3 7/2/3 5/3/3 6/4/3\n'
+            'f 6/1/4 2/2/4 4/3/4 8/4/4\nf 2/1/5 1/2/5 3/3/5 4/4/5\nf 6/1/6 5/2/6 1/3/6 2/4/6\n',
+    # Windows line breaks, tabs, and texture coordinates without their 'v' value
+    'crlf': 'v 0 0 0\r\nv 1 0 0\r\nv 0 1 0\r\nv 1 1 0\r\nvt 0.5\r\nvt 1\r\nvt 0\r\n'
+            'f 1/1 2/2 3/3\r\nf\t2/1 4/2 3/3\r\n',
+    'normals_only': 'v 0 0 0\nv 1 0 0\nv 0 1 0\nv 1 1 0\nvn 0 0 1\nf 1//1 2//1 3//1\nf 2//1 4//1 3//1\ns off\n',
+    'negative_indices': 'v 0 0 0\nv 1 0 0\nv 0 1 0\nf -3 -2 -1\nv 1 1 0\nf -3 -1 -2\n',
+    'no_final_line_break': 'v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 3',
+    'points': 'v 0 0 0\nv 1 0 0\nv 0 1 0\n',
+    'smooth_grid': grid_obj(),
+}
+
+# Files that the fast parser leaves to the line-by-line parser
+fallback_files = {
+    'line_continuation': 'v 0 0 0\nv 1 0 0 \\\n\nv 0 1 0\nf 1 2 3\n',
+    'mixed_face_sizes': 'v 0 0 0\nv 1 0 0\nv 0 1 0\nv 1 1 0\nf 1 2 3\nf 2 4 3 1\n',
+    'two_objects': 'v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 3\no Second\nf 1 3 2\n',
+    'two_smooth_groups': 'v 0 0 0\nv 1 0 0\nv 0 1 0\nv 1 1 0\ns 1\nf 1 2 3\ns 2\nf 2 4 3\n',
+    'edges': 'v 0 0 0\nv 1 0 0\nv 0 1 0\nl 1 2\nf 1 2 3\n',
+    'comma_decimals': 'v 0,5 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 3\n',
+    'repeated_vertex': 'v 0 0 0\nv 1 0 0\nv 0 1 0\nv 1 1 0\nf 1 2 3 1\nf 2 4 3 2\n',
+    'mixed_corner_formats': 'v 0 0 0\nv 1 0 0\nv 0 1 0\nvt 0 0\nf 1/1 2 3\n',
+}
+
+def mesh_summary(mesh):
+    '''
+    Data of a blender mesh to compare imports.
+    '''
+    def get(collection, attr, dtype, width=1):
+        values = np.empty(len(collection) * width, dtype=dtype)
+        collection.foreach_get(attr, values)
+        return values.reshape(-1, width) if width > 1 else values
+
+    summary = {
+        'name': mesh.name,
+        'positions': get(mesh.vertices, 'co', np.float32, 3),
+        'loops': get(mesh.loops, 'vertex_index', np.int32),
+        'loop_total': get(mesh.polygons, 'loop_total', np.int32),
+        'smooth': get(mesh.polygons, 'use_smooth', bool),
+        'uvs': [get(layer.data, 'uv', np.float32, 2) for layer in mesh.uv_layers],
+    }
+    edges = get(mesh.edges, 'vertices', np.int32, 2)
+    sharp = get(mesh.edges, 'use_edge_sharp', bool)
+    summary['sharp_edges'] = sorted(tuple(sorted(edge)) for edge in edges[sharp].tolist())
+    return summary
+
+def assert_same_meshes(a, b):
+    assert len(a) == len(b)
+    for mesh_a, mesh_b in zip(a, b):
+        summary_a, summary_b = mesh_summary(mesh_a), mesh_summary(mesh_b)
+        assert summary_a.keys() == summary_b.keys()
+        for key in summary_a:
+            if key == 'uvs':
+                assert len(summary_a[key]) == len(summary_b[key])
+                assert all(np.allclose(x, y) for x, y in zip(summary_a[key], summary_b[key])), key
+            elif isinstance(summary_a[key], np.ndarray):
+                assert np.allclose(summary_a[key], summary_b[key]) and summary_a[key].shape == summary_b[key].shape, key
+            else:
+                assert summary_a[key] == summary_b[key], key
+
+def write_obj(tmp_path, name, content):
+    filepath = str(tmp_path / f"{name}.obj")
+    with open(filepath, 'w', encoding='utf-8', newline='') as f:
+        f.write(content)
+    return filepath
+
+@pytest.mark.parametrize("name", list(fast_files))
+def test_obj_fast_parser_matches_legacy_parser(tmp_path, name):
+    import bpy
+    bl_import_obj = importlib.import_module("mitsuba-blender.io.importer.bl_import_obj")
+
+    filepath = write_obj(tmp_path, name, fast_files[name])
+    assert bl_import_obj.parse_obj(filepath) is not None
+
+    legacy_meshes = bl_import_obj.load(filepath, use_fast_parser=False)
+    fast_meshes = bl_import_obj.load(filepath)
+    assert_same_meshes(fast_meshes, legacy_meshes)
+    for mesh in legacy_meshes + fast_meshes:
+        bpy.data.meshes.remove(mesh)
+
+@pytest.mark.parametrize("chunk_size", [7, 64])
+def test_obj_fast_parser_blocks(tmp_path, monkeypatch, chunk_size):
+    bl_import_obj = importlib.import_module("mitsuba-blender.io.importer.bl_import_obj")
+
+    filepath = write_obj(tmp_path, 'smooth_grid', fast_files['smooth_grid'])
+    mesh = bl_import_obj.parse_obj(filepath)
+    # Lines split across blocks, and blocks without a whole line
+    monkeypatch.setattr(bl_import_obj, 'OBJ_CHUNK_SIZE', chunk_size)
+    mesh_in_blocks = bl_import_obj.parse_obj(filepath)
+
+    assert mesh.keys() == mesh_in_blocks.keys()
+    for key, value in mesh.items():
+        if isinstance(value, np.ndarray):
+            assert np.array_equal(value, mesh_in_blocks[key]), key
+        else:
+            assert value == mesh_in_blocks[key], key
+
+@pytest.mark.parametrize("name", list(fallback_files))
+def test_obj_fast_parser_fallback(tmp_path, name):
+    import bpy
+    bl_import_obj = importlib.import_module("mitsuba-blender.io.importer.bl_import_obj")
+
+    filepath = write_obj(tmp_path, name, fallback_files[name])
+    assert bl_import_obj.parse_obj(filepath) is None
+
+    # Still imported, by the line-by-line parser
+    legacy_meshes = bl_import_obj.load(filepath, use_fast_parser=False)
+    meshes = bl_import_obj.load(filepath)
+    assert meshes
+    assert_same_meshes(meshes, legacy_meshes)
+    for mesh in legacy_meshes + meshes:
+        bpy.data.meshes.remove(mesh)
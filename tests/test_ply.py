@@ -0,0 +1,220 @@
+import importlib
+
+import numpy as np
+import pytest
+
+from fixtures import *
+
+@pytest.mark.parametrize("with_normals", [False, True])
+@pytest.mark.parametrize("with_uvs", [False, True])
+def test_ply_writer_loads_in_mitsuba(tmp_path, with_normals, with_uvs):
+    ply_writer = importlib.import_module("mitsuba-blender.io.exporter.ply_writer")
+    from mitsuba import load_dict, traverse
+
+    mesh = random_mesh()
+    positions, faces, normals, uvs = mesh['positions'], mesh['faces'], mesh['normals'], mesh['uvs']
+    filepath = str(tmp_path / "mesh.ply")
+    ply_writer.write_ply(filepath, positions, faces, normals if with_normals else None, uvs if with_uvs else None)
+
+    mi_mesh = load_dict({'type': 'ply', 'filename': filepath})
+    params = traverse(mi_mesh)
+    assert np.array_equal(np.array(params['vertex_positions']).reshape(-1, 3), positions)
+    assert np.array_equal(np.array(params['faces']).reshape(-1, 3), faces)
+    if with_normals:
+        assert np.allclose(np.array(params['vertex_normals']).reshape(-1, 3), normals, atol=1e-6)
+    if with_uvs:
+        assert np.array_equal(np.array(params['vertex_texcoords']).reshape(-1, 2), uvs)
+    assert mi_mesh.has_vertex_texcoords() == with_uvs
+
+def test_ply_writer_attributes_load_in_mitsuba(tmp_path):
+    ply_writer = importlib.import_module("mitsuba-blender.io.exporter.ply_writer")
+    from mitsuba import load_dict, traverse
+
+    mesh = random_mesh()
+    colors = mesh['attributes']['vertex_Col']
+    filepath = str(tmp_path / "mesh.ply")
+    ply_writer.write_ply(filepath, mesh['positions'], mesh['faces'], attributes={'vertex_Col': colors})
+
+    mi_mesh = load_dict({'type': 'ply', 'filename': filepath})
+    assert mi_mesh.has_attribute('vertex_Col')
+    assert np.array_equal(np.array(traverse(mi_mesh)['vertex_Col']).reshape(-1, 3), colors)
+
+def test_ply_writer_pool_reports_errors(tmp_path):
+    ply_writer = importlib.import_module("mitsuba-blender.io.exporter.ply_writer")
+
+    mesh = random_mesh()
+    positions, faces = mesh['positions'], mesh['faces']
+    pool = ply_writer.PlyWriterPool(2, max_pending=1)
+    for i in range(4):
+        pool.submit(ply_writer.write_ply, str(tmp_path / f"mesh{i}.ply"), positions, faces)
+    pool.submit(ply_writer.write_ply, str(tmp_path / "missing" / "mesh.ply"), positions, faces)
+    errors = pool.wait(raise_errors=False)
+
+    assert len(errors) == 1 and isinstance(errors[0], OSError)
+    assert all((tmp_path / f"mesh{i}.ply").stat().st_size > 0 for i in range(4))
+
+def write_test_ply(filepath, faces, fmt='binary_little_endian', line_sep=b'\n'):
+    '''
+    Write a PLY file with 4 vertices, uchar colors, double UVs, and an extra face property,
+    in the given format. Faces may have different lengths.
+    '''
+    import struct
+
+    byte_order = '>' if fmt == 'binary_big_endian' else '<'
+    header = [b'ply', f'format {fmt} 1.0'.encode(), b'element vertex 4',
+              b'property float x', b'property float y', b'property float z',
+              b'property uchar red', b'property uchar green', b'property uchar blue',
+              b'property double s', b'property double t',
+              f'element face {len(faces)}'.encode(), b'property list uchar int vertex_indices',
+              b'property short flags', b'end_header']
+    with open(filepath, 'wb') as f:
+        f.write(line_sep.join(header) + line_sep)
+        for i in range(4):
+            values = (i, 2 * i, 3 * i, 10 * i, 20, 30, 0.1 * i, 0.2)
+            if fmt == 'ascii':
+                f.write(b'%f %f %f %d %d %d %f %f\n' % values)
+            else:
+                f.write(struct.pack(byte_order + 'fffBBBdd', *values))
+        for face in faces:
+            if fmt == 'ascii':
+                f.write(b'%d %s 7\n' % (len(face), b' '.join(b'%d' % v for v in face)))
+            else:
+                f.write(struct.pack(byte_order + 'B%dih' % len(face), len(face), *face, 7))
+
+def assert_same_buffers(a, b):
+    assert a.keys() == b.keys()
+    for key in a:
+        if a[key] is None:
+            assert b[key] is None, key
+        else:
+            assert np.array_equal(a[key], b[key]), key
+
+def parse_per_element(bl_import_ply, monkeypatch, filepath, **kwargs):
+    # Without the block reader, every element is read one by one
+    with monkeypatch.context() as m:
+        m.setattr(bl_import_ply.ElementSpec, 'load_block', lambda *args, **kwargs: None)
+        return bl_import_ply.parse_ply_mesh(filepath, **kwargs)
+
+def test_ply_block_reader_round_trip(tmp_path, monkeypatch):
+    ply_writer = importlib.import_module("mitsuba-blender.io.exporter.ply_writer")
+    bl_import_ply = importlib.import_module("mitsuba-blender.io.importer.bl_import_ply")
+
+    mesh = random_mesh()
+    positions, faces = mesh['positions'], mesh['faces']
+    filepath = str(tmp_path / "mesh.ply")
+    ply_writer.write_ply(filepath, positions, faces, mesh['normals'], mesh['uvs'])
+
+    obj_spec, obj, _ = bl_import_ply.read(filepath)
+    # Both elements have fixed-size records
+    assert all(isinstance(obj[el.name], np.ndarray) for el in obj_spec.specs)
+
+    buffers = bl_import_ply.parse_ply_mesh(filepath)
+    assert np.array_equal(buffers['positions'], positions)
+    assert np.array_equal(buffers['loop_total'], np.full(len(faces), 3))
+    assert np.array_equal(np.sort(buffers['loops'].reshape(-1, 3), axis=1), np.sort(faces, axis=1))
+    assert_same_buffers(buffers, parse_per_element(bl_import_ply, monkeypatch, filepath))
+
+@pytest.mark.parametrize("fmt, faces, line_sep", [
+    ('binary_little_endian', [(0, 1, 2), (1, 2, 3)], b'\n'),
+    ('binary_big_endian', [(0, 1, 2, 3), (3, 2, 1, 0)], b'\n'),
+    ('binary_little_endian', [(0, 1, 2), (1, 2, 3)], b'\r\n'),
+    ('binary_little_endian', [(0, 1, 2), (0, 1, 2, 3)], b'\n'), # Mixed face sizes, read one by one
+    ('ascii', [(0, 1, 2), (0, 1, 2, 3)], b'\n'),
+])
+def test_ply_block_reader_matches_per_element_reader(tmp_path, monkeypatch, fmt, faces, line_sep):
+    bl_import_ply = importlib.import_module("mitsuba-blender.io.importer.bl_import_ply")
+
+    filepath = str(tmp_path / "mesh.ply")
+    write_test_ply(filepath, faces, fmt, line_sep)
+
+    buffers = bl_import_ply.parse_ply_mesh(filepath)
+    assert buffers is not None
+    assert np.array_equal(buffers['positions'], [[i, 2 * i, 3 * i] for i in range(4)])
+    assert np.array_equal(buffers['loop_total'], [len(face) for face in faces])
+    assert_same_buffers(buffers, parse_per_element(bl_import_ply, monkeypatch, filepath))
+
+@pytest.mark.parametrize("ply_file", ["scenes/meshes/Cube.ply"])
+def test_ply_block_reader_matches_per_element_reader_on_resource(resource_resolver, monkeypatch, ply_file):
+    bl_import_ply = importlib.import_module("mitsuba-blender.io.importer.bl_import_ply")
+
+    filepath = resource_resolver.get_absolute_resource_path(ply_file)
+    assert_same_buffers(bl_import_ply.parse_ply_mesh(filepath), parse_per_element(bl_import_ply, monkeypatch, filepath))
+
+def test_ply_new_mesh(tmp_path):
+    import bpy
+    bl_import_ply = importlib.import_module("mitsuba-blender.io.importer.bl_import_ply")
+
+    filepath = str(tmp_path / "mesh.ply")
+    write_test_ply(filepath, [(0, 1, 2), (1, 2, 3, 0)])
+    buffers = bl_import_ply.parse_ply_mesh(filepath)
+    mesh = bl_import_ply.new_mesh("mesh", **buffers)
+
+    assert (len(mesh.vertices), len(mesh.polygons), len(mesh.loops)) == (4, 2, 7)
+    positions = np.empty(3 * len(mesh.vertices), dtype=np.float32)
+    mesh.vertices.foreach_get("co", positions)
+    assert np.array_equal(positions.reshape(-1, 3), buffers['positions'])
+    loops = np.empty(len(mesh.loops), dtype=np.int32)
+    mesh.loops.foreach_get("vertex_index", loops)
+    assert np.array_equal(loops, buffers['loops'])
+    loop_total = np.empty(len(mesh.polygons), dtype=np.int32)
+    mesh.polygons.foreach_get("loop_total", loop_total)
+    assert np.array_equal(loop_total, [3, 4])
+    assert len(mesh.uv_layers) == 1
+    loop_uvs = np.empty(2 * len(mesh.loops), dtype=np.float32)
+    mesh.uv_layers[0].data.foreach_get("uv", loop_uvs)
+    assert np.allclose(loop_uvs.reshape(-1, 2), buffers['loop_uvs'])
+    assert len(mesh.vertex_colors) == 1
+
+    bpy.data.meshes.remove(mesh)
+
+def test_ply_new_mesh_validated(tmp_path):
+    import bpy
+    bl_import_ply = importlib.import_module("mitsuba-blender.io.importer.bl_import_ply")
+
+    filepath = str(tmp_path / "mesh.ply")
+    # The last face has a repeated vertex
+    write_test_ply(filepath, [(0, 1, 2), (1, 2, 3, 0), (1, 2, 2)])
+    mesh = bl_import_ply.new_mesh("mesh", **bl_import_ply.parse_ply_mesh(filepath))
+
+    assert len(mesh.polygons) == 2
+    edges = np.empty(2 * len(mesh.edges), dtype=np.int32)
+    mesh.edges.foreach_get("vertices", edges)
+    assert sorted(tuple(sorted(edge)) for edge in edges.reshape(-1, 2).tolist()) == [(0, 1), (0, 2), (0, 3), (1, 2), (2, 3)]
+
+    bpy.data.meshes.remove(mesh)
+
+def test_ply_memory_mapped_reader(tmp_path, monkeypatch):
+    ply_writer = importlib.import_module("mitsuba-blender.io.exporter.ply_writer")
+    bl_import_ply = importlib.import_module("mitsuba-blender.io.importer.bl_import_ply")
+
+    mesh = random_mesh(vertex_count=1000, face_count=3000)
+    filepath = str(tmp_path / "mesh.ply")
+    ply_writer.write_ply(filepath, mesh['positions'], mesh['faces'], mesh['normals'], mesh['uvs'])
+    # Process the arrays in several chunks
+    monkeypatch.setattr(bl_import_ply, 'CHUNK_SIZE', 256)
+
+    _, obj, _ = bl_import_ply.read(filepath, use_mmap=True)
+    assert all(isinstance(elements, np.memmap) for elements in obj.values())
+    del obj
+
+    buffers = bl_import_ply.parse_ply_mesh(filepath, use_mmap=True)
+    assert_same_buffers(buffers, bl_import_ply.parse_ply_mesh(filepath))
+    assert_same_buffers(buffers, parse_per_element(bl_import_ply, monkeypatch, filepath))
+
+@pytest.mark.parametrize("use_mmap", [False, True])
+def test_ply_proxy_mesh(tmp_path, use_mmap):
+    ply_writer = importlib.import_module("mitsuba-blender.io.exporter.ply_writer")
+    bl_import_ply = importlib.import_module("mitsuba-blender.io.importer.bl_import_ply")
+
+    mesh = random_mesh(vertex_count=1000, face_count=3000)
+    positions, faces = mesh['positions'], mesh['faces']
+    filepath = str(tmp_path / "mesh.ply")
+    ply_writer.write_ply(filepath, positions, faces, uvs=mesh['uvs'])
+
+    buffers = bl_import_ply.parse_ply_mesh(filepath, use_mmap, proxy_faces=100)
+    loops = buffers['loops'].reshape(-1, 3)
+    # One face every 30 faces, and only their vertices
+    assert len(loops) == 100
+    assert len(buffers['positions']) == len(np.unique(faces[::30]))
+    assert np.array_equal(np.sort(buffers['positions'][loops], axis=1), np.sort(positions[faces[::30]], axis=1))
+    assert len(buffers['loop_uvs']) == len(buffers['loops'])
@@ -0,0 +1,75 @@
+import importlib
+import os
+
+import pytest
+
+def scene_entries(mesh_path):
+    '''
+    Entries of a scene dict covering all the sections of the XML file, in export order.
+    Built anew for each writer, since writing the entries modifies them.
+    '''
+    from mitsuba import ScalarTransform4f
+    return [
+        ('integrator', {'type': 'path', 'max_depth': 8}),
+        ('sensor', {
+            'type': 'perspective',
+            'fov': 40.0,
+            'to_world': ScalarTransform4f.look_at(origin=[0, 0, 5], target=[0, 0, 0], up=[0, 1, 0]),
+            'film': {'type': 'hdrfilm', 'width': 64, 'height': 48},
+            'sampler': {'type': 'independent', 'sample_count': 4},
+        }),
+        ('mat-red', {'type': 'diffuse', 'reflectance': {'type': 'rgb', 'value': [0.8, 0.1, 0.1]}}),
+        ('mat-glass', {'type': 'dielectric', 'int_ior': 1.5}),
+        ('light', {'type': 'point', 'position': [0, 4, 0], 'intensity': {'type': 'rgb', 'value': [10, 10, 10]}}),
+        ('mesh-a', {'type': 'ply', 'filename': mesh_path, 'bsdf': {'type': 'ref', 'id': 'mat-red'}}),
+        ('area', {
+            'type': 'rectangle',
+            'to_world': ScalarTransform4f.translate([0, 3, 0]),
+            'emitter': {'type': 'area', 'radiance': {'type': 'rgb', 'value': [1, 1, 1]}},
+        }),
+        ('mesh-b', {'type': 'sphere', 'radius': 0.5, 'bsdf': {'type': 'ref', 'id': 'mat-glass'}}),
+    ]
+
+def read_files(directory):
+    files = {}
+    for root, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            with open(path, 'rb') as f:
+                files[os.path.relpath(path, directory)] = f.read()
+    return files
+
+@pytest.mark.parametrize("split_files", [False, True])
+def test_streaming_xml_matches_write_xml(tmp_path, split_files):
+    xml_writer = importlib.import_module("mitsuba-blender.io.exporter.xml_writer")
+    from collections import OrderedDict
+    from mitsuba.python.xml import WriteXML
+
+    mesh_path = str(tmp_path / "meshes" / "mesh.ply")
+
+    reference_dir = tmp_path / "reference"
+    reference_dir.mkdir()
+    writer = WriteXML(str(reference_dir / "scene.xml"), split_files=split_files)
+    writer.process(OrderedDict([('type', 'scene')] + scene_entries(mesh_path)))
+
+    streaming_dir = tmp_path / "streaming"
+    streaming_dir.mkdir()
+    writer = xml_writer.StreamingWriteXML(str(streaming_dir / "scene.xml"), split_files=split_files)
+    for key, value in scene_entries(mesh_path):
+        writer.add_entry(key, value)
+    writer.close()
+
+    reference_files = read_files(reference_dir)
+    assert len(reference_files) == (6 if split_files else 1)
+    assert read_files(streaming_dir) == reference_files
+
+def test_streaming_xml_unknown_ref(tmp_path):
+    xml_writer = importlib.import_module("mitsuba-blender.io.exporter.xml_writer")
+
+    writer = xml_writer.StreamingWriteXML(str(tmp_path / "scene.xml"))
+    writer.add_entry('mat-red', {'type': 'diffuse'})
+    # Refs to entries that were written before are valid, other refs are not
+    writer.add_entry('mesh-a', {'type': 'sphere', 'bsdf': {'type': 'ref', 'id': 'mat-red'}})
+    with pytest.raises(ValueError):
+        writer.add_entry('mesh-b', {'type': 'sphere', 'bsdf': {'type': 'ref', 'id': 'mat-blue'}})
+    writer.exit()